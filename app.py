@@ -5,6 +5,10 @@ import warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="spaces")
 
 import base64
+import ctypes
+import functools
+import gc
+import itertools
 import os
 import re
 import subprocess
@@ -12,27 +16,92 @@ import sys
 import threading
 import time
 from collections import OrderedDict
+from dataclasses import replace
 from io import BytesIO
 
-import gradio as gr
 import pypdfium2 as pdfium
-import spaces
-import torch
-from openai import OpenAI
 from PIL import Image
-from transformers import (
-    LightOnOcrForConditionalGeneration,
-    LightOnOcrProcessor,
-    TextIteratorStreamer,
-)
+
+from soa_extractor.crop_cache import CropCache
+from soa_extractor.document_cache import DocumentCache
+from soa_extractor.rendering import render_page, trim_image, vision_tokens
+from soa_extractor.transport import TransportCache, TransportEncoding, data_uri
+
+# torch, transformers, gradio and openai are imported where they are first
+# used, so importing this module (benchmarks, scripts) stays cheap; see
+# benchmarks/bench_import_time.py
+
+# ZeroGPU's decorator only matters on Hugging Face Spaces
+if os.environ.get("SPACE_ID"):
+    import spaces
+
+    gpu = spaces.GPU
+else:
+
+    def gpu(fn):
+        return fn
+
 
 # vLLM endpoint configuration from environment variables
 VLLM_ENDPOINT_OCR = os.environ.get("VLLM_ENDPOINT_OCR")
 VLLM_ENDPOINT_BBOX = os.environ.get("VLLM_ENDPOINT_BBOX")
+# Jittered retries of transient vLLM failures, and the cap on pages in
+# flight when a whole document is sent
+VLLM_RETRIES = int(os.environ.get("OCR_VLLM_RETRIES", "3"))
+VLLM_MAX_CONCURRENCY = int(os.environ.get("OCR_VLLM_MAX_CONCURRENCY", "8"))
+# How pages are encoded for vLLM (see soa_extractor.transport): "png"
+# (lossless, the default), "jpeg-q90", "webp-q80", "jpeg-q90-gray", ...
+# OCR_TRANSPORT_NATIVE_SIZE=1 also downsizes pages to the model's input size
+# (the processor's longest_edge, or a registry entry's "longest_edge")
+TRANSPORT_ENCODING = TransportEncoding.parse(os.environ.get("OCR_TRANSPORT_ENCODING", "png"))
+TRANSPORT_NATIVE_SIZE = os.environ.get("OCR_TRANSPORT_NATIVE_SIZE", "0") == "1"
+TRANSPORT_CACHE_BYTES = int(os.environ.get("OCR_TRANSPORT_CACHE_MB", "64")) * 1024 * 1024
+
+# Bbox crops are written once to files served by Gradio (0 = inline base64
+# PNGs, as before); OCR_CROP_DIR defaults to a temporary directory
+CROP_CACHE_BYTES = int(os.environ.get("OCR_CROP_CACHE_MB", "256")) * 1024 * 1024
+CROP_DIR = os.environ.get("OCR_CROP_DIR")
+
+# Per browser session: open PDFs and rendered pages kept between clicks
+SESSION_DOCUMENTS = int(os.environ.get("OCR_SESSION_DOCUMENTS", "2"))
+SESSION_PAGE_CACHE_BYTES = int(os.environ.get("OCR_SESSION_PAGE_CACHE_MB", "128")) * 1024 * 1024
 
 # Streaming configuration
 STREAM_YIELD_INTERVAL = 0.5  # Yield every N seconds to reduce UI overhead
 
+# Wall-clock budget for one OCR request, in seconds
+OCR_TIMEOUT_S = float(os.environ.get("OCR_TIMEOUT_S", "300"))
+# Opt-in: stop a local-model page whose output loops, and decode it once
+# more with this repetition_penalty (0 = keep the truncated text)
+REPETITION_CHECK = os.environ.get("OCR_REPETITION_CHECK", "0") == "1"
+REPETITION_RETRY_PENALTY = float(os.environ.get("OCR_REPETITION_RETRY_PENALTY", "0"))
+
+# Opt-in int8 dynamic quantisation for CPU-only hosts
+CPU_INT8 = os.environ.get("OCR_CPU_INT8", "0") == "1"
+CPU_INT8_VISION = os.environ.get("OCR_CPU_INT8_VISION", "0") == "1"
+INT8_CACHE_DIR = os.environ.get("OCR_INT8_CACHE_DIR", "int8_weights")
+
+# Pre-converted model snapshots (python -m soa_extractor.snapshot prepare) and
+# loading + warming up DEFAULT_MODEL at startup instead of on first request
+SNAPSHOT_DIR = os.environ.get("OCR_SNAPSHOT_DIR")
+WARM_UP = os.environ.get("OCR_WARM_UP", "0") == "1"
+
+# Loaded models are evicted (least recently used first) to stay within this
+# many bytes, and unloaded after this many idle seconds (0 = never). With
+# OCR_PRELOAD=1 the default model loads in the background at startup.
+MODEL_BUDGET_BYTES = int(os.environ.get("OCR_MODEL_BUDGET_MB", "10240")) * 1024 * 1024
+MODEL_IDLE_TTL_S = float(os.environ.get("OCR_MODEL_IDLE_TTL_S", "0"))
+PRELOAD = os.environ.get("OCR_PRELOAD", "0") == "1"
+
+# Opt-in per-model cache of encoded page images, so re-running a page with
+# other generation settings skips the vision tower (0 disables)
+VISION_CACHE_BYTES = int(os.environ.get("OCR_VISION_CACHE_MB", "0")) * 1024 * 1024
+
+# Micro-batching of concurrent local-model requests: requests for the same
+# model arriving within the window share one generate() (1 = off)
+BATCH_MAX_SIZE = int(os.environ.get("OCR_BATCH_MAX_SIZE", "1"))
+BATCH_WINDOW_S = float(os.environ.get("OCR_BATCH_WINDOW_MS", "20")) / 1000
+
 # Model Registry with all supported models
 MODEL_REGISTRY = {
     "LightOnOCR-2-1B (Best OCR)": {
@@ -71,25 +140,82 @@ MODEL_REGISTRY = {
 
 DEFAULT_MODEL = "LightOnOCR-2-1B (Best OCR)"
 
-device = "cuda" if torch.cuda.is_available() else "cpu"
 
-# Choose best attention implementation based on device
-if device == "cuda":
-    attn_implementation = "sdpa"
-    dtype = torch.bfloat16
-    print("Using sdpa for GPU")
-else:
-    attn_implementation = "eager"  # Best for CPU
-    dtype = torch.float32
+@functools.lru_cache(maxsize=None)
+def torch_runtime():
+    """(device, dtype, attn_implementation) for local models; imports torch."""
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+
+    # Choose best attention implementation based on device
+    if device == "cuda":
+        print("Using sdpa for GPU")
+        return device, torch.bfloat16, "sdpa"
     print("Using eager attention for CPU")
+    return device, torch.float32, "eager"  # eager is best for CPU
+
+
+def model_bytes(model):
+    """
+    Memory held by a model's parameters and buffers (int8 packed weights
+    included), counting storages shared by tied weights once.
+    """
+    import torch
+
+    storages = {}
+    tensors = list(model.state_dict(keep_vars=True).values())
+    tensors += [buffer for _, buffer in model.named_buffers()]
+    while tensors:
+        tensor = tensors.pop()
+        if isinstance(tensor, (tuple, list)):
+            # Dynamic int8 Linear layers store a (weight, bias) pair
+            tensors.extend(tensor)
+        elif isinstance(tensor, torch.Tensor):
+            storage = tensor.untyped_storage()
+            storages[storage.data_ptr()] = storage.nbytes()
+    return sum(storages.values())
 
 
 class ModelManager:
-    """Manages model loading with LRU caching and GPU memory management."""
-
-    def __init__(self, max_cached=2):
+    """
+    Caches loaded models up to a memory budget (`max_bytes`, LRU eviction).
+
+    Loads are single-flight: concurrent requests for a model that is not
+    loaded yet wait for one load instead of each starting their own. With an
+    `idle_ttl`, a background thread unloads models no request has used for
+    that many seconds. Requests already holding an evicted model keep using
+    it; its memory is released once they finish.
+    """
+
+    def __init__(
+        self,
+        max_bytes=None,
+        idle_ttl=None,
+        max_cached=None,
+        vision_cache_bytes=0,
+        batch_max_size=1,
+        batch_window_s=0.02,
+    ):
         self._cache = OrderedDict()  # {model_id: (model, processor)}
+        # Per-model state, dropped with the model
+        self._vision_caches = {}  # model_id -> VisionCache
+        self._batchers = {}  # model_id -> MicroBatcher
+        self._vision_cache_bytes = vision_cache_bytes
+        self._batch_max_size = batch_max_size
+        self._batch_window_s = batch_window_s
+        self._sizes = {}  # model_id -> bytes, kept after unloading
+        self._last_used = {}
+        self._max_bytes = max_bytes
         self._max_cached = max_cached
+        self._idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        if idle_ttl:
+            sweeper = threading.Thread(
+                target=self._sweep, name="model-idle-sweeper", daemon=True
+            )
+            sweeper.start()
 
     def get_model(self, model_name):
         """Get model and processor, loading if necessary."""
@@ -99,41 +225,239 @@ class ModelManager:
 
         model_id = config["model_id"]
 
-        # Check cache
-        if model_id in self._cache:
-            # Move to end (most recently used)
-            self._cache.move_to_end(model_id)
-            print(f"Using cached model: {model_name}")
-            return self._cache[model_id]
-
-        # Evict oldest if cache is full
-        while len(self._cache) >= self._max_cached:
-            evicted_id, (evicted_model, _) = self._cache.popitem(last=False)
-            print(f"Evicting model from cache: {evicted_id}")
-            del evicted_model
-            if device == "cuda":
-                torch.cuda.empty_cache()
+        with self._lock:
+            cached = self._lookup(model_id)
+            if cached is not None:
+                print(f"Using cached model: {model_name}")
+                return cached
+            load_lock = self._load_locks.setdefault(model_id, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                # Loaded by the request we were waiting for
+                cached = self._lookup(model_id)
+                if cached is not None:
+                    return cached
+                # Make room before loading when the size is known from an
+                # earlier load, so peak memory stays within the budget
+                evicted = self._evict(self._sizes.get(model_id, 0))
+            self._release(evicted)
+
+            model, processor = self._load(model_name, model_id)
+            size = model_bytes(model)
+
+            with self._lock:
+                self._sizes[model_id] = size
+                evicted = self._evict(size)
+                self._cache[model_id] = (model, processor)
+                self._last_used[model_id] = time.monotonic()
+                used = sum(self._sizes[key] for key in self._cache)
+            self._release(evicted)
+
+        budget = f" / {self._max_bytes / 2**20:.0f}" if self._max_bytes else ""
+        print(
+            f"Model cache: {model_name} uses {size / 2**20:.0f} MB, "
+            f"{used / 2**20:.0f}{budget} MB in use"
+        )
+        return model, processor
+
+    def _lookup(self, model_id):
+        # Caller holds self._lock
+        if model_id not in self._cache:
+            return None
+        # Move to end (most recently used)
+        self._cache.move_to_end(model_id)
+        self._last_used[model_id] = time.monotonic()
+        return self._cache[model_id]
+
+    def _evict(self, incoming_bytes):
+        """
+        Drops least recently used models until `incoming_bytes` more fit the
+        budget (and the count cap, if any). Caller holds self._lock; returns
+        the evicted ids for _release.
+        """
+        evicted = []
+        while self._cache:
+            used = sum(self._sizes[key] for key in self._cache)
+            over_bytes = self._max_bytes and used + incoming_bytes > self._max_bytes
+            over_count = self._max_cached and len(self._cache) >= self._max_cached
+            if not (over_bytes or over_count):
+                break
+            evicted_id = next(iter(self._cache))
+            self._drop(evicted_id)
+            evicted.append(evicted_id)
+        if self._max_bytes and incoming_bytes > self._max_bytes:
+            print(
+                f"Model needs {incoming_bytes / 2**20:.0f} MB, more than the "
+                f"{self._max_bytes / 2**20:.0f} MB model cache budget"
+            )
+        return evicted
+
+    def _drop(self, model_id):
+        # Caller holds self._lock
+        del self._cache[model_id]
+        self._last_used.pop(model_id, None)
+        self._vision_caches.pop(model_id, None)
+        batcher = self._batchers.pop(model_id, None)
+        if batcher is not None:
+            batcher.close()
+
+    def _release(self, evicted_ids):
+        if not evicted_ids:
+            return
+        for model_id in evicted_ids:
+            print(f"Evicting model from cache: {model_id}")
+        gc.collect()
+        device, _, _ = torch_runtime()
+        if device == "cuda":
+            import torch
+
+            torch.cuda.empty_cache()
+        elif sys.platform.startswith("linux"):
+            # glibc keeps freed heap pages; hand them back to the OS
+            try:
+                ctypes.CDLL("libc.so.6").malloc_trim(0)
+            except (OSError, AttributeError):
+                pass
+
+    def unload_idle(self):
+        """Unload models not used for idle_ttl seconds."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [
+                model_id
+                for model_id, last_used in self._last_used.items()
+                if now - last_used > self._idle_ttl
+            ]
+            for model_id in idle:
+                self._drop(model_id)
+        self._release(idle)
+
+    def _sweep(self):
+        while True:
+            time.sleep(min(60, self._idle_ttl / 2))
+            self.unload_idle()
+
+    def vision_cache(self, model_name):
+        """The model's VisionCache, or None when disabled."""
+        from soa_extractor.vision_cache import VisionCache
+
+        if not self._vision_cache_bytes:
+            return None
+        model_id = MODEL_REGISTRY[model_name]["model_id"]
+        with self._lock:
+            if model_id not in self._vision_caches:
+                self._vision_caches[model_id] = VisionCache(self._vision_cache_bytes)
+            return self._vision_caches[model_id]
+
+    def batcher(self, model_name):
+        """
+        The model's MicroBatcher, or None when batching is off or the model
+        is no longer loaded.
+        """
+        from soa_extractor.micro_batching import MicroBatcher
+
+        if self._batch_max_size <= 1:
+            return None
+        model_id = MODEL_REGISTRY[model_name]["model_id"]
+        with self._lock:
+            if model_id not in self._cache:
+                return None
+            if model_id not in self._batchers:
+                model, processor = self._cache[model_id]
+                self._batchers[model_id] = MicroBatcher(
+                    model,
+                    processor.tokenizer,
+                    window_s=self._batch_window_s,
+                    max_batch_size=self._batch_max_size,
+                )
+            return self._batchers[model_id]
+
+    def metrics(self):
+        """Memory, vision cache and micro-batching stats per loaded model."""
+        with self._lock:
+            report = {}
+            for model_id in self._cache:
+                entry = {"mb": round(self._sizes[model_id] / 2**20)}
+                if model_id in self._vision_caches:
+                    entry["vision_cache"] = self._vision_caches[model_id].stats()
+                if model_id in self._batchers:
+                    entry["batching"] = self._batchers[model_id].stats()
+                report[model_id] = entry
+            return report
+
+    def preload(self, model_name, on_loaded=None):
+        """
+        Loads `model_name` on a daemon thread, then calls
+        on_loaded(model, processor). Requests for it in the meantime wait for
+        this load rather than starting another.
+        """
+
+        def run():
+            try:
+                model, processor = self.get_model(model_name)
+                if on_loaded is not None:
+                    on_loaded(model, processor)
+            except Exception as e:
+                print(f"Preloading {model_name} failed: {e}")
+
+        thread = threading.Thread(target=run, name="model-preload", daemon=True)
+        thread.start()
+        return thread
+
+    def _load(self, model_name, model_id):
+        from transformers import LightOnOcrForConditionalGeneration, LightOnOcrProcessor
+
+        from soa_extractor.quantization import load_quantized
+        from soa_extractor.snapshot import (
+            StageTimer,
+            has_snapshot,
+            load_snapshot,
+            snapshot_path,
+        )
+
+        device, dtype, attn_implementation = torch_runtime()
 
         # Load new model
         print(f"Loading model: {model_name} ({model_id})...")
-        model = (
-            LightOnOcrForConditionalGeneration.from_pretrained(
-                model_id,
+        timer = StageTimer()
+        snapshot = snapshot_path(SNAPSHOT_DIR, model_id, dtype) if SNAPSHOT_DIR else None
+        if not has_snapshot(snapshot):
+            snapshot = None
+        if CPU_INT8 and device == "cpu":
+            with timer.stage("load int8"):
+                model = load_quantized(
+                    LightOnOcrForConditionalGeneration,
+                    model_id,
+                    cache_dir=INT8_CACHE_DIR,
+                    vision=CPU_INT8_VISION,
+                    trust_remote_code=True,
+                )
+        elif snapshot is not None:
+            model = load_snapshot(
+                LightOnOcrForConditionalGeneration,
+                snapshot,
+                device=device,
                 attn_implementation=attn_implementation,
-                torch_dtype=dtype,
-                trust_remote_code=True,
+                timer=timer,
+            )
+        else:
+            with timer.stage("from_pretrained"):
+                model = LightOnOcrForConditionalGeneration.from_pretrained(
+                    model_id,
+                    attn_implementation=attn_implementation,
+                    torch_dtype=dtype,
+                    trust_remote_code=True,
+                )
+            with timer.stage(f"to({device})"):
+                model = model.to(device).eval()
+
+        with timer.stage("processor"):
+            processor = LightOnOcrProcessor.from_pretrained(
+                snapshot or model_id, trust_remote_code=True
             )
-            .to(device)
-            .eval()
-        )
-
-        processor = LightOnOcrProcessor.from_pretrained(
-            model_id, trust_remote_code=True
-        )
 
-        # Add to cache
-        self._cache[model_id] = (model, processor)
-        print(f"Model loaded successfully: {model_name}")
+        print(f"Model loaded successfully: {model_name} ({timer.report()})")
 
         return model, processor
 
@@ -143,28 +467,73 @@ class ModelManager:
 
 
 # Initialize model manager
-model_manager = ModelManager(max_cached=2)
+model_manager = ModelManager(
+    max_bytes=MODEL_BUDGET_BYTES,
+    idle_ttl=MODEL_IDLE_TTL_S,
+    vision_cache_bytes=VISION_CACHE_BYTES,
+    batch_max_size=BATCH_MAX_SIZE,
+    batch_window_s=BATCH_WINDOW_S,
+)
 print("Model manager initialized. Models will be loaded on first use.")
 
+# Encoded pages for vLLM requests, so retries and re-sends skip the encode
+transport_cache = TransportCache(TRANSPORT_CACHE_BYTES)
+
+# Bbox crops as files, so the Markdown output links them instead of
+# carrying every crop as base64
+crop_cache = CropCache(CROP_DIR, CROP_CACHE_BYTES) if CROP_CACHE_BYTES else None
+
+
+def render_pdf_page(page, max_resolution=1540, scale=2.77, mode="fixed"):
+    """Render a PDF page to PIL Image. mode="adaptive" lowers the resolution
+    of pages whose smallest text stays legible (see soa_extractor.rendering)."""
+    return render_page(page, max_resolution=max_resolution, scale=scale, mode=mode)
+
 
-def render_pdf_page(page, max_resolution=1540, scale=2.77):
-    """Render a PDF page to PIL Image."""
-    width, height = page.get_size()
-    pixel_width = width * scale
-    pixel_height = height * scale
-    resize_factor = min(1, max_resolution / pixel_width, max_resolution / pixel_height)
-    target_scale = scale * resize_factor
-    return page.render(scale=target_scale, rev_byteorder=True).to_pil()
+@functools.lru_cache(maxsize=None)
+def image_processor_longest_edge(model_id, default=1540):
+    """`longest_edge` from the model's image processor config, without
+    loading the model (for models served by vLLM)."""
+    from transformers import AutoImageProcessor
 
+    try:
+        image_processor = AutoImageProcessor.from_pretrained(model_id)
+    except Exception as e:
+        print(f"Could not read the image processor config of {model_id}: {e}")
+        return default
+    size = getattr(image_processor, "size", None) or {}
+    return size.get("longest_edge", default)
+
+
+def processor_longest_edge(model_name, default=1540):
+    """Resize target of the model's image processor; pixels beyond it are wasted.
+    A registry "longest_edge" overrides it; vLLM models read it from the
+    model's processor config instead of loading the model locally."""
+    config = MODEL_REGISTRY.get(model_name, {})
+    if config.get("longest_edge"):
+        return config["longest_edge"]
+    if config.get("vllm_endpoint"):
+        return image_processor_longest_edge(config["model_id"], default)
+    _, processor = model_manager.get_model(model_name)
+    size = getattr(processor.image_processor, "size", None) or {}
+    return size.get("longest_edge", default)
+
+
+def process_pdf(pdf_path, page_num=1, render_mode="fixed", max_resolution=1540, documents=None):
+    """Extract a specific page from PDF. With the session's DocumentCache
+    (`documents`), the open document and earlier renders are reused."""
+    if documents is not None:
+        total_pages = documents.page_count(pdf_path)
+        page_idx = min(max(int(page_num) - 1, 0), total_pages - 1)
+        img = documents.render(pdf_path, page_idx, max_resolution=max_resolution, mode=render_mode)
+        return img, total_pages, page_idx + 1
 
-def process_pdf(pdf_path, page_num=1):
-    """Extract a specific page from PDF."""
     pdf = pdfium.PdfDocument(pdf_path)
     total_pages = len(pdf)
     page_idx = min(max(int(page_num) - 1, 0), total_pages - 1)
 
     page = pdf[page_idx]
-    img = render_pdf_page(page)
+    img = render_pdf_page(page, max_resolution=max_resolution, mode=render_mode)
 
     pdf.close()
     return img, total_pages, page_idx + 1
@@ -197,10 +566,133 @@ def clean_output_text(text):
     return cleaned
 
 
+class StreamCleaner:
+    """
+    clean_output_text() for streamed output, fed chunk by chunk.
+
+    `text` is always clean_output_text() of everything fed so far, but each
+    chunk is only looked at once: lines are kept or dropped as soon as they
+    can no longer be a bare marker, and whitespace that strip() might remove
+    is held back until a non-space character follows it. feed() returns the
+    text committed by the chunk (`text` also shows a line that may still
+    turn out to be a marker); after a chunk containing the first
+    "assistant" everything before it is dropped, `restarted` is set and the
+    return value is the new text.
+    """
+
+    MARKERS = ("system", "user", "assistant")
+
+    def __init__(self):
+        self.restarted = False
+        self._parts = []
+        self._tail = ""  # last raw characters, for an "assistant" split across chunks
+        self._after_assistant = False
+        self._line = ""  # current line while it may still be a bare marker
+        self._line_decided = False
+        self._kept_lines = 0
+        self._started = False  # a non-space character has been emitted
+        self._held = ""  # whitespace that is only emitted if text follows
+
+    @property
+    def text(self):
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return (self._parts[0] if self._parts else "") + self._tentative()
+
+    def _tentative(self):
+        # The current line while it could still be a marker, unless it is one
+        if self._after_assistant or self._line_decided:
+            return ""
+        if self._line.strip().lower() in self.MARKERS:
+            return ""
+        line = ("\n" if self._kept_lines else "") + self._line
+        if not self._started:
+            return line.strip()
+        line = line.rstrip()
+        return self._held + line if line else ""
+
+    def feed(self, chunk):
+        self.restarted = False
+        if not self._after_assistant:
+            window = self._tail + chunk
+            index = window.find("assistant")
+            if index >= 0:
+                # Same as clean_output_text: everything after the first
+                # "assistant", whatever was kept before it
+                self._after_assistant = True
+                self.restarted = True
+                self._parts, self._started, self._held = [], False, ""
+                return self._emit(window[index + len("assistant") :])
+            self._tail = window[-(len("assistant") - 1) :]
+            return self._feed_lines(chunk)
+        return self._emit(chunk)
+
+    def _feed_lines(self, chunk):
+        out = []
+        *complete, rest = chunk.split("\n")
+        for piece in complete:
+            out.append(self._extend_line(piece))
+            if not self._line_decided and self._line.strip().lower() not in self.MARKERS:
+                out.append(self._keep_line())
+            self._line, self._line_decided = "", False
+        out.append(self._extend_line(rest))
+        return "".join(out)
+
+    def _extend_line(self, piece):
+        if self._line_decided:
+            return self._emit(piece)
+        self._line += piece
+        stripped = self._line.strip().lower()
+        if any(marker.startswith(stripped) for marker in self.MARKERS):
+            return ""  # could still turn out to be a bare marker line
+        return self._keep_line()
+
+    def _keep_line(self):
+        self._line_decided = True
+        separator = "\n" if self._kept_lines else ""
+        self._kept_lines += 1
+        line, self._line = self._line, ""
+        return self._emit(separator + line)
+
+    def _emit(self, text):
+        # str.strip() of the whole output, applied as it grows
+        if not self._started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self._started = True
+        text = self._held + text
+        body = text.rstrip()
+        self._held = text[len(body) :]
+        if body:
+            self._parts.append(body)
+        return body
+
+
 # Bbox parsing pattern: ![image](image_N.png)x1,y1,x2,y2 (no space between)
 BBOX_PATTERN = r"!\[image\]\((image_\d+\.png)\)\s*(\d+),(\d+),(\d+),(\d+)"
 
 
+def _literal_prefix(literal):
+    # Regex matching any prefix of `literal`, e.g. "ab" -> a(?:b)?
+    pattern = ""
+    for char in reversed(literal[1:]):
+        pattern = f"(?:{re.escape(char)}{pattern})?"
+    return re.escape(literal[0]) + pattern
+
+
+# Tails of streamed text that may still grow into a BBOX_PATTERN match
+BBOX_PARTIAL = re.compile(
+    "|".join(
+        [
+            _literal_prefix("![image](image_"),
+            r"!\[image\]\(image_\d+(?:" + _literal_prefix(".png)") + ")?",
+            r"!\[image\]\(image_\d+\.png\)\s*(?:\d+(?:,(?:\d+(?:,(?:\d+(?:,\d*)?)?)?)?)?)?",
+        ]
+    )
+)
+
+
 def parse_bbox_output(text):
     """Parse bbox output and return cleaned text with list of detections."""
     detections = []
@@ -214,16 +706,22 @@ def parse_bbox_output(text):
     return cleaned, detections
 
 
-def crop_from_bbox(source_image, bbox, padding=5):
-    """Crop region from image based on normalized [0,1000] coords."""
+def crop_from_bbox(source_image, bbox, padding=5, region=None):
+    """Crop region from image based on normalized [0,1000] coords.
+
+    region is the (left, top, right, bottom) box of source_image the model
+    actually saw (after margin trimming); coords are relative to it.
+    """
     w, h = source_image.size
     x1, y1, x2, y2 = bbox["coords"]
+    left, top, right, bottom = region or (0, 0, w, h)
+    rw, rh = right - left, bottom - top
 
     # Convert to pixel coordinates (coords are normalized to 0-1000)
-    px1 = int(x1 * w / 1000)
-    py1 = int(y1 * h / 1000)
-    px2 = int(x2 * w / 1000)
-    py2 = int(y2 * h / 1000)
+    px1 = left + int(x1 * rw / 1000)
+    py1 = top + int(y1 * rh / 1000)
+    px2 = left + int(x2 * rw / 1000)
+    py2 = top + int(y2 * rh / 1000)
 
     # Add padding, clamp to bounds
     px1, py1 = max(0, px1 - padding), max(0, py1 - padding)
@@ -240,8 +738,15 @@ def image_to_data_uri(image):
     return f"data:image/png;base64,{b64}"
 
 
-def extract_text_via_vllm(image, model_name, temperature=0.2, stream=False, max_tokens=2048):
-    """Extract text from image using vLLM endpoint."""
+def transport_encoding(model_name):
+    """The TransportEncoding for pages sent to `model_name`'s endpoint."""
+    if TRANSPORT_NATIVE_SIZE and not TRANSPORT_ENCODING.max_edge:
+        return replace(TRANSPORT_ENCODING, max_edge=processor_longest_edge(model_name))
+    return TRANSPORT_ENCODING
+
+
+def vllm_request(image, model_name, temperature=0.2, max_tokens=2048):
+    """Endpoint and chat.completions.create() arguments for one page."""
     config = MODEL_REGISTRY.get(model_name)
     if config is None:
         raise ValueError(f"Unknown model: {model_name}")
@@ -254,14 +759,11 @@ def extract_text_via_vllm(image, model_name, temperature=0.2, stream=False, max_
 
     # Convert image to base64 data URI
     if isinstance(image, Image.Image):
-        image_uri = image_to_data_uri(image)
+        image_uri = data_uri(image, transport_encoding(model_name), transport_cache)
     else:
         # Assume it's already a data URI or URL
         image_uri = image
 
-    # Create OpenAI client pointing to vLLM endpoint
-    client = OpenAI(base_url=endpoint, api_key="not-needed")
-
     # Prepare the message with image
     messages = [
         {
@@ -271,57 +773,81 @@ def extract_text_via_vllm(image, model_name, temperature=0.2, stream=False, max_
             ],
         }
     ]
+    return endpoint, dict(
+        model=model_id,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature if temperature > 0 else 0.0,
+        top_p=0.9,
+        timeout=OCR_TIMEOUT_S,
+    )
+
+
+def extract_text_via_vllm(image, model_name, temperature=0.2, stream=False, max_tokens=2048):
+    """Extract text from image using vLLM endpoint."""
+    from soa_extractor.vllm_clients import create_with_retries, get_client
+
+    endpoint, request = vllm_request(image, model_name, temperature, max_tokens)
+    # Shared keep-alive client: no connection setup per page
+    client = get_client(endpoint)
 
     if stream:
         # Streaming response
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature if temperature > 0 else 0.0,
-            top_p=0.9,
-            stream=True,
-        )
+        response = create_with_retries(client, retries=VLLM_RETRIES, stream=True, **request)
 
-        full_text = ""
+        cleaner = StreamCleaner()
         last_yield_time = time.time()
-        for chunk in response:
-            if chunk.choices and chunk.choices[0].delta.content:
-                full_text += chunk.choices[0].delta.content
-                # Batch yields to reduce UI overhead
-                if time.time() - last_yield_time > STREAM_YIELD_INTERVAL:
-                    yield clean_output_text(full_text)
-                    last_yield_time = time.time()
+        try:
+            for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    cleaner.feed(chunk.choices[0].delta.content)
+                    # Batch yields to reduce UI overhead
+                    if time.time() - last_yield_time > STREAM_YIELD_INTERVAL:
+                        yield cleaner.text
+                        last_yield_time = time.time()
+        finally:
+            # Dropping the connection makes the server abort the request
+            # when the user clears or leaves mid-stream
+            response.close()
         # Final yield with cleaned text
-        yield clean_output_text(full_text)
+        yield cleaner.text
     else:
         # Non-streaming response
-        response = client.chat.completions.create(
-            model=model_id,
-            messages=messages,
-            max_tokens=max_tokens,
-            temperature=temperature if temperature > 0 else 0.0,
-            top_p=0.9,
-            stream=False,
-        )
+        response = create_with_retries(client, retries=VLLM_RETRIES, stream=False, **request)
 
         output_text = response.choices[0].message.content
         cleaned_text = clean_output_text(output_text)
         yield cleaned_text
 
 
-def render_bbox_with_crops(raw_output, source_image):
+def crop_markdown(source_image, bbox, region=None, image_key=None):
+    """
+    Markdown image for one detected region: a link to its cached crop file,
+    or an inline data URI when the crop cache is off. image_key is
+    CropCache.image_key(source_image), if the caller already has it.
+    """
+    if crop_cache is None:
+        cropped = crop_from_bbox(source_image, bbox, region=region)
+        return f"![Cropped region]({image_to_data_uri(cropped)})"
+    path = crop_cache.path(
+        image_key or crop_cache.image_key(source_image),
+        bbox["coords"],
+        region,
+        lambda: crop_from_bbox(source_image, bbox, region=region),
+    )
+    return f"![Cropped region](/gradio_api/file={path})"
+
+
+def render_bbox_with_crops(raw_output, source_image, region=None):
     """Replace markdown image placeholders with actual cropped images."""
     cleaned, detections = parse_bbox_output(raw_output)
+    image_key = crop_cache.image_key(source_image) if crop_cache and detections else None
 
     for bbox in detections:
         try:
-            cropped = crop_from_bbox(source_image, bbox)
-            data_uri = image_to_data_uri(cropped)
-            # Replace ![image](image_N.png) with ![Cropped](data:...)
-            cleaned = cleaned.replace(
-                f"![image]({bbox['ref']})", f"![Cropped region]({data_uri})"
-            )
+            markdown = crop_markdown(source_image, bbox, region, image_key)
+            # Replace ![image](image_N.png) with ![Cropped](...)
+            cleaned = cleaned.replace(f"![image]({bbox['ref']})", markdown)
         except Exception as e:
             print(f"Error cropping bbox {bbox}: {e}")
             # Keep original reference if cropping fails
@@ -330,18 +856,83 @@ def render_bbox_with_crops(raw_output, source_image):
     return cleaned
 
 
-@spaces.GPU
-def extract_text_from_image(image, model_name, temperature=0.2, stream=False, max_tokens=2048):
-    """Extract text from image using LightOnOCR model."""
-    # Check if model has a vLLM endpoint configured
-    config = MODEL_REGISTRY.get(model_name, {})
-    if config.get("vllm_endpoint"):
-        # Use vLLM endpoint instead of local model
-        yield from extract_text_via_vllm(image, model_name, temperature, stream, max_tokens)
-        return
-
-    # Get model and processor from cache or load
-    model, processor = model_manager.get_model(model_name)
+class BboxStreamRenderer:
+    """
+    render_bbox_with_crops() for streamed text: update() takes the whole
+    text so far and only parses what was added since the last call. Text
+    that may still grow into a bbox reference is held back until it is
+    complete. Each reference is rendered with its own box (the batch
+    version gives repeated refs the first one's crop) and crops are kept,
+    so nothing is cropped or encoded twice.
+    """
+
+    def __init__(self, source_image, region=None):
+        self.source_image = source_image
+        self.region = region
+        self._image_key = None
+        self._seen = ""  # input consumed so far (rendered or pending)
+        self._rendered = []
+        self._pending = ""
+        self._crops = {}  # (ref, coords) -> markdown
+
+    def update(self, text, final=False):
+        if text.startswith(self._seen):
+            self._pending += text[len(self._seen) :]
+        else:
+            # Not an extension of the previous text: start over
+            self._rendered, self._pending = [], text
+        self._seen = text
+
+        pending = self._pending
+        done = len(pending) if final else self._stable_end(pending)
+        if done:
+            self._rendered = ["".join(self._rendered) + self._render(pending[:done])]
+            self._pending = pending[done:]
+        return (self._rendered[0] if self._rendered else "") + self._pending_text()
+
+    def _pending_text(self):
+        # Held-back text is shown with its coordinates stripped, as the
+        # batch version would
+        return re.sub(BBOX_PATTERN, r"![image](\1)", self._pending)
+
+    def _stable_end(self, text):
+        """Length of the prefix of `text` that no later chunk can change."""
+        end = 0
+        for match in re.finditer(BBOX_PATTERN, text):
+            if match.end() == len(text):
+                return match.start()  # the last number may still grow
+            end = match.end()
+        start = text.find("!", end)
+        while start >= 0:
+            if BBOX_PARTIAL.fullmatch(text, start):
+                return start
+            start = text.find("!", start + 1)
+        return len(text)
+
+    def _render(self, text):
+        return re.sub(BBOX_PATTERN, self._crop_markdown, text)
+
+    def _crop_markdown(self, match):
+        ref, *coords = match.groups()
+        bbox = {"ref": ref, "coords": tuple(int(value) for value in coords)}
+        key = (ref, bbox["coords"])
+        if key not in self._crops:
+            try:
+                if crop_cache is not None and self._image_key is None:
+                    # Hashed once per page, on the first box
+                    self._image_key = crop_cache.image_key(self.source_image)
+                self._crops[key] = crop_markdown(self.source_image, bbox, self.region, self._image_key)
+            except Exception as e:
+                print(f"Error cropping bbox {bbox}: {e}")
+                self._crops[key] = f"![image]({ref})"
+        return self._crops[key]
+
+
+def prepare_inputs(processor, image):
+    """Chat-template a single image into model inputs on the model's device."""
+    import torch
+
+    device, dtype, _ = torch_runtime()
 
     # Prepare the chat format
     chat = [
@@ -363,7 +954,7 @@ def extract_text_from_image(image, model_name, temperature=0.2, stream=False, ma
     )
 
     # Move inputs to device AND convert to the correct dtype
-    inputs = {
+    return {
         k: v.to(device=device, dtype=dtype)
         if isinstance(v, torch.Tensor)
         and v.dtype in [torch.float32, torch.float16, torch.bfloat16]
@@ -373,56 +964,181 @@ def extract_text_from_image(image, model_name, temperature=0.2, stream=False, ma
         for k, v in inputs.items()
     }
 
-    generation_kwargs = dict(
-        **inputs,
-        max_new_tokens=max_tokens,
+
+def encoded_inputs(model_name, model, processor, image):
+    """
+    generate() inputs with the image already run through the vision tower,
+    reused from the model's VisionCache when this exact image was seen.
+    """
+    from soa_extractor.vision_cache import encode_prompt
+
+    vision_cache = model_manager.vision_cache(model_name)
+    if vision_cache is None:
+        return prepare_inputs(processor, image)
+    key = vision_cache.key(image, processor)
+    inputs = vision_cache.get(key)
+    if inputs is not None:
+        print(f"Vision cache hit: {vision_cache.stats()}")
+        return inputs
+    inputs = encode_prompt(model, prepare_inputs(processor, image))
+    vision_cache.put(key, inputs)
+    return inputs
+
+
+def warm_up_model(model, processor):
+    """Run one short generation so the first request does not pay for lazy init."""
+    from soa_extractor.snapshot import warm_up
+
+    start_time = time.time()
+    white = Image.new("RGB", (448, 448), "white")
+    warm_up(model, prepare_inputs(processor, white))
+    print(f"Warm-up done in {time.time() - start_time:.2f}s")
+
+
+@gpu
+def extract_text_from_image(image, model_name, temperature=0.2, stream=False, max_tokens=2048, request_cancel=None):
+    """Extract text from image using LightOnOCR model. `request_cancel` is a
+    CancelToken shared by the pages of one multi-page request; tripping it
+    stops this page's generation too."""
+    # Check if model has a vLLM endpoint configured
+    config = MODEL_REGISTRY.get(model_name, {})
+    if config.get("vllm_endpoint"):
+        # Use vLLM endpoint instead of local model
+        yield from extract_text_via_vllm(image, model_name, temperature, stream, max_tokens)
+        return
+
+    import gradio as gr
+    import torch
+    from transformers import TextIteratorStreamer
+
+    from soa_extractor.ocr_stopping import (
+        CancelToken,
+        DeadlineCheck,
+        RepetitionCheck,
+        StopCheckCriteria,
+        StopChecks,
+    )
+
+    # Get model and processor from cache or load
+    model, processor = model_manager.get_model(model_name)
+    inputs = encoded_inputs(model_name, model, processor, image)
+
+    # OCR_TIMEOUT_S covers the whole request, a repetition retry included
+    deadline = CancelToken(OCR_TIMEOUT_S)
+    sampling = dict(
         temperature=temperature if temperature > 0 else 0.0,
         top_p=0.9,
         top_k=0,
-        use_cache=True,
         do_sample=temperature > 0,
     )
+    stop_warnings = {
+        RepetitionCheck.REASON: (
+            "Output started repeating, so generation was stopped early. "
+            "Try a higher temperature."
+        ),
+        DeadlineCheck.TIMEOUT: (
+            f"Generation hit the {OCR_TIMEOUT_S:g}s time limit; output is truncated."
+        ),
+    }
 
-    if stream:
-        # Setup streamer for streaming generation
-        streamer = TextIteratorStreamer(
-            processor.tokenizer, skip_prompt=True, skip_special_tokens=True
+    def attempt(sampling):
+        # One decode of the page; yields partial text while streaming and
+        # returns (text, stop reason). Cut short if the output starts
+        # looping (OCR_REPETITION_CHECK), the deadline passes, the request is
+        # cancelled, or the consumer goes away (see the finally blocks below)
+        cancel = CancelToken()
+        checks = [DeadlineCheck(cancel=cancel), DeadlineCheck(cancel=deadline)]
+        if REPETITION_CHECK:
+            checks.insert(0, RepetitionCheck(processor.tokenizer))
+        if request_cancel is not None:
+            checks.append(DeadlineCheck(cancel=request_cancel))
+        stop_checks = StopChecks(checks)
+        stopping = StopCheckCriteria(stop_checks)
+        generation_kwargs = dict(
+            **inputs,
+            **sampling,
+            max_new_tokens=max_tokens,
+            use_cache=True,
+            stopping_criteria=[stopping],
         )
-        generation_kwargs["streamer"] = streamer
 
-        # Run generation in a separate thread
-        thread = threading.Thread(target=model.generate, kwargs=generation_kwargs)
-        thread.start()
+        batcher = model_manager.batcher(model_name)
+        if batcher is not None:
+            # Decoded together with other requests for this model that arrive
+            # within the batch window
+            request = batcher.submit(
+                inputs, max_new_tokens=max_tokens, sampling=sampling, stop_check=stop_checks
+            )
+            cleaner = StreamCleaner()
+            last_yield_time = time.time()
+            try:
+                for new_text in request.streamer:
+                    cleaner.feed(new_text)
+                    if stream and time.time() - last_yield_time > STREAM_YIELD_INTERVAL:
+                        yield cleaner.text
+                        last_yield_time = time.time()
+            finally:
+                # Clear or a closed session: this row stops at its next token
+                # while the rest of the batch carries on
+                cancel.cancel()
+
+            if request.error is not None:
+                raise request.error
+            return cleaner.text, request.stop_reason
+
+        if stream:
+            # Setup streamer for streaming generation
+            streamer = TextIteratorStreamer(
+                processor.tokenizer, skip_prompt=True, skip_special_tokens=True
+            )
+            generation_kwargs["streamer"] = streamer
+
+            # Run generation in a separate thread
+            thread = threading.Thread(target=model.generate, kwargs=generation_kwargs)
+            thread.start()
+
+            # Yield chunks as they arrive
+            cleaner = StreamCleaner()
+            last_yield_time = time.time()
+            try:
+                for new_text in streamer:
+                    cleaner.feed(new_text)
+                    # Batch yields to reduce UI overhead
+                    if time.time() - last_yield_time > STREAM_YIELD_INTERVAL:
+                        yield cleaner.text
+                        last_yield_time = time.time()
+            finally:
+                # Runs when Clear cancels the event or the session goes away:
+                # stop the generate thread at its next token instead of letting
+                # it decode to max_new_tokens
+                cancel.cancel()
+                thread.join()
+            return cleaner.text, stopping.reason
 
-        # Yield chunks as they arrive
-        full_text = ""
-        last_yield_time = time.time()
-        for new_text in streamer:
-            full_text += new_text
-            # Batch yields to reduce UI overhead
-            if time.time() - last_yield_time > STREAM_YIELD_INTERVAL:
-                yield clean_output_text(full_text)
-                last_yield_time = time.time()
-
-        thread.join()
-        # Final yield with cleaned text
-        yield clean_output_text(full_text)
-    else:
         # Non-streaming generation
         with torch.no_grad():
             outputs = model.generate(**generation_kwargs)
 
-        # Decode the output
+        # Decode and clean the output
         output_text = processor.decode(outputs[0], skip_special_tokens=True)
+        return clean_output_text(output_text), stopping.reason
 
-        # Clean the output
-        cleaned_text = clean_output_text(output_text)
+    text, stop_reason = yield from attempt(sampling)
+    if stop_reason == RepetitionCheck.REASON and REPETITION_RETRY_PENALTY:
+        # Same retry as OCRService and run_ocr.py: once more with a penalty
+        print(f"Output started repeating; retrying with repetition_penalty={REPETITION_RETRY_PENALTY}")
+        text, stop_reason = yield from attempt(dict(sampling, repetition_penalty=REPETITION_RETRY_PENALTY))
 
-        yield cleaned_text
+    if stop_reason in stop_warnings:
+        gr.Warning(stop_warnings[stop_reason])
+    # Final yield with cleaned text
+    yield text
 
 
-def process_input(file_input, model_name, temperature, page_num, enable_streaming, max_output_tokens):
+def process_input(file_input, model_name, temperature, page_num, enable_streaming, max_output_tokens, render_mode="fixed", trim_margins=False, documents=None):
     """Process uploaded file (image or PDF) and extract text with optional streaming."""
+    import gradio as gr
+
     if file_input is None:
         yield "Please upload an image or PDF first.", "", "", None, gr.update()
         return
@@ -435,10 +1151,15 @@ def process_input(file_input, model_name, temperature, page_num, enable_streamin
     # Handle PDF files
     if file_path.lower().endswith(".pdf"):
         try:
+            max_resolution = 1540
+            if render_mode == "adaptive":
+                max_resolution = min(max_resolution, processor_longest_edge(model_name))
             image_to_process, total_pages, actual_page = process_pdf(
-                file_path, int(page_num)
+                file_path, int(page_num), render_mode, max_resolution, documents
             )
             page_info = f"Processing page {actual_page} of {total_pages}"
+            if render_mode == "adaptive":
+                page_info += f" (rendered at {image_to_process.width}x{image_to_process.height})"
         except Exception as e:
             yield f"Error processing PDF: {str(e)}", "", "", None, gr.update()
             return
@@ -451,18 +1172,29 @@ def process_input(file_input, model_name, temperature, page_num, enable_streamin
             yield f"Error opening image: {str(e)}", "", "", None, gr.update()
             return
 
+    # Crop blank margins; the model sees `region` of the full page
+    ocr_image, region = image_to_process, None
+    if trim_margins:
+        ocr_image, region = trim_image(image_to_process)
+        saved = vision_tokens(*image_to_process.size) - vision_tokens(*ocr_image.size)
+        page_info += f" | margins trimmed, ~{saved} vision tokens saved"
+
     # Check if model has bbox capability
     model_info = MODEL_REGISTRY.get(model_name, {})
     has_bbox = model_info.get("has_bbox", False)
 
+    # For bbox models, render cropped images inline; each streamed update
+    # only parses and crops what was added since the previous one
+    renderer = BboxStreamRenderer(image_to_process, region) if has_bbox else None
+
     try:
         # Extract text using LightOnOCR with optional streaming
+        extracted_text = rendered_text = ""
         for extracted_text in extract_text_from_image(
-            image_to_process, model_name, temperature, stream=enable_streaming, max_tokens=max_output_tokens
+            ocr_image, model_name, temperature, stream=enable_streaming, max_tokens=max_output_tokens
         ):
-            # For bbox models, render cropped images inline
-            if has_bbox:
-                rendered_text = render_bbox_with_crops(extracted_text, image_to_process)
+            if renderer is not None:
+                rendered_text = renderer.update(extracted_text)
             else:
                 rendered_text = extracted_text
             yield (
@@ -473,36 +1205,317 @@ def process_input(file_input, model_name, temperature, page_num, enable_streamin
                 gr.update(),
             )
 
+        # A box at the very end is only rendered once the text is complete
+        if renderer is not None:
+            final_text = renderer.update(extracted_text, final=True)
+            if final_text != rendered_text:
+                yield final_text, extracted_text, page_info, image_to_process, gr.update()
+
     except Exception as e:
         error_msg = f"Error during text extraction: {str(e)}"
         yield error_msg, error_msg, page_info, image_to_process, gr.update()
 
 
-def update_slider_and_preview(file_input):
-    """Update page slider and preview image based on uploaded file."""
+def update_slider_and_preview(file_input, documents=None):
+    """Update page slider and preview image based on uploaded file.
+
+    Also returns the session's DocumentCache, created on first upload; the
+    PDF stays open in it for the extraction that follows.
+    """
+    import gradio as gr
+
+    if documents is None:
+        documents = DocumentCache(SESSION_DOCUMENTS, SESSION_PAGE_CACHE_BYTES)
+
     if file_input is None:
-        return gr.update(maximum=20, value=1), None
+        return gr.update(maximum=20, value=1), None, documents
 
     file_path = file_input if isinstance(file_input, str) else file_input.name
 
     if file_path.lower().endswith(".pdf"):
         try:
-            pdf = pdfium.PdfDocument(file_path)
-            total_pages = len(pdf)
-            # Render first page for preview
-            page = pdf[0]
-            preview_image = page.render(scale=2).to_pil()
-            pdf.close()
-            return gr.update(maximum=total_pages, value=1), preview_image
+            total_pages = documents.page_count(file_path)
+            # Small render of the first page; extraction renders its own
+            preview_image = documents.thumbnail(file_path, 0)
+            return gr.update(maximum=total_pages, value=1), preview_image, documents
         except:
-            return gr.update(maximum=20, value=1), None
+            return gr.update(maximum=20, value=1), None, documents
     else:
         # It's an image file
         try:
             preview_image = Image.open(file_path)
-            return gr.update(maximum=1, value=1), preview_image
+            return gr.update(maximum=1, value=1), preview_image, documents
         except:
-            return gr.update(maximum=1, value=1), None
+            return gr.update(maximum=1, value=1), None, documents
+
+
+def parse_page_range(spec, total_pages):
+    """
+    Zero-based page indexes for "all" / "" or a list like "1-5, 8, 12-",
+    1-based and inclusive. Raises ValueError for anything else.
+    """
+    spec = (spec or "").strip().lower()
+    if spec in ("", "all"):
+        return list(range(total_pages))
+    pages = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            start = int(first) if first.strip() else 1
+            end = (int(last) if last.strip() else total_pages) if dash else start
+        except ValueError:
+            raise ValueError(f"Invalid page range {part!r}, expected e.g. 1-5, 8")
+        if start < 1 or end < start:
+            raise ValueError(f"Invalid page range {part!r}")
+        pages.update(range(start - 1, min(end, total_pages)))
+    if not pages:
+        raise ValueError(f"No pages of {total_pages} in {spec!r}")
+    return sorted(pages)
+
+
+def ocr_page(image, model_name, temperature, max_tokens, request_cancel=None):
+    """Final OCR text of one page, without streaming."""
+    text = ""
+    for text in extract_text_from_image(
+        image, model_name, temperature, stream=False, max_tokens=max_tokens, request_cancel=request_cancel
+    ):
+        pass
+    return text
+
+
+def process_document(file_input, model_name, temperature, page_range, max_output_tokens, render_mode="fixed", trim_margins=False, documents=None):
+    """
+    OCR every page of the upload (or the pages in `page_range`) and show
+    each page's text as soon as it is done, labelled by page.
+
+    Rendering runs ahead of OCR on a background thread. Pages go to the
+    vLLM endpoint OCR_VLLM_MAX_CONCURRENCY at a time, or to the local model
+    one at a time (OCR_BATCH_MAX_SIZE at a time when micro-batching is on,
+    so concurrent pages share a batch).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    from soa_extractor.ocr_stopping import CancelToken
+    from soa_extractor.prefetch import prefetch
+
+    if file_input is None:
+        yield "Please upload an image or PDF first.", "", ""
+        return
+
+    file_path = file_input if isinstance(file_input, str) else file_input.name
+    is_pdf = file_path.lower().endswith(".pdf")
+    # A cache opened just for this call is closed when it ends
+    owned_documents = is_pdf and documents is None
+    if owned_documents:
+        documents = DocumentCache(SESSION_DOCUMENTS, SESSION_PAGE_CACHE_BYTES)
+
+    try:
+        total_pages = documents.page_count(file_path) if is_pdf else 1
+        pages = parse_page_range(page_range, total_pages)
+    except Exception as e:
+        if owned_documents:
+            documents.close()
+        yield f"Error processing file: {str(e)}", "", ""
+        return
+
+    max_resolution = 1540
+    if render_mode == "adaptive":
+        max_resolution = min(max_resolution, processor_longest_edge(model_name))
+
+    def render(page_index):
+        if is_pdf:
+            image = documents.render(file_path, page_index, max_resolution=max_resolution, mode=render_mode)
+        else:
+            image = Image.open(file_path)
+            image.load()
+        ocr_image, region = trim_image(image) if trim_margins else (image, None)
+        return page_index, image, ocr_image, region
+
+    if MODEL_REGISTRY[model_name].get("vllm_endpoint"):
+        concurrency = VLLM_MAX_CONCURRENCY
+    else:
+        concurrency = max(1, BATCH_MAX_SIZE)
+    has_bbox = MODEL_REGISTRY[model_name].get("has_bbox", False)
+
+    results = {}  # page index -> (rendered markdown, raw text)
+    start_time = time.time()
+
+    def show(last_page):
+        # Finished pages in page order, whatever order they finished in
+        order = sorted(results)
+        rendered = "\n\n".join(f"### Page {index + 1}\n\n{results[index][0]}" for index in order)
+        raw = "\n\n".join(f"<!-- Page {index + 1} -->\n{results[index][1]}" for index in order)
+        info = (
+            f"{len(results)} of {len(pages)} pages done (last: page {last_page + 1}) "
+            f"in {time.time() - start_time:.1f}s"
+        )
+        return rendered, raw, info
+
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="document-ocr")
+    # Shared by every page, so Clear also stops the pages mid-generation
+    request_cancel = CancelToken()
+    pending = {}  # future -> (page index, page image, region)
+    rendered_pages = prefetch(render, pages, depth=concurrency)
+    try:
+        yield "*Extracting...*", "", f"0 of {len(pages)} pages done"
+        exhausted = False
+        while pending or not exhausted:
+            # Keep `concurrency` pages in flight; rendering stays ahead
+            filling = not exhausted and len(pending) < concurrency
+            if filling:
+                try:
+                    page_index, image, ocr_image, region = next(rendered_pages)
+                    future = executor.submit(
+                        ocr_page, ocr_image, model_name, temperature, max_output_tokens, request_cancel
+                    )
+                    pending[future] = (page_index, image, region)
+                except StopIteration:
+                    exhausted = True
+            if not pending:
+                continue
+
+            # While filling, only pick up pages that are already done
+            done, _ = wait(pending, timeout=0 if filling else None, return_when=FIRST_COMPLETED)
+            for future in done:
+                page_index, image, region = pending.pop(future)
+                try:
+                    text = future.result()
+                    rendered = render_bbox_with_crops(text, image, region) if has_bbox else text
+                except Exception as e:
+                    text = rendered = f"*Error during text extraction: {str(e)}*"
+                results[page_index] = (rendered, text)
+                yield show(page_index)
+    except Exception as e:
+        yield f"Error processing document: {str(e)}", "", ""
+    finally:
+        # Clear or a closed session: drop the pages not started yet and stop
+        # the local generations of those in flight at their next token
+        request_cancel.cancel()
+        rendered_pages.close()
+        executor.shutdown(wait=False, cancel_futures=True)
+        if owned_documents:
+            documents.close()
+
+
+def ocr_page_with_stats(image, model_name, temperature, max_tokens):
+    """
+    (text, seconds, generated tokens) for one page, without streaming. A
+    local model should already be loaded so that loading is not timed.
+    """
+    if MODEL_REGISTRY[model_name].get("vllm_endpoint"):
+        from soa_extractor.vllm_clients import create_with_retries, get_client
+
+        endpoint, request = vllm_request(image, model_name, temperature, max_tokens)
+        start_time = time.perf_counter()
+        response = create_with_retries(get_client(endpoint), retries=VLLM_RETRIES, stream=False, **request)
+        latency = time.perf_counter() - start_time
+        usage = getattr(response, "usage", None)
+        tokens = usage.completion_tokens if usage else None
+        return clean_output_text(response.choices[0].message.content), latency, tokens
+
+    start_time = time.perf_counter()
+    text = ocr_page(image, model_name, temperature, max_tokens)
+    latency = time.perf_counter() - start_time
+    # Re-tokenised output: the generated tokens minus special tokens
+    _, processor = model_manager.get_model(model_name)
+    tokens = len(processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+    return text, latency, tokens
+
+
+def compare_models(file_path, model_names, page_range="1", temperature=0.0, max_tokens=2048, documents=None):
+    """
+    Runs each of `model_names` over the same pages and yields a PageRun per
+    (model, page). Pages are rendered once up front. Models run one after
+    the other, each loaded through model_manager (so OCR_MODEL_BUDGET_MB
+    evicts earlier ones as needed) and warmed up before its pages are timed;
+    loading and warm-up are timed separately.
+    """
+    from soa_extractor.model_comparison import PageRun
+
+    if file_path.lower().endswith(".pdf"):
+        owned = documents is None
+        if owned:
+            documents = DocumentCache(SESSION_DOCUMENTS, SESSION_PAGE_CACHE_BYTES)
+        try:
+            indexes = parse_page_range(page_range, documents.page_count(file_path))
+            pages = [(index, documents.render(file_path, index)) for index in indexes]
+        finally:
+            # Rendered pages outlive the cache; only the PDF is closed
+            if owned:
+                documents.close()
+    else:
+        image = Image.open(file_path)
+        image.load()
+        pages = [(0, image)]
+
+    for model_name in model_names:
+        load_s = warm_up_s = 0.0
+        if not MODEL_REGISTRY[model_name].get("vllm_endpoint"):
+            start_time = time.perf_counter()
+            model, processor = model_manager.get_model(model_name)
+            load_s = time.perf_counter() - start_time
+            start_time = time.perf_counter()
+            warm_up_model(model, processor)
+            warm_up_s = time.perf_counter() - start_time
+        for page_index, image in pages:
+            run = PageRun(model=model_name, page=page_index, load_s=load_s, warm_up_s=warm_up_s)
+            load_s = warm_up_s = 0.0
+            try:
+                run.text, run.latency_s, run.tokens = ocr_page_with_stats(
+                    image, model_name, temperature, max_tokens
+                )
+            except Exception as e:
+                run.error = str(e)
+            yield run
+
+
+def process_comparison(file_input, model_names, page_range, max_output_tokens, documents=None):
+    """Compare tab: the chosen models over the same pages, at temperature 0."""
+    from soa_extractor.model_comparison import (
+        format_markdown,
+        pairwise_similarity,
+        summarize,
+        unified_diffs,
+    )
+
+    if file_input is None:
+        yield "Please upload an image or PDF in the Extract tab first.", "", ""
+        return
+    if not model_names:
+        yield "Select at least one model.", "", ""
+        return
+
+    file_path = file_input if isinstance(file_input, str) else file_input.name
+    runs = []
+    try:
+        for run in compare_models(file_path, model_names, page_range, 0.0, max_output_tokens, documents):
+            runs.append(run)
+            if run.error is None:
+                info = f"{run.model}: page {run.page + 1} in {run.latency_s:.1f}s"
+            else:
+                info = f"{run.model}: page {run.page + 1} failed: {run.error}"
+            yield format_markdown(summarize(runs, model_names), pairwise_similarity(runs, model_names)), "", info
+    except Exception as e:
+        yield f"Error during comparison: {str(e)}", "", ""
+        return
+
+    pairs = pairwise_similarity(runs, model_names)
+    diffs = "\n\n".join(
+        unified_diffs(runs, a, b) or f"{a} and {b}: identical output"
+        if (a, b) in pairs
+        else f"{a} and {b}: no page both models got through"
+        for a, b in itertools.combinations(model_names, 2)
+    )
+    yield format_markdown(summarize(runs, model_names), pairs), diffs, f"Done: {len(runs)} runs"
+
+
+def close_documents(documents):
+    """Session end: close the session's open PDFs."""
+    if documents is not None:
+        documents.close()
 
 
 # Helper function to get model info text
@@ -517,9 +1530,18 @@ def get_model_info_text(model_name):
     return f"**Description:** {info.get('description', 'N/A')}\n**Bounding Box Detection:** {has_bbox}"
 
 
-# Create Gradio interface
-with gr.Blocks(title="LightOnOCR-2 Multi-Model OCR") as demo:
-    gr.Markdown(f"""
+def build_demo():
+    """Build the Gradio interface."""
+    import gradio as gr
+
+    device, _, attn_implementation = torch_runtime()
+
+    if crop_cache is not None:
+        # Bbox crops are linked from the output as /gradio_api/file=<path>
+        gr.set_static_paths(paths=[crop_cache.directory])
+
+    with gr.Blocks(title="LightOnOCR-2 Multi-Model OCR") as demo:
+        gr.Markdown(f"""
 # LightOnOCR-2 — Efficient 1B VLM for OCR
 
 State-of-the-art OCR on OlmOCR-Bench, ~9× smaller and faster than competitors. Handles tables, forms, math, multi-column layouts.
@@ -533,152 +1555,244 @@ State-of-the-art OCR on OlmOCR-Bench, ~9× smaller and faster than competitors.
 **How to use:** Select a model → Upload image/PDF → Click "Extract Text" | **Device:** {device.upper()} | **Attention:** {attn_implementation}
 """)
 
-    with gr.Row():
-        with gr.Column(scale=1):
-            model_selector = gr.Dropdown(
-                choices=list(MODEL_REGISTRY.keys()),
-                value=DEFAULT_MODEL,
-                label="Model",
-                info="Select OCR model variant",
-            )
-            model_info = gr.Markdown(
-                value=get_model_info_text(DEFAULT_MODEL), label="Model Info"
-            )
-            file_input = gr.File(
-                label="Upload Image or PDF",
-                file_types=[".pdf", ".png", ".jpg", ".jpeg"],
-                type="filepath",
-            )
-            rendered_image = gr.Image(
-                label="Preview", type="pil", height=400, interactive=False
+        with gr.Tab("Extract"):
+            with gr.Row():
+                with gr.Column(scale=1):
+                    model_selector = gr.Dropdown(
+                        choices=list(MODEL_REGISTRY.keys()),
+                        value=DEFAULT_MODEL,
+                        label="Model",
+                        info="Select OCR model variant",
+                    )
+                    model_info = gr.Markdown(
+                        value=get_model_info_text(DEFAULT_MODEL), label="Model Info"
+                    )
+                    file_input = gr.File(
+                        label="Upload Image or PDF",
+                        file_types=[".pdf", ".png", ".jpg", ".jpeg"],
+                        type="filepath",
+                    )
+                    rendered_image = gr.Image(
+                        label="Preview", type="pil", height=400, interactive=False
+                    )
+                    num_pages = gr.Slider(
+                        minimum=1,
+                        maximum=20,
+                        value=1,
+                        step=1,
+                        label="PDF: Page Number",
+                        info="Select which page to extract",
+                    )
+                    page_range = gr.Textbox(
+                        label="PDF: Pages for Whole Document",
+                        value="all",
+                        info='"all" or a list such as 1-5, 8, 12-',
+                    )
+                    render_mode = gr.Radio(
+                        choices=[("Fixed", "fixed"), ("Adaptive", "adaptive")],
+                        value="fixed",
+                        label="PDF: Render Resolution",
+                        info="Adaptive renders sparse, large-type pages at lower resolution (fewer vision tokens)",
+                    )
+                    trim_margins = gr.Checkbox(
+                        label="Trim Margins",
+                        value=False,
+                        info="Crop blank page margins before OCR (fewer vision tokens)",
+                    )
+                    page_info = gr.Textbox(label="Processing Info", value="", interactive=False)
+                    temperature = gr.Slider(
+                        minimum=0.0,
+                        maximum=1.0,
+                        value=0.2,
+                        step=0.05,
+                        label="Temperature",
+                        info="0.0 = deterministic, Higher = more varied",
+                    )
+                    enable_streaming = gr.Checkbox(
+                        label="Enable Streaming",
+                        value=True,
+                        info="Show text progressively as it's generated",
+                    )
+                    max_output_tokens = gr.Slider(
+                        minimum=256,
+                        maximum=8192,
+                        value=2048,
+                        step=256,
+                        label="Max Output Tokens",
+                        info="Maximum number of tokens to generate",
+                    )
+                    submit_btn = gr.Button("Extract Text", variant="primary")
+                    document_btn = gr.Button("Extract Whole Document", variant="primary")
+                    clear_btn = gr.Button("Clear", variant="secondary")
+
+                with gr.Column(scale=2):
+                    output_text = gr.Markdown(
+                        label="📄 Extracted Text (Rendered)",
+                        value="*Extracted text will appear here...*",
+                        latex_delimiters=[
+                            {"left": "$$", "right": "$$", "display": True},
+                            {"left": "$", "right": "$", "display": False},
+                        ],
+                    )
+
+            # Example inputs with image previews
+            EXAMPLE_IMAGES = [
+                "examples/example_1.png",
+                "examples/example_2.png",
+                "examples/example_3.png",
+                "examples/example_4.png",
+                "examples/example_5.png",
+                "examples/example_6.png",
+                "examples/example_7.png",
+                "examples/example_8.png",
+                "examples/example_9.png",
+            ]
+
+            with gr.Accordion("📁 Example Documents (click an image to load)", open=True):
+                example_gallery = gr.Gallery(
+                    value=EXAMPLE_IMAGES,
+                    columns=5,
+                    rows=2,
+                    height="auto",
+                    object_fit="contain",
+                    show_label=False,
+                    allow_preview=False,
+                )
+
+            def load_example_image(evt: gr.SelectData):
+                """Load selected example image into file input."""
+                return EXAMPLE_IMAGES[evt.index]
+
+            example_gallery.select(
+                fn=load_example_image,
+                outputs=[file_input],
             )
-            num_pages = gr.Slider(
-                minimum=1,
-                maximum=20,
-                value=1,
-                step=1,
-                label="PDF: Page Number",
-                info="Select which page to extract",
-            )
-            page_info = gr.Textbox(label="Processing Info", value="", interactive=False)
-            temperature = gr.Slider(
-                minimum=0.0,
-                maximum=1.0,
-                value=0.2,
-                step=0.05,
-                label="Temperature",
-                info="0.0 = deterministic, Higher = more varied",
-            )
-            enable_streaming = gr.Checkbox(
-                label="Enable Streaming",
-                value=True,
-                info="Show text progressively as it's generated",
-            )
-            max_output_tokens = gr.Slider(
-                minimum=256,
-                maximum=8192,
-                value=2048,
-                step=256,
-                label="Max Output Tokens",
-                info="Maximum number of tokens to generate",
-            )
-            submit_btn = gr.Button("Extract Text", variant="primary")
-            clear_btn = gr.Button("Clear", variant="secondary")
-
-        with gr.Column(scale=2):
-            output_text = gr.Markdown(
-                label="📄 Extracted Text (Rendered)",
-                value="*Extracted text will appear here...*",
-                latex_delimiters=[
-                    {"left": "$$", "right": "$$", "display": True},
-                    {"left": "$", "right": "$", "display": False},
-                ],
+
+            with gr.Row():
+                with gr.Column():
+                    raw_output = gr.Textbox(
+                        label="Raw Markdown Output",
+                        placeholder="Raw text will appear here...",
+                        lines=20,
+                        max_lines=30,
+                    )
+
+        with gr.Tab("Compare Models"):
+            gr.Markdown(
+                "Runs the selected models over the same pages of the file uploaded in the "
+                "Extract tab (temperature 0) and compares speed and output."
             )
+            with gr.Row():
+                with gr.Column(scale=1):
+                    compare_models_selector = gr.CheckboxGroup(
+                        choices=list(MODEL_REGISTRY.keys()),
+                        value=[DEFAULT_MODEL, "LightOnOCR-2-1B-ocr-soup"],
+                        label="Models",
+                        info="Loaded one at a time within the model memory budget",
+                    )
+                    compare_pages = gr.Textbox(
+                        label="PDF: Pages",
+                        value="1",
+                        info='"all" or a list such as 1-5, 8, 12-',
+                    )
+                    compare_max_tokens = gr.Slider(
+                        minimum=256,
+                        maximum=8192,
+                        value=2048,
+                        step=256,
+                        label="Max Output Tokens",
+                    )
+                    compare_btn = gr.Button("Run Comparison", variant="primary")
+                    compare_info = gr.Textbox(label="Progress", value="", interactive=False)
+                with gr.Column(scale=2):
+                    compare_summary = gr.Markdown(value="*Results will appear here...*")
+                    compare_diffs = gr.Code(label="Pairwise Diffs", language=None, lines=20)
+
+        with gr.Accordion("Server metrics", open=False):
+            metrics_output = gr.JSON(label="Loaded models")
+            metrics_btn = gr.Button("Refresh", variant="secondary")
+
+        # Open PDFs and rendered pages of this browser session
+        documents = gr.State(None, delete_callback=close_documents)
+
+        # Event handlers
+        submit_event = submit_btn.click(
+            fn=process_input,
+            inputs=[file_input, model_selector, temperature, num_pages, enable_streaming, max_output_tokens, render_mode, trim_margins, documents],
+            outputs=[output_text, raw_output, page_info, rendered_image, num_pages],
+        )
 
-    # Example inputs with image previews
-    EXAMPLE_IMAGES = [
-        "examples/example_1.png",
-        "examples/example_2.png",
-        "examples/example_3.png",
-        "examples/example_4.png",
-        "examples/example_5.png",
-        "examples/example_6.png",
-        "examples/example_7.png",
-        "examples/example_8.png",
-        "examples/example_9.png",
-    ]
+        document_event = document_btn.click(
+            fn=process_document,
+            inputs=[file_input, model_selector, temperature, page_range, max_output_tokens, render_mode, trim_margins, documents],
+            outputs=[output_text, raw_output, page_info],
+        )
 
-    with gr.Accordion("📁 Example Documents (click an image to load)", open=True):
-        example_gallery = gr.Gallery(
-            value=EXAMPLE_IMAGES,
-            columns=5,
-            rows=2,
-            height="auto",
-            object_fit="contain",
-            show_label=False,
-            allow_preview=False,
+        compare_event = compare_btn.click(
+            fn=process_comparison,
+            inputs=[file_input, compare_models_selector, compare_pages, compare_max_tokens, documents],
+            outputs=[compare_summary, compare_diffs, compare_info],
         )
 
-    def load_example_image(evt: gr.SelectData):
-        """Load selected example image into file input."""
-        return EXAMPLE_IMAGES[evt.index]
+        file_input.change(
+            fn=update_slider_and_preview,
+            inputs=[file_input, documents],
+            outputs=[num_pages, rendered_image, documents],
+        )
 
-    example_gallery.select(
-        fn=load_example_image,
-        outputs=[file_input],
-    )
+        model_selector.change(
+            fn=get_model_info_text, inputs=[model_selector], outputs=[model_info]
+        )
 
-    with gr.Row():
-        with gr.Column():
-            raw_output = gr.Textbox(
-                label="Raw Markdown Output",
-                placeholder="Raw text will appear here...",
-                lines=20,
-                max_lines=30,
-            )
+        clear_btn.click(
+            fn=lambda: (
+                None,
+                DEFAULT_MODEL,
+                get_model_info_text(DEFAULT_MODEL),
+                "*Extracted text will appear here...*",
+                "",
+                "",
+                None,
+                1,
+                2048,
+            ),
+            outputs=[
+                file_input,
+                model_selector,
+                model_info,
+                output_text,
+                raw_output,
+                page_info,
+                rendered_image,
+                num_pages,
+                max_output_tokens,
+            ],
+            # Stop an OCR or comparison still running for the previous upload
+            cancels=[submit_event, document_event, compare_event],
+        )
 
-    # Event handlers
-    submit_btn.click(
-        fn=process_input,
-        inputs=[file_input, model_selector, temperature, num_pages, enable_streaming, max_output_tokens],
-        outputs=[output_text, raw_output, page_info, rendered_image, num_pages],
-    )
+        metrics_btn.click(fn=model_manager.metrics, outputs=[metrics_output], api_name="metrics")
 
-    file_input.change(
-        fn=update_slider_and_preview,
-        inputs=[file_input],
-        outputs=[num_pages, rendered_image],
-    )
+    return demo
 
-    model_selector.change(
-        fn=get_model_info_text, inputs=[model_selector], outputs=[model_info]
-    )
 
-    clear_btn.click(
-        fn=lambda: (
-            None,
-            DEFAULT_MODEL,
-            get_model_info_text(DEFAULT_MODEL),
-            "*Extracted text will appear here...*",
-            "",
-            "",
-            None,
-            1,
-            2048,
-        ),
-        outputs=[
-            file_input,
-            model_selector,
-            model_info,
-            output_text,
-            raw_output,
-            page_info,
-            rendered_image,
-            num_pages,
-            max_output_tokens,
-        ],
-    )
+def __getattr__(name):
+    # `gradio app.py` (reload mode) looks the interface up as app.demo
+    if name == "demo":
+        globals()["demo"] = build_demo()
+        return globals()["demo"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 if __name__ == "__main__":
-    demo.launch(theme=gr.themes.Soft(), ssr_mode=False)
+    import gradio as gr
+
+    if not MODEL_REGISTRY[DEFAULT_MODEL].get("vllm_endpoint"):
+        if PRELOAD:
+            # The UI comes up right away; early requests wait on this load
+            model_manager.preload(
+                DEFAULT_MODEL, on_loaded=warm_up_model if WARM_UP else None
+            )
+        elif WARM_UP:
+            warm_up_model(*model_manager.get_model(DEFAULT_MODEL))
+    build_demo().launch(theme=gr.themes.Soft(), ssr_mode=False)
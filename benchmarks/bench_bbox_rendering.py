@@ -0,0 +1,110 @@
+"""
+Bbox crop rendering during streaming: per-yield latency and Markdown payload.
+
+Replays a synthetic bbox-model stream over a page and renders the output at
+every yield the way the demo does:
+
+- "full, inline": re-parse the whole text and inline every crop as a base64
+  PNG at every yield (the previous behaviour)
+- "incremental, inline": BboxStreamRenderer, crops still inlined
+- "incremental, files": BboxStreamRenderer with crops in the CropCache,
+  linked as Gradio static files
+
+Payload is the length of the Markdown value sent for a yield.
+
+Usage:
+    python benchmarks/bench_bbox_rendering.py
+    python benchmarks/bench_bbox_rendering.py --input datasets/0218.pdf --tokens 8000 --boxes 30
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+import app
+from soa_extractor.crop_cache import CropCache
+
+
+def synthetic_stream(tokens, boxes, seed=0):
+    """Token strings of a bbox model's output with `boxes` figures spread through it."""
+    rng = random.Random(seed)
+    words = ["| ", "Invoice ", "12,500.00 ", "\n", "Total ", "| --- ", "Date ", "01/02/2025 "]
+    every = max(1, tokens // max(1, boxes))
+    stream = []
+    for index in range(tokens):
+        if boxes and index % every == 0 and len([t for t in stream if t.startswith("![")]) < boxes:
+            x1, y1 = rng.randint(0, 700), rng.randint(0, 800)
+            stream += [f"![image](image_{index // every + 1}.png)", f"{x1},{y1},{x1 + 250},{y1 + 150}", "\n"]
+        stream.append(rng.choice(words))
+    return stream
+
+
+def load_page(path):
+    if path is None:
+        return Image.new("RGB", (1190, 1540), "white")
+    if path.lower().endswith(".pdf"):
+        return app.render_pdf_page(pdfium.PdfDocument(path)[0])
+    return Image.open(path).convert("RGB")
+
+
+def replay(stream, page, mode, yield_every):
+    renderer = None if mode == "full" else app.BboxStreamRenderer(page)
+    latencies, payloads = [], []
+    text = ""
+    for index, token in enumerate(stream, 1):
+        text += token
+        if index % yield_every and index != len(stream):
+            continue
+        start = time.perf_counter()
+        if renderer is None:
+            rendered = app.render_bbox_with_crops(text, page)
+        else:
+            rendered = renderer.update(text, final=index == len(stream))
+        latencies.append(time.perf_counter() - start)
+        payloads.append(len(rendered))
+    return latencies, payloads
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default=None, help="PDF or image page (default: blank page)")
+    parser.add_argument("--tokens", type=int, default=4000)
+    parser.add_argument("--boxes", type=int, default=20)
+    parser.add_argument("--yield-every", type=int, default=16, help="Tokens between yields")
+    args = parser.parse_args()
+
+    page = load_page(args.input)
+    stream = synthetic_stream(args.tokens, args.boxes)
+    print(f"{args.tokens} tokens, {args.boxes} boxes, page {page.width}x{page.height}, yield every {args.yield_every} tokens")
+
+    modes = [
+        ("full, inline", "full", None),
+        ("incremental, inline", "incremental", None),
+        ("incremental, files", "incremental", CropCache(tempfile.mkdtemp(prefix="bench_crops_"))),
+    ]
+    print(
+        f"{'mode':<22} {'total s':>8} {'mean ms':>8} {'p95 ms':>8} {'max ms':>8} "
+        f"{'final KB':>9} {'all yields MB':>14}"
+    )
+    for name, mode, cache in modes:
+        app.crop_cache = cache
+        latencies, payloads = replay(stream, page, mode, args.yield_every)
+        p95 = statistics.quantiles(latencies, n=20)[-1] if len(latencies) > 1 else latencies[0]
+        print(
+            f"{name:<22} {sum(latencies):>8.2f} {statistics.mean(latencies) * 1000:>8.2f} "
+            f"{p95 * 1000:>8.2f} {max(latencies) * 1000:>8.2f} {payloads[-1] / 1024:>9.1f} "
+            f"{sum(payloads) / 2**20:>14.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Side-by-side model comparison: the same pages through several models.
+
+Pages are rendered once and shared by every model. Models run one after
+the other through app.py's ModelManager, so --budget-mb (OCR_MODEL_BUDGET_MB)
+decides which of them stay resident; each local model is loaded and warmed
+up before its pages are timed (reported as load s and warm-up s). Temperature is 0 by
+default so that differences come from the models, not from sampling.
+
+Reports per model: pages, failures, load and warm-up time, mean latency, generated
+tokens and tokens/s, mean output length; per model pair: mean word-level
+similarity of the outputs.
+
+Usage:
+    python benchmarks/bench_compare_models.py --input datasets/0218.pdf --pages 1-3
+    python benchmarks/bench_compare_models.py --input examples/example_1.png --models "LightOnOCR-2-1B (Best OCR),LightOnOCR-2-1B-ocr-soup" --diff
+    python benchmarks/bench_compare_models.py --input datasets/0218.pdf --pages all --budget-mb 4096 --json results.json
+"""
+
+import argparse
+import dataclasses
+import itertools
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def resolve_models(spec, registry):
+    """Registry keys or model ids, comma-separated; all registry models if empty."""
+    if not spec:
+        return list(registry)
+    names = []
+    for item in (part.strip() for part in spec.split(",")):
+        if item in registry:
+            names.append(item)
+            continue
+        matches = [name for name, config in registry.items() if config["model_id"] == item]
+        if not matches:
+            raise SystemExit(f"Unknown model {item!r}; choose from: {', '.join(registry)}")
+        names.append(matches[0])
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", required=True, help="PDF or image")
+    parser.add_argument("--models", default="", help="Comma-separated registry names or model ids (default: all)")
+    parser.add_argument("--pages", default="1", help='PDF pages, e.g. "1-3,8" or "all"')
+    parser.add_argument("--max-tokens", type=int, default=2048)
+    parser.add_argument("--temperature", type=float, default=0.0)
+    parser.add_argument("--budget-mb", type=int, default=None, help="Model memory budget (OCR_MODEL_BUDGET_MB)")
+    parser.add_argument("--json", default=None, help="Write every page run and the summary to this file")
+    parser.add_argument("--diff", action="store_true", help="Print line diffs for every model pair")
+    args = parser.parse_args()
+
+    # Read by app.py at import
+    if args.budget_mb is not None:
+        os.environ["OCR_MODEL_BUDGET_MB"] = str(args.budget_mb)
+
+    import app
+    from soa_extractor.model_comparison import pairwise_similarity, summarize, unified_diffs
+
+    models = resolve_models(args.models, app.MODEL_REGISTRY)
+    runs = []
+    for run in app.compare_models(args.input, models, args.pages, args.temperature, args.max_tokens):
+        runs.append(run)
+        status = f"{run.latency_s:.2f}s" if run.error is None else f"failed: {run.error}"
+        print(f"{run.model}: page {run.page + 1} {status}")
+
+    summary = summarize(runs, models)
+    pairs = pairwise_similarity(runs, models)
+    width = max(len(model) for model in models)
+    print()
+    print(
+        f"{'model':<{width}} {'pages':>5} {'errors':>6} {'load s':>7} {'warm-up s':>9} {'latency s':>9} "
+        f"{'tokens':>7} {'tokens/s':>8} {'chars':>6}"
+    )
+    for row in summary:
+        cells = [
+            "-" if row[key] is None else str(row[key])
+            for key in ("pages", "errors", "load_s", "warm_up_s", "mean_latency_s", "tokens", "tokens_per_s", "mean_chars")
+        ]
+        print(
+            f"{row['model']:<{width}} {cells[0]:>5} {cells[1]:>6} {cells[2]:>7} {cells[3]:>9} {cells[4]:>9} "
+            f"{cells[5]:>7} {cells[6]:>8} {cells[7]:>6}"
+        )
+    if pairs:
+        print()
+        for (a, b), score in pairs.items():
+            print(f"{score:.3f}  {a} vs {b}")
+
+    if args.diff:
+        for a, b in itertools.combinations(models, 2):
+            print()
+            print(unified_diffs(runs, a, b) or f"{a} and {b}: identical output")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "input": args.input,
+                    "pages": args.pages,
+                    "runs": [dataclasses.asdict(run) for run in runs],
+                    "summary": summary,
+                    "pairs": [{"a": a, "b": b, "similarity": score} for (a, b), score in pairs.items()],
+                },
+                f,
+                indent=2,
+                ensure_ascii=False,
+            )
+        print(f"\nWrote {args.json}")
+
+
+if __name__ == "__main__":
+    main()
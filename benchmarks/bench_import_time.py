@@ -0,0 +1,121 @@
+"""
+Import-time budget for every entry point, measured with `python -X importtime`.
+
+Each entry point is imported in a fresh interpreter `--repeat` times and the
+fastest run is kept (the first run also warms the bytecode and OS file
+caches). Exits non-zero when an entry point is over its budget, so it can
+run as a CI step.
+
+Usage:
+    python benchmarks/bench_import_time.py
+    python benchmarks/bench_import_time.py --repeat 10 --top 15
+    python benchmarks/bench_import_time.py --budget app=300 --only app
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Module -> budget in milliseconds for `import <module>`. None of them may
+# pull in torch, transformers, gradio, openai, vllm or pandas at import.
+BUDGETS_MS = {
+    "app": 400,
+    "soa_extractor.run": 250,
+    "run_ocr": 400,
+    "run_hard_core": 100,
+}
+
+HEAVY_MODULES = ("torch", "transformers", "gradio", "spaces", "openai", "vllm", "pandas")
+
+
+def import_profile(module):
+    """
+    Imports `module` in a fresh interpreter. Returns (total_us, rows) where
+    rows are (cumulative_us, self_us, name) for every module imported.
+    """
+    env = dict(os.environ)
+    # A Space would import `spaces` (and torch) on purpose; measure the
+    # local path
+    env.pop("SPACE_ID", None)
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1])
+
+    rows = []
+    total = None
+    for line in completed.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        if not self_us.strip().isdigit():
+            continue  # header
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+        if name.strip() == module:
+            total = int(cumulative_us)
+    if total is None:
+        raise RuntimeError(f"No importtime entry for {module}")
+    return total, rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=8, help="Slowest imports to list")
+    parser.add_argument(
+        "--budget",
+        action="append",
+        default=[],
+        metavar="MODULE=MS",
+        help="Override a budget (repeatable)",
+    )
+    parser.add_argument("--only", default=None, help="Comma-separated entry points")
+    args = parser.parse_args()
+
+    budgets = dict(BUDGETS_MS)
+    for override in args.budget:
+        module, _, ms = override.partition("=")
+        budgets[module] = float(ms)
+    if args.only:
+        budgets = {module: budgets[module] for module in args.only.split(",")}
+
+    failures = []
+    for module, budget in budgets.items():
+        try:
+            runs = [import_profile(module) for _ in range(args.repeat)]
+        except RuntimeError as e:
+            print(f"{module:<20} import failed: {e}")
+            failures.append(module)
+            continue
+        total, rows = min(runs, key=lambda run: run[0])
+        ms = total / 1000
+        status = "ok" if ms <= budget else "OVER"
+        print(f"{module:<20} {ms:>8.1f} ms  budget {budget:>6.0f} ms  {status}")
+
+        imported = {name for _, _, name in rows}
+        heavy = [name for name in HEAVY_MODULES if name in imported]
+        if heavy:
+            print(f"    imports {', '.join(heavy)} at import time")
+            status = "OVER"
+
+        # The biggest subtrees after the entry point itself
+        for cumulative_us, self_us, name in sorted(rows, reverse=True)[1 : args.top + 1]:
+            print(f"    {cumulative_us / 1000:>8.1f} ms  {name}")
+        if status != "ok":
+            failures.append(module)
+
+    if failures:
+        print(f"Failed: {', '.join(failures)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
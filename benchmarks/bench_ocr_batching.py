@@ -0,0 +1,80 @@
+"""
+Throughput comparison: one-page-at-a-time OCR vs continuous batching.
+
+Usage:
+    python benchmarks/bench_ocr_batching.py --input examples --batch-sizes 1,2,4,8
+    python benchmarks/bench_ocr_batching.py --input datasets/0218.pdf --max-pages 20
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from soa_extractor.ocr_service import OCRService
+
+
+def load_images(input_path, service, max_pages=None):
+    """Render/load every input page up front so only decoding is timed."""
+    if os.path.isdir(input_path):
+        paths = sorted(glob.glob(os.path.join(input_path, "*.png")))
+        images = [Image.open(path).convert("RGB") for path in paths]
+    else:
+        pdf = pdfium.PdfDocument(input_path)
+        images = [service.render_pdf_page(pdf[i]) for i in range(len(pdf))]
+        pdf.close()
+    return images[:max_pages] if max_pages else images
+
+
+def run_once(service, images):
+    start = time.time()
+    texts = [text for _, text, _ in service.extract_texts(images)]
+    elapsed = time.time() - start
+    tokens = sum(
+        len(service.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+        for text in texts
+    )
+    return texts, elapsed, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default="examples", help="PDF file or image dir")
+    parser.add_argument("--model", default="lightonai/LightOnOCR-2-1B")
+    parser.add_argument("--batch-sizes", default="1,2,4,8")
+    parser.add_argument("--max-new-tokens", type=int, default=2048)
+    parser.add_argument("--max-pages", type=int, default=None)
+    args = parser.parse_args()
+
+    service = OCRService(model_name=args.model, max_new_tokens=args.max_new_tokens)
+    service.load_model()
+    images = load_images(args.input, service, args.max_pages)
+    print(f"Benchmarking {len(images)} pages on {service.device.upper()}")
+
+    # Warm-up so the first measured run does not pay lazy-init costs
+    service.batch_size = 1
+    service.extract_text_from_image(images[0])
+
+    baseline = None
+    print(f"{'batch':>5} {'seconds':>9} {'pages/s':>8} {'tokens/s':>9} {'speedup':>8} same")
+    for batch_size in [int(b) for b in args.batch_sizes.split(",")]:
+        service.batch_size = batch_size
+        texts, elapsed, tokens = run_once(service, images)
+        if baseline is None:
+            baseline = (texts, elapsed)
+        same = sum(a == b for a, b in zip(texts, baseline[0]))
+        print(
+            f"{batch_size:>5} {elapsed:>9.2f} {len(images) / elapsed:>8.3f} "
+            f"{tokens / elapsed:>9.1f} {baseline[1] / elapsed:>7.2f}x "
+            f"{same}/{len(texts)}"
+        )
+
+
+if __name__ == "__main__":
+    main()
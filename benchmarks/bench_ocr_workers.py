@@ -0,0 +1,78 @@
+"""
+CPU OCR throughput for K worker processes x T threads each.
+
+The model is loaded once and shared by every pool (workers are forked).
+"0xT" is the single-process baseline: OCRService.process_pdf with T threads.
+
+Usage:
+    python benchmarks/bench_ocr_workers.py --input datasets --configs 0x8,1x8,2x4,4x2,8x1
+    python benchmarks/bench_ocr_workers.py --input datasets/0218.pdf --max-new-tokens 512
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch
+
+from soa_extractor.ocr_service import OCRService
+from soa_extractor.ocr_workers import OCRWorkerPool
+
+
+def run_inline(service, paths, threads):
+    torch.set_num_threads(threads)
+    return sum(1 for path in paths for _ in service.process_pdf(path))
+
+
+def run_pool(service, paths, processes, threads):
+    pool = OCRWorkerPool(service, processes, threads=threads)
+    return sum(1 for _, pages in pool.documents(paths) for _ in pages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default="datasets", help="PDF file or directory")
+    parser.add_argument("--model", default="lightonai/LightOnOCR-2-1B")
+    parser.add_argument("--configs", default="0x8,1x8,2x4,4x2,8x1")
+    parser.add_argument("--max-new-tokens", type=int, default=1024)
+    parser.add_argument("--int8", action="store_true", help="Dynamic int8 weights")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        paths = sorted(glob.glob(os.path.join(args.input, "*.pdf")))
+    else:
+        paths = [args.input]
+
+    service = OCRService(
+        model_name=args.model,
+        max_new_tokens=args.max_new_tokens,
+        quantize={} if args.int8 else None,
+    )
+    service.device, service.dtype = "cpu", torch.float32
+    service.load_model()
+    print(f"OCR of {len(paths)} documents on {os.cpu_count()} cores")
+
+    baseline = None
+    print(f"{'K x T':>7} {'seconds':>9} {'pages/s':>8} {'speedup':>8}")
+    for config in args.configs.split(","):
+        processes, threads = (int(n) for n in config.split("x"))
+        start = time.time()
+        if processes == 0:
+            pages = run_inline(service, paths, threads)
+        else:
+            pages = run_pool(service, paths, processes, threads)
+        elapsed = time.time() - start
+        if baseline is None:
+            baseline = elapsed
+        print(
+            f"{config:>7} {elapsed:>9.2f} {pages / elapsed:>8.3f} "
+            f"{baseline / elapsed:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+CPU inference: float32 vs int8 dynamic quantisation (speed, memory, accuracy).
+
+Each mode runs in its own subprocess so peak RSS is measured per mode.
+Character error rate is relative to the float32 output.
+
+Usage:
+    python benchmarks/bench_quantization.py --input examples
+    python benchmarks/bench_quantization.py --modes fp32,int8 --max-pages 3
+"""
+
+import argparse
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MODES = {
+    "fp32": None,
+    "int8": {"vision": False},
+    "int8-vision": {"vision": True},
+}
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def levenshtein(a, b):
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+def cer(texts, references):
+    errors = sum(levenshtein(t, r) for t, r in zip(texts, references))
+    return errors / max(1, sum(len(r) for r in references))
+
+
+def run_worker(args):
+    """Child process: load one mode, OCR every image, print a JSON report."""
+    import torch
+    from PIL import Image
+
+    from soa_extractor.ocr_service import OCRService
+
+    quantize = MODES[args.worker]
+    if quantize is not None:
+        quantize = dict(quantize, cache_dir=args.cache_dir)
+    service = OCRService(
+        model_name=args.model, max_new_tokens=args.max_new_tokens, quantize=quantize
+    )
+    # Compare on CPU even when a GPU is present
+    service.device, service.dtype = "cpu", torch.float32
+    torch.set_num_threads(args.threads or torch.get_num_threads())
+
+    paths = sorted(glob.glob(os.path.join(args.input, "*.png")))[: args.max_pages]
+    images = [Image.open(path).convert("RGB") for path in paths]
+
+    start = time.time()
+    service.load_model()
+    load_seconds = time.time() - start
+
+    start = time.time()
+    texts = [text for _, text, _ in service.extract_texts(images)]
+    seconds = time.time() - start
+    tokens = sum(
+        len(service.processor.tokenizer(text, add_special_tokens=False)["input_ids"])
+        for text in texts
+    )
+    print(
+        json.dumps(
+            {
+                "load_seconds": load_seconds,
+                "seconds": seconds,
+                "tokens": tokens,
+                "peak_rss_mb": peak_rss_mb(),
+                "texts": texts,
+            }
+        )
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default="examples", help="Directory of PNG pages")
+    parser.add_argument("--model", default="lightonai/LightOnOCR-2-1B")
+    parser.add_argument("--modes", default="fp32,int8,int8-vision")
+    parser.add_argument("--max-new-tokens", type=int, default=1024)
+    parser.add_argument("--max-pages", type=int, default=None)
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--cache-dir", default=os.path.join("outputs", "int8_weights"))
+    parser.add_argument("--worker", choices=sorted(MODES), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    modes = args.modes.split(",")
+    if "fp32" in modes:
+        # The reference run goes first so CER can be computed as we go
+        modes.remove("fp32")
+        modes.insert(0, "fp32")
+
+    references = None
+    print(
+        f"{'mode':>12} {'load s':>7} {'seconds':>8} {'tokens/s':>9} "
+        f"{'peak RSS MB':>12} {'CER':>7}"
+    )
+    for mode in modes:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", mode]
+        for flag in ("input", "model", "max_new_tokens", "max_pages", "threads", "cache_dir"):
+            value = getattr(args, flag)
+            if value is not None:
+                command += [f"--{flag.replace('_', '-')}", str(value)]
+        completed = subprocess.run(command, capture_output=True, text=True)
+        if completed.returncode != 0:
+            print(f"{mode:>12} failed:\n{completed.stderr[-2000:]}")
+            continue
+        report = json.loads(completed.stdout.strip().splitlines()[-1])
+
+        if mode == "fp32":
+            references = report["texts"]
+        error_rate = (
+            f"{cer(report['texts'], references):>7.4f}" if references else f"{'n/a':>7}"
+        )
+        rss = report["peak_rss_mb"]
+        rss = "n/a" if rss is None else f"{rss:.0f}"
+        print(
+            f"{mode:>12} {report['load_seconds']:>7.1f} {report['seconds']:>8.1f} "
+            f"{report['tokens'] / report['seconds']:>9.2f} {rss:>12} {error_rate}"
+        )
+
+
+if __name__ == "__main__":
+    main()
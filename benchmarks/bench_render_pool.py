@@ -0,0 +1,77 @@
+"""
+Rasterisation throughput: in-process render_page vs RenderPool workers.
+
+Usage:
+    python benchmarks/bench_render_pool.py --input datasets --workers 1,2,4,8
+    python benchmarks/bench_render_pool.py --input datasets/0218.pdf --repeat 3
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdfium2 as pdfium
+
+from soa_extractor.render_pool import RenderPool
+from soa_extractor.rendering import render_page
+
+
+def render_inline(paths):
+    pages = 0
+    for path in paths:
+        pdf = pdfium.PdfDocument(path)
+        for i in range(len(pdf)):
+            page = pdf[i]
+            render_page(page)
+            page.close()
+            pages += 1
+        pdf.close()
+    return pages
+
+
+def render_pooled(pool, paths):
+    pages = 0
+    for path in paths:
+        for _, rendered in pool.pages(path):
+            rendered.release()
+            pages += 1
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default="datasets", help="PDF file or directory")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--repeat", type=int, default=1)
+    args = parser.parse_args()
+
+    if os.path.isdir(args.input):
+        paths = sorted(glob.glob(os.path.join(args.input, "*.pdf")))
+    else:
+        paths = [args.input]
+    paths = paths * args.repeat
+    print(f"Rendering {len(paths)} documents on {os.cpu_count()} cores")
+
+    start = time.time()
+    pages = render_inline(paths)
+    baseline = time.time() - start
+    print(f"{'workers':>7} {'seconds':>9} {'pages/s':>8} {'speedup':>8}")
+    print(f"{'inline':>7} {baseline:>9.2f} {pages / baseline:>8.2f} {1:>7.2f}x")
+
+    for workers in [int(w) for w in args.workers.split(",")]:
+        with RenderPool(workers=workers) as pool:
+            start = time.time()
+            pages = render_pooled(pool, paths)
+            elapsed = time.time() - start
+        print(
+            f"{workers:>7} {elapsed:>9.2f} {pages / elapsed:>8.2f} "
+            f"{baseline / elapsed:>7.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
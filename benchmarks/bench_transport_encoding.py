@@ -0,0 +1,125 @@
+"""
+Page transport encodings for vLLM endpoints: encode time, payload size and OCR accuracy.
+
+Every page is rendered as app.py renders it (1540 px longest edge) and
+encoded with each option; payload is the base64 data URI actually sent.
+With --endpoint, every page is also OCR'd once per option and the character
+error rate is relative to the output for the first option (lossless PNG by
+default).
+
+Usage:
+    python benchmarks/bench_transport_encoding.py --input examples
+    python benchmarks/bench_transport_encoding.py --input datasets --encodings png,jpeg-q90,webp-q80-gray
+    python benchmarks/bench_transport_encoding.py --input datasets --endpoint http://localhost:8000/v1 --model lightonai/LightOnOCR-2-1B
+"""
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pypdfium2 as pdfium
+from PIL import Image
+
+from bench_quantization import cer
+from soa_extractor.rendering import render_page
+from soa_extractor.transport import TransportEncoding, data_uri
+
+DEFAULT_ENCODINGS = "png,png-c1,jpeg-q95,jpeg-q90,jpeg-q80,webp-q90,webp-q80,jpeg-q90-gray,png-gray,jpeg-q90-1024"
+
+
+def load_pages(input_path, max_pages):
+    if os.path.isdir(input_path):
+        paths = sorted(
+            path
+            for pattern in ("*.pdf", "*.png", "*.jpg", "*.jpeg")
+            for path in glob.glob(os.path.join(input_path, pattern))
+        )
+    else:
+        paths = [input_path]
+
+    pages = []
+    for path in paths:
+        if path.lower().endswith(".pdf"):
+            pdf = pdfium.PdfDocument(path)
+            for index in range(len(pdf)):
+                pages.append(render_page(pdf[index], max_resolution=1540))
+                if len(pages) >= max_pages:
+                    return pages
+            pdf.close()
+        else:
+            pages.append(Image.open(path).convert("RGB"))
+        if len(pages) >= max_pages:
+            break
+    return pages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--input", default="examples", help="PDF/image file or directory")
+    parser.add_argument("--encodings", default=DEFAULT_ENCODINGS)
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=3, help="Encodes per page; the fastest counts")
+    parser.add_argument("--endpoint", default=None, help="vLLM server for the accuracy column")
+    parser.add_argument("--model", default="lightonai/LightOnOCR-2-1B")
+    parser.add_argument("--max-tokens", type=int, default=2048)
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    pages = load_pages(args.input, args.max_pages)
+    encodings = [TransportEncoding.parse(spec) for spec in args.encodings.split(",")]
+    print(f"{len(pages)} pages")
+
+    if args.endpoint:
+        from soa_extractor.vllm_clients import complete_many
+
+    references = None
+    print(f"{'encoding':<16} {'encode ms':>10} {'payload KB':>11} {'vs first':>9} {'CER':>7}")
+    baseline_bytes = None
+    for encoding in encodings:
+        encode_s = 0.0
+        payload_bytes = 0
+        uris = []
+        for page in pages:
+            best = None
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                uri = data_uri(page, encoding)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            encode_s += best
+            payload_bytes += len(uri)
+            uris.append(uri)
+        baseline_bytes = baseline_bytes or payload_bytes
+
+        error_rate = f"{'n/a':>7}"
+        if args.endpoint:
+            requests = [
+                dict(
+                    endpoint=args.endpoint,
+                    model=args.model,
+                    messages=[{"role": "user", "content": [{"type": "image_url", "image_url": {"url": uri}}]}],
+                    max_tokens=args.max_tokens,
+                    temperature=0.0,
+                )
+                for uri in uris
+            ]
+            texts = [
+                text if isinstance(text, str) else ""
+                for text in complete_many(requests, max_concurrency=args.concurrency)
+            ]
+            if references is None:
+                references = texts
+            error_rate = f"{cer(texts, references):>7.4f}"
+
+        print(
+            f"{encoding.name:<16} {encode_s / len(pages) * 1000:>10.1f} "
+            f"{payload_bytes / len(pages) / 1024:>11.1f} {payload_bytes / baseline_bytes:>8.0%} {error_rate}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""
+vLLM client throughput: a new OpenAI client per page (the old app.py
+behaviour) vs the pooled keep-alive client vs concurrent async requests.
+
+Runs against the stub server in benchmarks/stub_openai_server.py unless
+--endpoint points at a real vLLM server. With --fail-rate the stub answers
+that share of requests with 503, and every page must still come back
+through the jittered retries.
+
+Usage:
+    python benchmarks/bench_vllm_clients.py --pages 50 --concurrency 1,4,8,16
+    python benchmarks/bench_vllm_clients.py --fail-rate 0.2
+    python benchmarks/bench_vllm_clients.py --endpoint http://localhost:8000/v1 --model lightonai/LightOnOCR-2-1B
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_openai_server import serve
+
+# 1x1 white PNG: the stub ignores it, a real server sees a tiny page
+IMAGE_URI = (
+    "data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAIAAACQd1PeAAAADElEQVR4"
+    "nGP4//8/AAX+Av4N70a4AAAAAElFTkSuQmCC"
+)
+
+
+def page_request(model, max_tokens):
+    return dict(
+        model=model,
+        messages=[{"role": "user", "content": [{"type": "image_url", "image_url": {"url": IMAGE_URI}}]}],
+        max_tokens=max_tokens,
+        temperature=0.0,
+        timeout=60,
+    )
+
+
+def stub_stats(endpoint):
+    try:
+        with urllib.request.urlopen(endpoint.rstrip("/") + "/stats", timeout=5) as response:
+            return json.loads(response.read())
+    except Exception:
+        return None  # not the stub
+
+
+def run_fresh(endpoint, request, pages, retries):
+    from openai import OpenAI
+
+    from soa_extractor.vllm_clients import create_with_retries
+
+    for _ in range(pages):
+        client = OpenAI(base_url=endpoint, api_key="not-needed", max_retries=0)
+        create_with_retries(client, retries=retries, **request)
+        client.close()
+
+
+def run_pooled(endpoint, request, pages, retries):
+    from soa_extractor.vllm_clients import create_with_retries, get_client
+
+    client = get_client(endpoint)
+    for _ in range(pages):
+        create_with_retries(client, retries=retries, **request)
+
+
+def run_async(endpoint, request, pages, retries, concurrency):
+    from soa_extractor.vllm_clients import complete_many
+
+    results = complete_many(
+        [dict(request, endpoint=endpoint) for _ in range(pages)],
+        max_concurrency=concurrency,
+        retries=retries,
+    )
+    errors = [result for result in results if isinstance(result, Exception)]
+    if errors:
+        raise errors[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--endpoint", default=None, help="Real server; default starts the stub")
+    parser.add_argument("--model", default="stub")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--concurrency", default="1,4,8,16")
+    parser.add_argument("--max-tokens", type=int, default=256)
+    parser.add_argument("--retries", type=int, default=3)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Stub response delay")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Stub 503 share")
+    args = parser.parse_args()
+
+    endpoint = args.endpoint
+    if endpoint is None:
+        _, endpoint = serve(latency_s=args.latency_ms / 1000, fail_rate=args.fail_rate)
+        print(f"Stub server on {endpoint} ({args.latency_ms:.0f} ms latency, {args.fail_rate:.0%} failures)")
+    request = page_request(args.model, args.max_tokens)
+
+    runs = [("fresh client", lambda: run_fresh(endpoint, request, args.pages, args.retries))]
+    runs.append(("pooled client", lambda: run_pooled(endpoint, request, args.pages, args.retries)))
+    for concurrency in map(int, args.concurrency.split(",")):
+        runs.append(
+            (
+                f"async x{concurrency}",
+                lambda c=concurrency: run_async(endpoint, request, args.pages, args.retries, c),
+            )
+        )
+
+    print(f"{args.pages} pages per run")
+    print(f"{'client':<15} {'seconds':>9} {'pages/s':>8} {'connections':>12} {'failures':>9}")
+    for name, run in runs:
+        before = stub_stats(endpoint)
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        after = stub_stats(endpoint)
+        if before and after:
+            # Less the connection of the second /stats request itself
+            connections = after["connections"] - before["connections"] - 1
+            failures = after["failures"] - before["failures"]
+        else:
+            connections = failures = "-"
+        print(f"{name:<15} {elapsed:>9.2f} {args.pages / elapsed:>8.1f} {connections:>12} {failures:>9}")
+
+
+if __name__ == "__main__":
+    main()
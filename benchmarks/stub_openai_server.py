@@ -0,0 +1,164 @@
+"""
+Stub OpenAI-compatible chat completions server, standing in for vLLM.
+
+Answers POST /v1/chat/completions (streaming and not) with canned text
+after a configurable delay, can fail a share of requests with 503 to
+exercise retries, and keeps HTTP/1.1 connections alive. GET /stats reports
+connections opened, requests served and failures injected.
+
+Usage:
+    python benchmarks/stub_openai_server.py --port 8001 --latency-ms 50
+    python benchmarks/stub_openai_server.py --fail-rate 0.2 --token-delay-ms 5
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TEXT = "# Statement of Account\n\n| Date | Description | Amount |\n|---|---|---|\n| 01/02 | Invoice 1001 | 1,250.00 |"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def setup(self):
+        super().setup()
+        # One handler instance per TCP connection
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.stats_lock:
+                self._send_json(200, dict(self.server.stats))
+        elif self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        server = self.server
+        with server.stats_lock:
+            server.stats["requests"] += 1
+            fail = server.rng.random() < server.fail_rate
+            if fail:
+                server.stats["failures"] += 1
+            latency = server.latency_s + server.rng.uniform(0, server.latency_jitter_s)
+        time.sleep(latency)
+        if fail:
+            self._send_json(503, {"error": {"message": "injected failure", "type": "server_error"}})
+            return
+
+        words = TEXT.split(" ")
+        max_tokens = request.get("max_tokens") or len(words)
+        words = words[:max_tokens]
+        model = request.get("model", "stub")
+        created = int(time.time())
+
+        if not request.get("stream"):
+            self._send_json(
+                200,
+                {
+                    "id": "chatcmpl-stub",
+                    "object": "chat.completion",
+                    "created": created,
+                    "model": model,
+                    "choices": [
+                        {
+                            "index": 0,
+                            "message": {"role": "assistant", "content": " ".join(words)},
+                            "finish_reason": "stop",
+                        }
+                    ],
+                    "usage": {"prompt_tokens": 1, "completion_tokens": len(words), "total_tokens": len(words) + 1},
+                },
+            )
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send_event(data):
+            chunk = f"data: {data}\n\n".encode()
+            self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+            self.wfile.flush()
+
+        for index, word in enumerate(words):
+            time.sleep(server.token_delay_s)
+            delta = {"content": word if index == 0 else " " + word}
+            finish = "stop" if index == len(words) - 1 else None
+            send_event(
+                json.dumps(
+                    {
+                        "id": "chatcmpl-stub",
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": model,
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+                    }
+                )
+            )
+        send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(port=0, latency_s=0.05, token_delay_s=0.0, fail_rate=0.0, latency_jitter_s=0.0, seed=None):
+    """
+    Starts the stub on a daemon thread. Returns (server, base_url). Each
+    response waits latency_s plus up to latency_jitter_s; `seed` makes the
+    injected failures and jitter repeatable.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    server.daemon_threads = True
+    server.rng = random.Random(seed)
+    server.latency_s = latency_s
+    server.latency_jitter_s = latency_jitter_s
+    server.token_delay_s = token_delay_s
+    server.fail_rate = fail_rate
+    server.stats = {"connections": 0, "requests": 0, "failures": 0}
+    server.stats_lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Delay before each response")
+    parser.add_argument("--token-delay-ms", type=float, default=0, help="Delay per streamed chunk")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Share of requests answered 503")
+    args = parser.parse_args()
+
+    server, base_url = serve(args.port, args.latency_ms / 1000, args.token_delay_ms / 1000, args.fail_rate)
+    print(f"Stub OpenAI server on {base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
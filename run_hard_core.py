@@ -1,6 +1,5 @@
 import os
 import json
-import pandas as pd
 from pipeline.orchestrator import ProcessingPipeline
 from pipeline.extractors import get_all_plugins
 
@@ -32,6 +31,9 @@ def append_to_excel(new_data, output_excel="extracted_data.xlsx"):
     Append new data to the Excel file.
     Reads existing file (if any), appends new rows, and saves back.
     """
+    # Only needed when writing the workbook; pandas is slow to import
+    import pandas as pd
+
     # Load existing data
     if os.path.exists(output_excel):
         try:
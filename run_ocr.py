@@ -1,24 +1,60 @@
+import functools
 import os
 import warnings
 import time
-import torch
 import pypdfium2 as pdfium
 from PIL import Image
-from transformers import (
-    LightOnOcrForConditionalGeneration,
-    LightOnOcrProcessor,
-)
+
+# torch and transformers are imported on first use: render workers started
+# with spawn re-import this module and never need them
+from soa_extractor.error_system import ERRORS
+from soa_extractor.ocr_cache import OCRCache
+from soa_extractor.render_pool import RenderPool
+from soa_extractor.rendering import BlankPage, blank_page_check
 
 # Suppress warnings
 warnings.filterwarnings("ignore", category=FutureWarning, module="spaces")
 
 # Configuration
 MODEL_NAME = "lightonai/LightOnOCR-2-1B"
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
-DTYPE = torch.bfloat16 if DEVICE == "cuda" else torch.float32
-ATTN_IMPLEMENTATION = "sdpa" if DEVICE == "cuda" else "eager"
-
-print(f"Running on {DEVICE.upper()} with {DTYPE} and {ATTN_IMPLEMENTATION} attention.")
+RENDER_SCALE = 2.77
+# OCR result cache file, e.g. os.path.join("outputs", "ocr_cache.sqlite");
+# None disables it
+CACHE_PATH = None
+CACHE_MAX_BYTES = 1024 * 1024 * 1024
+# Render pages in this many worker processes (0 = in the main process)
+RENDER_WORKERS = 0
+# Blank page probe thresholds, e.g.
+# {"probe_width": 256, "ink_delta": 48, "max_ink_ratio": 0.0003}; None OCRs every page
+BLANK_PAGE = None
+# Stop a page whose output loops: RepetitionCheck options, e.g. {} for its
+# defaults; None disables the check
+REPETITION_CHECK = None
+# With REPETITION_CHECK set, a looping page is decoded once more with this
+# repetition_penalty (None = keep the truncated text)
+REPETITION_RETRY_PENALTY = None
+# Wall-clock budget per page in seconds; a page over it is dropped (None = no limit)
+PAGE_TIMEOUT_S = None
+# int8 dynamic quantisation of the language model on CPU (see README)
+CPU_INT8 = False
+CPU_INT8_VISION = False
+INT8_CACHE_DIR = os.path.join("outputs", "int8_weights")
+# Pre-converted snapshot root (python -m soa_extractor.snapshot prepare)
+SNAPSHOT_DIR = os.environ.get("OCR_SNAPSHOT_DIR")
+# One short generation on a blank image before the first page
+WARM_UP = False
+
+
+@functools.lru_cache(maxsize=None)
+def torch_runtime():
+    """(device, dtype, attn_implementation); imports torch."""
+    import torch
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    dtype = torch.bfloat16 if device == "cuda" else torch.float32
+    attn_implementation = "sdpa" if device == "cuda" else "eager"
+    print(f"Running on {device.upper()} with {dtype} and {attn_implementation} attention.")
+    return device, dtype, attn_implementation
 
 
 import gc
@@ -26,26 +62,67 @@ import gc
 
 def load_model():
     """Load the model and processor locally."""
+    import torch
+    from transformers import LightOnOcrForConditionalGeneration, LightOnOcrProcessor
+
+    from soa_extractor.quantization import load_quantized
+    from soa_extractor.snapshot import (
+        StageTimer,
+        has_snapshot,
+        load_snapshot,
+        snapshot_path,
+        warm_up,
+    )
+
+    device, dtype, attn_implementation = torch_runtime()
+
     # Clear cache before loading
     gc.collect()
     if torch.cuda.is_available():
         torch.cuda.empty_cache()
 
     print(f"Loading model: {MODEL_NAME}...")
-    start_time = time.time()
-    model = (
-        LightOnOcrForConditionalGeneration.from_pretrained(
-            MODEL_NAME,
-            attn_implementation=ATTN_IMPLEMENTATION,
-            torch_dtype=DTYPE,
-            trust_remote_code=True,
+    timer = StageTimer()
+    snapshot = snapshot_path(SNAPSHOT_DIR, MODEL_NAME, dtype) if SNAPSHOT_DIR else None
+    if not has_snapshot(snapshot):
+        snapshot = None
+    if CPU_INT8 and device == "cpu":
+        with timer.stage("load int8"):
+            model = load_quantized(
+                LightOnOcrForConditionalGeneration,
+                MODEL_NAME,
+                cache_dir=INT8_CACHE_DIR,
+                vision=CPU_INT8_VISION,
+                trust_remote_code=True,
+            )
+    elif snapshot is not None:
+        model = load_snapshot(
+            LightOnOcrForConditionalGeneration,
+            snapshot,
+            device=device,
+            attn_implementation=attn_implementation,
+            timer=timer,
         )
-        .to(DEVICE)
-        .eval()
-    )
+    else:
+        with timer.stage("from_pretrained"):
+            model = LightOnOcrForConditionalGeneration.from_pretrained(
+                MODEL_NAME,
+                attn_implementation=attn_implementation,
+                torch_dtype=dtype,
+                trust_remote_code=True,
+            )
+        with timer.stage(f"to({device})"):
+            model = model.to(device).eval()
 
-    processor = LightOnOcrProcessor.from_pretrained(MODEL_NAME, trust_remote_code=True)
-    print(f"Model loaded in {time.time() - start_time:.2f}s")
+    with timer.stage("processor"):
+        processor = LightOnOcrProcessor.from_pretrained(
+            snapshot or MODEL_NAME, trust_remote_code=True
+        )
+    if WARM_UP:
+        with timer.stage("warm-up"):
+            white = Image.new("RGB", (448, 448), "white")
+            warm_up(model, prepare_inputs(processor, white))
+    print(f"Model loaded in {timer.total:.2f}s ({timer.report()})")
     return model, processor
 
 
@@ -70,7 +147,7 @@ def clean_output_text(text):
     return cleaned
 
 
-def render_pdf_page(page, max_resolution=1540, scale=2.77):
+def render_pdf_page(page, max_resolution=1540, scale=RENDER_SCALE):
     """Render a PDF page to PIL Image."""
     width, height = page.get_size()
     pixel_width = width * scale
@@ -80,8 +157,12 @@ def render_pdf_page(page, max_resolution=1540, scale=2.77):
     return page.render(scale=target_scale, rev_byteorder=True).to_pil()
 
 
-def extract_text(model, processor, image, max_tokens=8192):
-    """Run inference on a single image."""
+def prepare_inputs(processor, image):
+    """Chat-template a single image into model inputs on the model's device."""
+    import torch
+
+    device, dtype, _ = torch_runtime()
+
     chat = [
         {
             "role": "user",
@@ -99,57 +180,105 @@ def extract_text(model, processor, image, max_tokens=8192):
         return_tensors="pt",
     )
 
-    inputs = {
+    return {
         k: (
-            v.to(device=DEVICE, dtype=DTYPE)
+            v.to(device=device, dtype=dtype)
             if isinstance(v, torch.Tensor)
             and v.dtype in [torch.float32, torch.float16, torch.bfloat16]
-            else v.to(DEVICE) if isinstance(v, torch.Tensor) else v
+            else v.to(device) if isinstance(v, torch.Tensor) else v
         )
         for k, v in inputs.items()
     }
 
-    with torch.no_grad():
-        outputs = model.generate(
-            **inputs,
-            max_new_tokens=max_tokens,
-            temperature=0.0,  # Deterministic
-            top_p=0.9,
-            use_cache=True,
-            do_sample=False,
-        )
-
-    output_text = processor.decode(outputs[0], skip_special_tokens=True)
-    return clean_output_text(output_text)
 
-
-def is_blank_page(image, threshold=0.99):
+def extract_text(model, processor, image, max_tokens=8192, cache=None):
     """
-    Check if image is blank (mostly white).
-    Returns True if blank.
+    Run inference on a single image, consulting the OCR cache first.
+    Returns None for a page dropped after running over PAGE_TIMEOUT_S.
     """
-    # Convert to grayscale
-    gray = image.convert("L")
-    # Get extrema (optimization: if purely one color)
-    min_val, max_val = gray.getextrema()
-    if min_val == max_val:
-        return max_val > 250  # Pure white or light gray treated as blank
+    import torch
+
+    from soa_extractor.ocr_stopping import (
+        DeadlineCheck,
+        RepetitionCheck,
+        StopCheckCriteria,
+        StopChecks,
+    )
 
-    # Calculate percentage of white pixels (brightness > 250)
-    # This handles scanned docs with some noise or paper texture
-    histogram = gray.histogram()
-    white_pixels = sum(histogram[250:])
-    total_pixels = gray.width * gray.height
-    white_ratio = white_pixels / total_pixels
+    cache_key = None
+    if cache is not None:
+        device, dtype, _ = torch_runtime()
+        quantize = {"vision": CPU_INT8_VISION} if CPU_INT8 and device == "cpu" else None
+        cache_key = cache.make_key(
+            image, MODEL_NAME, RENDER_SCALE, max_tokens, dtype=dtype, quantize=quantize
+        )
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    inputs = prepare_inputs(processor, image)
+
+    def generate(**overrides):
+        # Cuts the page short if the output starts looping or runs too long
+        checks = []
+        if REPETITION_CHECK is not None:
+            checks.append(RepetitionCheck(processor.tokenizer, **REPETITION_CHECK))
+        if PAGE_TIMEOUT_S:
+            checks.append(DeadlineCheck(PAGE_TIMEOUT_S))
+        criteria = StopCheckCriteria(StopChecks(checks))
+        with torch.no_grad():
+            outputs = model.generate(
+                **inputs,
+                max_new_tokens=max_tokens,
+                temperature=0.0,  # Deterministic
+                top_p=0.9,
+                use_cache=True,
+                do_sample=False,
+                stopping_criteria=[criteria],
+                **overrides,
+            )
+        output_text = processor.decode(outputs[0], skip_special_tokens=True)
+        return clean_output_text(output_text), criteria.reason
 
-    return white_ratio > threshold
+    text, stop_reason = generate()
+    if stop_reason == RepetitionCheck.REASON and REPETITION_RETRY_PENALTY:
+        print(
+            "Output started repeating; retrying with "
+            f"repetition_penalty={REPETITION_RETRY_PENALTY}"
+        )
+        text, stop_reason = generate(repetition_penalty=REPETITION_RETRY_PENALTY)
+    if stop_reason == DeadlineCheck.TIMEOUT:
+        # Like OCRService: a half-decoded table must not feed the extraction
+        print(
+            f"[{ERRORS.OCR_TIMEOUT.code}] Page exceeded {PAGE_TIMEOUT_S}s; "
+            "partial page dropped"
+        )
+        return None
+    if stop_reason is not None:
+        print(f"[{ERRORS.OCR_REPEAT.code}] Output still repeating; kept truncated text")
+    elif cache_key is not None:
+        cache.put(cache_key, text)
+    return text
 
 
-import extraction_service
+def load_pdf_page(page):
+    """
+    Render a PDF page, or return a BlankPage if BLANK_PAGE is set and a
+    low-res probe finds no ink.
+    """
+    if BLANK_PAGE is not None:
+        is_blank, ratio = blank_page_check(page, **BLANK_PAGE)
+        if is_blank:
+            return BlankPage(ratio)
+    return render_pdf_page(page)
 
 
-def process_file(file_path, model, processor, extraction_plugins):
+def process_file(
+    file_path, model, processor, extraction_plugins, cache=None, render_pool=None
+):
     """Process a PDF or Image file and save output to txt."""
+    import extraction_service
+
     if not os.path.exists(file_path):
         print(f"Error: File not found: {file_path}")
         return
@@ -169,19 +298,29 @@ def process_file(file_path, model, processor, extraction_plugins):
             total_pages = len(pdf)
             print(f"PDF loaded with {total_pages} pages.")
 
-            for i in range(total_pages):
+            if render_pool is not None:
+                # Pages are rasterised ahead in worker processes
+                pages = render_pool.pages(file_path)
+            else:
+                pages = ((i + 1, load_pdf_page(pdf[i])) for i in range(total_pages))
+
+            for page_num, rendered in pages:
+                i = page_num - 1
                 print(f"Processing page {i + 1}/{total_pages}...")
-                page = pdf[i]
-                image = render_pdf_page(page)
 
-                # Check for blank page
-                if is_blank_page(image):
+                # Blank pages are caught on a low-res probe before rendering
+                if isinstance(rendered, BlankPage):
                     print(f"Skipping page {i + 1} (detected as blank).")
                     continue
+                image = rendered.image if render_pool is not None else rendered
 
                 start_time = time.time()
-                text = extract_text(model, processor, image)
+                text = extract_text(model, processor, image, cache=cache)
                 elapsed = time.time() - start_time
+                if render_pool is not None:
+                    rendered.release()
+                if text is None:
+                    continue
 
                 output_filename = os.path.join(output_dir, f"{base_name}_page_{i+1}.md")
                 with open(output_filename, "w", encoding="utf-8") as f:
@@ -211,8 +350,10 @@ def process_file(file_path, model, processor, extraction_plugins):
             print("Image loaded.")
 
             start_time = time.time()
-            text = extract_text(model, processor, image)
+            text = extract_text(model, processor, image, cache=cache)
             elapsed = time.time() - start_time
+            if text is None:
+                return
 
             output_filename = os.path.join(output_dir, f"{base_name}.md")
             with open(output_filename, "w", encoding="utf-8") as f:
@@ -237,11 +378,23 @@ def main():
     # Define files to process
     files_to_process = [r"datasets\0218.pdf"]
 
+    # Fork the render workers before the model creates threads or a CUDA context
+    render_pool = None
+    if RENDER_WORKERS:
+        render_pool = RenderPool(
+            workers=RENDER_WORKERS, scale=RENDER_SCALE, blank_page=BLANK_PAGE
+        )
+
     # Load model once
     model, processor = load_model()
+    cache = OCRCache(CACHE_PATH, max_bytes=CACHE_MAX_BYTES) if CACHE_PATH else None
 
     # Initialize Extraction System
     print("\nInitializing Extraction System...")
+    # Imported where it is used, so `import run_ocr` (and its import-time
+    # budget) does not depend on the extraction plugins being installed
+    import extraction_service
+
     extraction_plugins = extraction_service.initialize_system(
         os.path.join("docs", "rule.json")
     )
@@ -253,9 +406,17 @@ def main():
     # Process each file
     try:
         for file_path in files_to_process:
-            process_file(file_path, model, processor, extraction_plugins)
+            process_file(
+                file_path, model, processor, extraction_plugins, cache, render_pool
+            )
     except KeyboardInterrupt:
         print("\nProcess interrupted by user. Exiting...")
+    finally:
+        if render_pool is not None:
+            render_pool.close()
+        if cache is not None:
+            print(f"OCR cache stats: {cache.stats()}")
+            cache.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,87 @@
+import atexit
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class CropCache:
+    """
+    Crops of detected regions, saved once as PNG files under `directory` (a
+    temporary directory removed at exit by default) and capped at
+    `max_bytes` on disk (least recently used files are deleted).
+    Keys are the page's pixel hash, the box and the trimmed region, so
+    re-running a page or re-rendering a stream reuses the files. The demo
+    serves `directory` as Gradio static files instead of inlining base64.
+    """
+
+    def __init__(self, directory=None, max_bytes=256 * 1024 * 1024):
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="ocr_crops_")
+            atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._files = OrderedDict()  # name -> size
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def image_key(image):
+        digest = hashlib.blake2b(digest_size=12)
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+        return digest.hexdigest()
+
+    def path(self, image_key, coords, region, make_crop):
+        """
+        File holding the crop for `coords` of the page `image_key`;
+        make_crop() produces the PIL crop the first time.
+        """
+        name = f"{image_key}-{'_'.join(map(str, coords))}"
+        if region is not None:
+            name += "-" + "_".join(map(str, region))
+        name += ".png"
+        path = os.path.join(self.directory, name)
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+                self.hits += 1
+                return path
+            self.misses += 1
+
+        # Written under a temporary name so a concurrent request never
+        # serves a half-written file
+        partial = f"{path}.{threading.get_ident()}.tmp"
+        make_crop().save(partial, format="PNG")
+        os.replace(partial, path)
+        size = os.path.getsize(path)
+
+        evicted = []
+        with self._lock:
+            if name not in self._files:
+                self._files[name] = size
+                self.bytes += size
+            while self.bytes > self.max_bytes and len(self._files) > 1:
+                old_name, old_size = self._files.popitem(last=False)
+                self.bytes -= old_size
+                evicted.append(old_name)
+        for old_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, old_name))
+            except OSError:
+                pass
+        return path
+
+    def stats(self):
+        with self._lock:
+            return {
+                "files": len(self._files),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
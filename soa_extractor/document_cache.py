@@ -0,0 +1,132 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pypdfium2 as pdfium
+
+from soa_extractor.rendering import PDFIUM_LOCK, render_page
+
+
+class DocumentCache:
+    """
+    Open PDFs and rendered pages for one demo session. Documents are keyed by
+    a hash of the file's contents (re-uploads of the same file share them),
+    pages by (document, page, max_resolution, scale, mode). At most
+    `max_documents` PdfDocuments stay open and rendered pages are capped at
+    `max_page_bytes`, least recently used first. Rendered pages are shared,
+    so callers must not modify them.
+    """
+
+    def __init__(self, max_documents=2, max_page_bytes=256 * 1024 * 1024):
+        self.max_documents = max_documents
+        self.max_page_bytes = max_page_bytes
+        self.page_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._digests = {}  # (path, size, mtime) -> content hash
+        self._documents = OrderedDict()  # content hash -> PdfDocument
+        self._pages = OrderedDict()  # render key -> PIL image
+        self._lock = threading.RLock()
+
+    def digest(self, path):
+        stat = os.stat(path)
+        file_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if file_key in self._digests:
+                return self._digests[file_key]
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._digests[file_key] = digest.hexdigest()
+            return self._digests[file_key]
+
+    def document(self, path):
+        """(content hash, open PdfDocument) for `path`."""
+        digest = self.digest(path)
+        with self._lock:
+            pdf = self._documents.get(digest)
+            if pdf is not None:
+                self._documents.move_to_end(digest)
+                return digest, pdf
+            with PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(path)
+            self._documents[digest] = pdf
+            while len(self._documents) > self.max_documents:
+                evicted, old_pdf = self._documents.popitem(last=False)
+                self._drop_pages(evicted)
+                with PDFIUM_LOCK:
+                    old_pdf.close()
+            return digest, pdf
+
+    def page_count(self, path):
+        _, pdf = self.document(path)
+        return len(pdf)
+
+    def render(self, path, page_index, max_resolution=1540, scale=2.77, mode="fixed"):
+        """Page `page_index` rendered as render_page() would, cached."""
+        return self._cached(
+            path,
+            (page_index, max_resolution, scale, mode),
+            lambda page: render_page(page, max_resolution=max_resolution, scale=scale, mode=mode),
+        )
+
+    def thumbnail(self, path, page_index, max_edge=640):
+        """A small render of the page for previews, cached."""
+
+        def render(page):
+            width, height = page.get_size()
+            return page.render(scale=max_edge / max(width, height), rev_byteorder=True).to_pil()
+
+        return self._cached(path, (page_index, "thumbnail", max_edge), render)
+
+    def _cached(self, path, render_key, render):
+        digest, pdf = self.document(path)
+        key = (digest, *render_key)
+        with self._lock:
+            image = self._pages.get(key)
+            if image is not None:
+                self._pages.move_to_end(key)
+                self.hits += 1
+                return image
+            self.misses += 1
+            with PDFIUM_LOCK:
+                page = pdf[render_key[0]]
+                try:
+                    image = render(page)
+                finally:
+                    page.close()
+            size = image.width * image.height * len(image.getbands())
+            if size <= self.max_page_bytes:
+                self._pages[key] = image
+                self.page_bytes += size
+                while self.page_bytes > self.max_page_bytes:
+                    _, evicted = self._pages.popitem(last=False)
+                    self.page_bytes -= evicted.width * evicted.height * len(evicted.getbands())
+            return image
+
+    def _drop_pages(self, digest):
+        for key in [key for key in self._pages if key[0] == digest]:
+            image = self._pages.pop(key)
+            self.page_bytes -= image.width * image.height * len(image.getbands())
+
+    def close(self):
+        with self._lock:
+            with PDFIUM_LOCK:
+                for pdf in self._documents.values():
+                    pdf.close()
+            self._documents.clear()
+            self._pages.clear()
+            self.page_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "documents": len(self._documents),
+                "pages": len(self._pages),
+                "page_bytes": self.page_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
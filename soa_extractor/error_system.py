@@ -15,6 +15,11 @@ class ERRORS:
     PAGE_HEADER = Err("SOA-PAGE-HEADER-001", "page_parse")
     PAGE_CLASS  = Err("SOA-PAGE-CLASS-002", "page_classify")
     PAGE_SPLIT  = Err("SOA-PAGE-SPLIT-003", "page_split")
+    PAGE_BLANK  = Err("SOA-PAGE-BLANK-004", "page_render")
+
+    # OCR
+    OCR_REPEAT  = Err("SOA-OCR-REPEAT-001", "ocr_generate")
+    OCR_TIMEOUT = Err("SOA-OCR-TIMEOUT-002", "ocr_generate")
 
     # REC
     REC_EMPTY   = Err("SOA-REC-EMPTY-001", "record_parse")
@@ -0,0 +1,261 @@
+import collections
+import queue
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria, TextIteratorStreamer
+from transformers.generation.streamers import BaseStreamer
+
+from soa_extractor.vision_cache import encode_prompt
+
+
+class BatchRequest:
+    """
+    One caller's share of a micro-batch. Iterate `streamer` for decoded
+    text; it ends when this row is finished, not when the whole batch is.
+    """
+
+    def __init__(self, inputs, tokenizer, max_new_tokens, sampling, stop_check=None):
+        self.inputs = inputs
+        self.max_new_tokens = max_new_tokens
+        self.sampling = sampling
+        self.stop_check = stop_check
+        self.streamer = TextIteratorStreamer(tokenizer, skip_special_tokens=True)
+        self.stop_reason = None
+        self.error = None
+        self.tokens = 0
+        self.done = False
+        self.submitted = time.monotonic()
+
+    @property
+    def sampling_key(self):
+        # Requests only share a generate() call when they sample alike
+        return tuple(sorted(self.sampling.items()))
+
+
+class BatchStopCriteria(StoppingCriteria):
+    """
+    Per-row stopping for a batched generate(): each row has its own
+    StopCheck and token limit, and stops at EOS, independently of the rest.
+    """
+
+    def __init__(self, requests, eos_token_ids):
+        self.requests = requests
+        self.eos_token_ids = set(eos_token_ids)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        tokens = input_ids[:, -1].tolist()
+        for request, token in zip(self.requests, tokens):
+            if request.done:
+                continue
+            request.tokens += 1
+            if request.stop_check is not None:
+                request.stop_reason = request.stop_check.update(token)
+            request.done = (
+                request.stop_reason is not None
+                or token in self.eos_token_ids
+                or request.tokens >= request.max_new_tokens
+            )
+        done = [request.done for request in self.requests]
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class BatchTokenStreamer(BaseStreamer):
+    """
+    Fans each step's (batch,) tokens out to the per-request text streamers,
+    dropping the padding generate() emits for rows that already finished.
+    A row's streamer is ended as soon as BatchStopCriteria marks it done, so
+    its caller finishes while the rest of the batch keeps decoding.
+    """
+
+    def __init__(self, requests):
+        self.requests = requests
+        self._prompt_seen = False
+        self._step = 0
+        self._ended = [False] * len(requests)
+
+    def put(self, value):
+        if not self._prompt_seen:
+            # generate() first hands over the prompt ids
+            self._prompt_seen = True
+            return
+        # Depending on the transformers version the stopping criteria run
+        # before or after this call, so a row's last real token is step
+        # request.tokens either way
+        self._step += 1
+        for index, request in enumerate(self.requests):
+            if self._ended[index]:
+                continue
+            if not request.done or self._step <= request.tokens:
+                request.streamer.put(value[index : index + 1])
+            if request.done and self._step >= request.tokens:
+                self._end_row(index)
+
+    def _end_row(self, index):
+        self._ended[index] = True
+        self.requests[index].streamer.end()
+
+    def end(self):
+        for index in range(len(self.requests)):
+            if not self._ended[index]:
+                self._end_row(index)
+
+
+def _left_pad(tensor, length, value=0):
+    missing = length - tensor.shape[1]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[1] = missing
+    padding = torch.full(shape, value, dtype=tensor.dtype, device=tensor.device)
+    return torch.cat([padding, tensor], dim=1)
+
+
+class MicroBatcher:
+    """
+    Dynamic micro-batching for one locally loaded model.
+
+    Requests submitted within `window_s` of the first queued one (and
+    sampling alike) are merged, up to `max_batch_size`, into one
+    left-padded model.generate() on a background thread. Each caller reads
+    its own tokens from its BatchRequest.streamer as they are produced.
+    """
+
+    def __init__(self, model, tokenizer, window_s=0.02, max_batch_size=4):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.window_s = window_s
+        self.max_batch_size = max_batch_size
+
+        eos = model.generation_config.eos_token_id
+        self.eos_token_ids = [eos] if isinstance(eos, int) else list(eos or [])
+        pad = model.generation_config.pad_token_id
+        self.pad_token_id = pad if pad is not None else self.eos_token_ids[0]
+
+        self._queue = queue.Queue()
+        self._held = collections.deque()  # taken from the queue, not batchable yet
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._waits = []
+        self._running = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._serve, name="micro-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, inputs, max_new_tokens, sampling, stop_check=None):
+        """Queue one prompt (processor output or encode_prompt() inputs)."""
+        request = BatchRequest(inputs, self.tokenizer, max_new_tokens, sampling, stop_check)
+        with self._lock:
+            if not self._closed:
+                self._queue.put(request)
+                return request
+        # Raced with close(): serve it alone rather than strand the caller
+        threading.Thread(target=self._run, args=([request],), daemon=True).start()
+        return request
+
+    def close(self):
+        """Stop once the requests already queued have been served."""
+        with self._lock:
+            self._closed = True
+            self._queue.put(None)
+
+    def stats(self):
+        with self._lock:
+            batches = sum(self._batch_sizes.values())
+            requests = sum(size * count for size, count in self._batch_sizes.items())
+            # The close() sentinel is not a request
+            queued = sum(request is not None for request in list(self._queue.queue))
+            return {
+                "queue_depth": queued + len(self._held),
+                "running": self._running,
+                "batches": batches,
+                "requests": requests,
+                "mean_batch_size": round(requests / batches, 2) if batches else 0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "mean_wait_s": round(sum(self._waits) / len(self._waits), 3) if self._waits else 0,
+            }
+
+    def _next(self, timeout=None):
+        if self._held:
+            return self._held.popleft()
+        return self._queue.get(timeout=timeout)
+
+    def _serve(self):
+        closing = False
+        while not (closing and not self._held):
+            first = self._next()
+            if first is None:
+                closing = True
+                continue
+            batch = [first]
+            deferred = []
+            deadline = time.monotonic() + self.window_s
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 and not self._held:
+                    break
+                try:
+                    request = self._next(timeout=max(remaining, 0))
+                except queue.Empty:
+                    break
+                if request is None:
+                    closing = True
+                    break
+                if request.sampling_key == first.sampling_key:
+                    batch.append(request)
+                else:
+                    deferred.append(request)
+            # Keep arrival order for what could not join this batch
+            self._held.extendleft(reversed(deferred))
+            self._run(batch)
+
+    def _run(self, batch):
+        started = time.monotonic()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._waits.extend(started - request.submitted for request in batch)
+            del self._waits[:-1000]
+            self._running = len(batch)
+        streamer = BatchTokenStreamer(batch)
+        try:
+            prompts = []
+            for request in batch:
+                inputs = request.inputs
+                if "inputs_embeds" not in inputs:
+                    inputs = encode_prompt(self.model, inputs)
+                prompts.append(inputs)
+
+            length = max(inputs["input_ids"].shape[1] for inputs in prompts)
+            generate_inputs = {
+                "input_ids": torch.cat(
+                    [_left_pad(p["input_ids"], length, self.pad_token_id) for p in prompts]
+                ),
+                "attention_mask": torch.cat(
+                    [_left_pad(p["attention_mask"], length) for p in prompts]
+                ),
+                "inputs_embeds": torch.cat(
+                    [_left_pad(p["inputs_embeds"], length) for p in prompts]
+                ),
+            }
+            with torch.no_grad():
+                self.model.generate(
+                    **generate_inputs,
+                    **batch[0].sampling,
+                    max_new_tokens=max(request.max_new_tokens for request in batch),
+                    pad_token_id=self.pad_token_id,
+                    use_cache=True,
+                    stopping_criteria=[BatchStopCriteria(batch, self.eos_token_ids)],
+                    streamer=streamer,
+                )
+        except Exception as e:
+            for request in batch:
+                request.error = e
+        finally:
+            streamer.end()
+            with self._lock:
+                self._running = 0
+        print(
+            f"Micro-batch of {len(batch)} done in {time.monotonic() - started:.2f}s "
+            f"({self.stats()['queue_depth']} queued)"
+        )
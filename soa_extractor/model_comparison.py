@@ -0,0 +1,96 @@
+import difflib
+import itertools
+from dataclasses import dataclass
+
+
+@dataclass
+class PageRun:
+    """One model's OCR of one page. `load_s` and `warm_up_s` are set on a model's first page."""
+
+    model: str
+    page: int
+    text: str = ""
+    latency_s: float = 0.0
+    tokens: int = None
+    load_s: float = 0.0
+    warm_up_s: float = 0.0
+    error: str = None
+
+
+def similarity(a, b):
+    """Word-level difflib ratio of two outputs, 1.0 when identical."""
+    return difflib.SequenceMatcher(None, a.split(), b.split(), autojunk=False).ratio()
+
+
+def summarize(runs, models):
+    """Per-model totals: pages, errors, latency, tokens/s, output length, load and warm-up time."""
+    rows = []
+    for model in models:
+        ok = [run for run in runs if run.model == model and run.error is None]
+        failed = [run for run in runs if run.model == model and run.error is not None]
+        latency = sum(run.latency_s for run in ok)
+        tokens = sum(run.tokens for run in ok if run.tokens is not None)
+        counted = any(run.tokens is not None for run in ok)
+        rows.append(
+            {
+                "model": model,
+                "pages": len(ok),
+                "errors": len(failed),
+                "load_s": round(sum(run.load_s for run in runs if run.model == model), 2),
+                "warm_up_s": round(sum(run.warm_up_s for run in runs if run.model == model), 2),
+                "mean_latency_s": round(latency / len(ok), 2) if ok else None,
+                "tokens": tokens if counted else None,
+                "tokens_per_s": round(tokens / latency, 1) if counted and latency else None,
+                "mean_chars": round(sum(len(run.text) for run in ok) / len(ok)) if ok else None,
+            }
+        )
+    return rows
+
+
+def pairwise_similarity(runs, models):
+    """{(model_a, model_b): mean similarity over the pages both got through}."""
+    texts = {(run.model, run.page): run.text for run in runs if run.error is None}
+    pairs = {}
+    for a, b in itertools.combinations(models, 2):
+        pages = sorted({page for model, page in texts if model == a} & {page for model, page in texts if model == b})
+        if pages:
+            scores = [similarity(texts[(a, page)], texts[(b, page)]) for page in pages]
+            pairs[(a, b)] = sum(scores) / len(scores)
+    return pairs
+
+
+def unified_diffs(runs, model_a, model_b, context=1):
+    """Line diff of the two models' outputs, page by page."""
+    texts = {(run.model, run.page): run.text for run in runs if run.error is None}
+    pages = sorted(page for model, page in texts if model == model_a and (model_b, page) in texts)
+    out = []
+    for page in pages:
+        diff = difflib.unified_diff(
+            texts[(model_a, page)].splitlines(),
+            texts[(model_b, page)].splitlines(),
+            fromfile=f"{model_a} page {page + 1}",
+            tofile=f"{model_b} page {page + 1}",
+            n=context,
+            lineterm="",
+        )
+        out.extend(diff)
+    return "\n".join(out)
+
+
+def format_markdown(summary, pairs):
+    """Markdown tables for the demo's comparison tab."""
+    lines = [
+        "| Model | Pages | Errors | Load s | Warm-up s | Mean latency s | Tokens | Tokens/s | Mean chars |",
+        "|---|---|---|---|---|---|---|---|---|",
+    ]
+    for row in summary:
+        cells = [row["model"]] + [
+            "-" if row[key] is None else str(row[key])
+            for key in ("pages", "errors", "load_s", "warm_up_s", "mean_latency_s", "tokens", "tokens_per_s", "mean_chars")
+        ]
+        lines.append("| " + " | ".join(cells) + " |")
+    if pairs:
+        lines += ["", "| Model A | Model B | Word similarity |", "|---|---|---|"]
+        for (a, b), score in pairs.items():
+            lines.append(f"| {a} | {b} | {score:.3f} |")
+    return "\n".join(lines)
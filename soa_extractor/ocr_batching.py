@@ -0,0 +1,209 @@
+import inspect
+
+import torch
+
+
+def _cache_tensors(cache):
+    """Return the per-layer [key, value] tensors of a DynamicCache."""
+    if hasattr(cache, "layers"):
+        return [(layer.keys, layer.values) for layer in cache.layers]
+    return list(zip(cache.key_cache, cache.value_cache))
+
+
+def _set_cache_tensors(cache, tensors):
+    if hasattr(cache, "layers"):
+        for layer, (keys, values) in zip(cache.layers, tensors):
+            layer.keys = keys
+            layer.values = values
+    else:
+        cache.key_cache = [keys for keys, _ in tensors]
+        cache.value_cache = [values for _, values in tensors]
+
+
+def _left_pad(tensor, length, dim):
+    missing = length - tensor.shape[dim]
+    if missing <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = missing
+    padding = torch.zeros(shape, dtype=tensor.dtype, device=tensor.device)
+    return torch.cat([padding, tensor], dim=dim)
+
+
+class _Row:
+    def __init__(self, key, position, stop_check=None):
+        self.key = key
+        self.position = position
+        self.stop_check = stop_check
+        self.stop_reason = None
+        self.tokens = []
+
+
+class ContinuousBatchEngine:
+    """
+    In-flight (continuous) batching for greedy OCR decoding.
+
+    Up to `max_batch_size` pages decode together in one batched forward pass.
+    A page that finishes leaves the batch immediately and the next page is
+    prefilled into the free slot, so short pages never wait for the longest
+    one. Sequences of different lengths share a left-padded KV cache.
+
+    `stop_check_factory(key)` may return a StopCheck (see ocr_stopping) that
+    can end a page early; its reason is reported alongside the tokens.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size=4,
+        max_new_tokens=1024,
+        eos_token_ids=None,
+        stop_check_factory=None,
+    ):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.stop_check_factory = stop_check_factory
+
+        if eos_token_ids is None:
+            eos_token_ids = model.generation_config.eos_token_id
+        if isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        self.eos_token_ids = set(eos_token_ids or [])
+
+        self._keep_last_logits = (
+            "logits_to_keep" in inspect.signature(model.forward).parameters
+        )
+        self._rows = []
+        self._cache = None
+        self._mask = None
+        self._next_tokens = None
+
+    def run(self, requests):
+        """
+        Decode an iterable of (key, inputs) pairs, where `inputs` is the
+        processor output already moved to the model device.
+        Yields (key, generated_token_ids, stop_reason) in completion order,
+        where stop_reason is None unless a stop check ended the page.
+        Requests are pulled lazily, only when a batch slot is free.
+        """
+        requests = iter(requests)
+        exhausted = False
+
+        while True:
+            while not exhausted and len(self._rows) < self.max_batch_size:
+                try:
+                    key, inputs = next(requests)
+                except StopIteration:
+                    exhausted = True
+                    break
+                yield from self._admit(key, inputs)
+
+            if not self._rows:
+                if exhausted:
+                    return
+                continue
+
+            yield from self._step()
+
+    def _forward(self, **kwargs):
+        if self._keep_last_logits:
+            kwargs["logits_to_keep"] = 1
+        with torch.no_grad():
+            outputs = self.model(**kwargs, use_cache=True)
+        return outputs.logits[:, -1, :].argmax(dim=-1), outputs.past_key_values
+
+    def _push_token(self, row, token):
+        """Record a new token; returns True when the row is finished."""
+        row.tokens.append(token)
+        if row.stop_check is not None:
+            row.stop_reason = row.stop_check.update(token)
+        return (
+            row.stop_reason is not None
+            or token in self.eos_token_ids
+            or len(row.tokens) >= self.max_new_tokens
+        )
+
+    def _admit(self, key, inputs):
+        """Prefill one page and merge it into the running batch."""
+        next_token, cache = self._forward(**inputs)
+        mask = inputs.get("attention_mask")
+        if mask is None:
+            mask = torch.ones_like(inputs["input_ids"])
+
+        stop_check = self.stop_check_factory(key) if self.stop_check_factory else None
+        row = _Row(key, position=mask.shape[1], stop_check=stop_check)
+        if self._push_token(row, int(next_token[0])):
+            yield row.key, row.tokens, row.stop_reason
+            return
+
+        if not self._rows:
+            self._cache, self._mask, self._next_tokens = cache, mask, next_token
+        else:
+            length = max(self._mask.shape[1], mask.shape[1])
+            merged = []
+            for (batch_k, batch_v), (new_k, new_v) in zip(
+                _cache_tensors(self._cache), _cache_tensors(cache)
+            ):
+                merged.append(
+                    (
+                        torch.cat([_left_pad(batch_k, length, 2), _left_pad(new_k, length, 2)]),
+                        torch.cat([_left_pad(batch_v, length, 2), _left_pad(new_v, length, 2)]),
+                    )
+                )
+            _set_cache_tensors(self._cache, merged)
+            self._mask = torch.cat(
+                [_left_pad(self._mask, length, 1), _left_pad(mask, length, 1)]
+            )
+            self._next_tokens = torch.cat([self._next_tokens, next_token])
+
+        self._rows.append(row)
+
+    def _step(self):
+        """Decode one token for every active row, then evict finished rows."""
+        device = self._mask.device
+        self._mask = torch.cat(
+            [self._mask, self._mask.new_ones((len(self._rows), 1))], dim=1
+        )
+        positions = torch.tensor(
+            [[row.position] for row in self._rows], dtype=torch.long, device=device
+        )
+
+        next_tokens, self._cache = self._forward(
+            input_ids=self._next_tokens.unsqueeze(-1),
+            attention_mask=self._mask,
+            position_ids=positions,
+            past_key_values=self._cache,
+        )
+
+        keep = []
+        for index, (row, token) in enumerate(zip(self._rows, next_tokens.tolist())):
+            row.position += 1
+            if self._push_token(row, token):
+                yield row.key, row.tokens, row.stop_reason
+            else:
+                keep.append(index)
+
+        if len(keep) == len(self._rows):
+            self._next_tokens = next_tokens
+            return
+
+        self._rows = [self._rows[i] for i in keep]
+        if not self._rows:
+            self._cache = self._mask = self._next_tokens = None
+            return
+
+        index = torch.tensor(keep, dtype=torch.long, device=device)
+        self._next_tokens = next_tokens[index]
+        self._mask = self._mask[index]
+
+        # Drop leading columns that are padding for every remaining row.
+        start = int(self._mask.any(dim=0).long().argmax())
+        self._mask = self._mask[:, start:]
+        _set_cache_tensors(
+            self._cache,
+            [
+                (keys[index, :, start:], values[index, :, start:])
+                for keys, values in _cache_tensors(self._cache)
+            ],
+        )
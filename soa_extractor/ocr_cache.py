@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# Bumped whenever make_key changes; a cache written with another version is
+# cleared on open instead of being looked up with keys it was not built for
+SCHEMA_VERSION = 2
+
+
+class OCRCache:
+    """
+    Persistent page -> markdown cache stored in a single SQLite file.
+    Entries are content-addressed (see make_key) and evicted least recently
+    used first once the stored text exceeds max_bytes.
+    """
+
+    def __init__(self, path, max_bytes=512 * 1024 * 1024):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        version = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS entries")
+            self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " key TEXT PRIMARY KEY, text TEXT NOT NULL,"
+            " size INTEGER NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)"
+        )
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(image, model_id, render_scale, max_new_tokens, dtype=None, quantize=None):
+        """
+        Hash of the page bitmap plus every setting that changes the output.
+        `dtype` is the weights' dtype and `quantize` describes int8 loading
+        (e.g. {"vision": True}), None when the model is not quantised.
+        """
+        if image.mode == "RGBX":
+            # RenderPool bitmaps: key them like the same page rendered as RGB
+            image = image.convert("RGB")
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(f"{image.mode}:{image.size[0]}x{image.size[1]}".encode())
+        digest.update(image.tobytes())
+        digest.update(
+            json.dumps(
+                [model_id, render_scale, max_new_tokens, str(dtype), quantize], sort_keys=True
+            ).encode()
+        )
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute(
+                "UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key)
+            )
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, text, size, last_access)"
+                " VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        doomed = []
+        for key, size in self._conn.execute(
+            "SELECT key, size FROM entries ORDER BY last_access"
+        ):
+            if total <= self.max_bytes:
+                break
+            doomed.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,5 +1,9 @@
+import itertools
 import os
-import time
+import threading
+from dataclasses import dataclass
+from typing import Optional
+
 import torch
 import pypdfium2 as pdfium
 from PIL import Image
@@ -8,47 +12,238 @@ from transformers import (
     LightOnOcrProcessor,
 )
 
+from soa_extractor.error_system import ERRORS, log_event
+from soa_extractor.ocr_batching import ContinuousBatchEngine
+from soa_extractor.ocr_stopping import (
+    CancelToken,
+    DeadlineCheck,
+    EarlyIgnoreCheck,
+    RepetitionCheck,
+    StopCheckCriteria,
+    StopChecks,
+)
+from soa_extractor.prefetch import prefetch
+from soa_extractor.quantization import load_quantized
+from soa_extractor.render_pool import RenderedPage, RenderPool
+from soa_extractor.snapshot import (
+    StageTimer,
+    has_snapshot,
+    load_snapshot,
+    snapshot_path,
+    warm_up,
+)
+from soa_extractor.rendering import (
+    PDFIUM_LOCK,
+    BlankPage,
+    blank_page_check,
+    plan_render,
+    render_planned,
+    trim_image,
+)
+from soa_extractor.text_layer import page_text_markdown
+
+
+@dataclass
+class PreparedPage:
+    """Model-ready inputs for one page, plus its OCR cache key if caching."""
+
+    inputs: dict
+    cache_key: Optional[str] = None
+
 
 class OCRService:
-    def __init__(self, model_name="lightonai/LightOnOCR-2-1B", max_new_tokens=1024):
+    # Stop reason reported by extract_pages for pages that were skipped
+    BLANK_REASON = "blank"
+
+    def __init__(
+        self,
+        model_name="lightonai/LightOnOCR-2-1B",
+        max_new_tokens=1024,
+        batch_size=1,
+        early_exit_rules=None,
+        use_text_layer=False,
+        cache=None,
+        prefetch_pages=0,
+        prefetch_workers=1,
+        render_workers=0,
+        blank_page=None,
+        render_mode="fixed",
+        trim_margins=False,
+        repetition_check=None,
+        repetition_retry_penalty=None,
+        page_timeout=None,
+        request_timeout=None,
+        quantize=None,
+        snapshot_dir=None,
+        warm_up=False,
+    ):
         self.model_name = model_name
         self.max_new_tokens = max_new_tokens
+        # batch_size > 1 decodes several pages at once with continuous batching
+        self.batch_size = batch_size
+        # Page classification rules; when set, pages whose header is already
+        # "Ignore" stop decoding early and are not yielded by process_pdf
+        self.early_exit_rules = early_exit_rules
+        # Take markdown straight from a usable PDF text layer instead of OCR
+        self.use_text_layer = use_text_layer
+        # Optional OCRCache consulted before the model is touched
+        self.cache = cache
+        # Pages rendered and preprocessed ahead of the decoder (0 = inline)
+        self.prefetch_pages = prefetch_pages
+        self.prefetch_workers = prefetch_workers
+        # Worker processes rasterising pages (0 = render in this process)
+        self.render_workers = render_workers
+        self.render_pool = None
+        # Thresholds for rendering.blank_page_check; None OCRs every page
+        self.blank_page = blank_page
+        # "fixed" renders every page at render_scale; "adaptive" lowers the
+        # scale for pages whose smallest text stays legible (see rendering.py)
+        self.render_mode = render_mode
+        # Crop blank margins before OCR so the vision tower encodes less
+        self.trim_margins = trim_margins
+        # RepetitionCheck settings ({} for defaults, None to disable); pages
+        # that loop are cut short and, with a retry penalty, decoded again
+        # once with repetition_penalty set
+        self.repetition_check = repetition_check
+        self.repetition_retry_penalty = repetition_retry_penalty
+        # Wall-clock budgets in seconds (None = unlimited). A page over
+        # page_timeout is cut short and dropped; once request_timeout passes,
+        # process_pdf stops decoding and OCRs no further pages
+        self.page_timeout = page_timeout
+        self.request_timeout = request_timeout
+        # load_quantized options ({"vision": bool, "cache_dir": path}) for
+        # int8 dynamic quantisation on CPU; None keeps float32 weights
+        self.quantize = quantize
+        # Root of prepared snapshots (python -m soa_extractor.snapshot
+        # prepare); a matching one is memory-mapped instead of from_pretrained
+        self.snapshot_dir = snapshot_dir
+        # Run one tiny generation at load time so the first page is not slower
+        self.warm_up = warm_up
+        self.render_scale = 2.77
+        self.max_resolution = 1540
         self.device = "cuda" if torch.cuda.is_available() else "cpu"
         self.dtype = torch.bfloat16 if self.device == "cuda" else torch.float32
         self.attn_implementation = "sdpa" if self.device == "cuda" else "eager"
         self.model = None
         self.processor = None
+        self._load_lock = threading.RLock()
+
+    def start_render_pool(self):
+        """
+        Starts the render worker processes (when render_workers > 0). Call it
+        before the model or any vLLM engine is loaded, so the workers can
+        still be forked; process_pdf starts the pool itself if needed.
+        """
+        if self.render_workers > 0 and self.render_pool is None:
+            self.render_pool = RenderPool(
+                workers=self.render_workers,
+                max_resolution=self.render_cap(),
+                scale=self.render_scale,
+                blank_page=self.blank_page,
+                render_mode=self.render_mode,
+                trim_margins=self.trim_margins,
+            )
+
+    def close(self):
+        if self.render_pool is not None:
+            self.render_pool.close()
+            self.render_pool = None
 
     def load_model(self):
         if self.model is not None:
             return
+        with self._load_lock:
+            if self.model is None:
+                self._load_model()
+
+    def snapshot(self):
+        """Path of the prepared snapshot for this model and dtype, or None."""
+        if self.snapshot_dir is None:
+            return None
+        path = snapshot_path(self.snapshot_dir, self.model_name, self.dtype)
+        return path if has_snapshot(path) else None
 
+    def _load_model(self):
         print(f"Loading OCR model: {self.model_name}...")
-        start_time = time.time()
-        self.model = (
-            LightOnOcrForConditionalGeneration.from_pretrained(
-                self.model_name,
+        timer = StageTimer()
+        snapshot = self.snapshot()
+        if self.quantize is not None and self.device == "cpu":
+            with timer.stage("load int8"):
+                model = load_quantized(
+                    LightOnOcrForConditionalGeneration,
+                    self.model_name,
+                    trust_remote_code=True,
+                    **self.quantize,
+                )
+        elif snapshot is not None:
+            model = load_snapshot(
+                LightOnOcrForConditionalGeneration,
+                snapshot,
+                device=self.device,
                 attn_implementation=self.attn_implementation,
-                torch_dtype=self.dtype,
-                trust_remote_code=True,
+                timer=timer,
             )
-            .to(self.device)
-            .eval()
-        )
-        self.processor = LightOnOcrProcessor.from_pretrained(
-            self.model_name, trust_remote_code=True
-        )
-        print(f"OCR Model loaded in {time.time() - start_time:.2f}s")
-
-    def render_pdf_page(self, page, max_resolution=1540, scale=2.77):
-        width, height = page.get_size()
-        pixel_width = width * scale
-        pixel_height = height * scale
-        resize_factor = min(
-            1, max_resolution / pixel_width, max_resolution / pixel_height
+        else:
+            if self.quantize is not None:
+                print("int8 quantisation is CPU-only; loading bfloat16 weights on GPU")
+            if self.snapshot_dir is not None:
+                print(
+                    f"No {self.dtype} snapshot of {self.model_name} in "
+                    f"{self.snapshot_dir}; loading from the checkpoint"
+                )
+            with timer.stage("from_pretrained"):
+                model = LightOnOcrForConditionalGeneration.from_pretrained(
+                    self.model_name,
+                    attn_implementation=self.attn_implementation,
+                    torch_dtype=self.dtype,
+                    trust_remote_code=True,
+                )
+            with timer.stage(f"to({self.device})"):
+                model = model.to(self.device).eval()
+        with timer.stage("processor"):
+            self.load_processor()
+        if self.warm_up:
+            with timer.stage("warm-up"):
+                image = Image.new("RGB", (448, 448), "white")
+                warm_up(model, self.prepare_inputs(image))
+        self.model = model
+        print(f"OCR Model loaded in {timer.total:.2f}s ({timer.report()})")
+
+    def load_processor(self):
+        """The processor alone is cheap; rendering needs it before the model."""
+        if self.processor is not None:
+            return
+        with self._load_lock:
+            if self.processor is None:
+                # A snapshot carries the processor files too (no Hub access)
+                self.processor = LightOnOcrProcessor.from_pretrained(
+                    self.snapshot() or self.model_name, trust_remote_code=True
+                )
+
+    def render_cap(self):
+        """
+        Longest rendered side. In adaptive mode this is also capped by the
+        processor's own resize target, since larger renders are just
+        downscaled again before the vision encoder sees them.
+        """
+        if self.render_mode != "adaptive":
+            return self.max_resolution
+        self.load_processor()
+        size = getattr(self.processor.image_processor, "size", None) or {}
+        return min(self.max_resolution, size.get("longest_edge", self.max_resolution))
+
+    def plan_pdf_page(self, page, max_resolution=None, scale=None):
+        return plan_render(
+            page,
+            max_resolution=max_resolution or self.render_cap(),
+            scale=scale or self.render_scale,
+            mode=self.render_mode,
+            trim=self.trim_margins,
         )
-        target_scale = scale * resize_factor
-        return page.render(scale=target_scale, rev_byteorder=True).to_pil()
+
+    def render_pdf_page(self, page, max_resolution=None, scale=None):
+        plan = self.plan_pdf_page(page, max_resolution, scale)
+        return render_planned(page, plan).to_pil()
 
     def clean_output_text(self, text):
         markers_to_remove = ["system", "user", "assistant"]
@@ -69,10 +264,8 @@ class OCRService:
 
         return cleaned
 
-    def extract_text_from_image(self, image):
-        if self.model is None:
-            self.load_model()
-
+    def prepare_inputs(self, image):
+        """Apply the chat template to an image and move tensors to the device."""
         chat = [
             {
                 "role": "user",
@@ -90,7 +283,7 @@ class OCRService:
             return_tensors="pt",
         )
 
-        inputs = {
+        return {
             k: (
                 v.to(device=self.device, dtype=self.dtype)
                 if isinstance(v, torch.Tensor)
@@ -100,6 +293,42 @@ class OCRService:
             for k, v in inputs.items()
         }
 
+    def make_stop_check(self, cancel=None):
+        """
+        Returns a fresh per-page StopCheck, or None if none is enabled.
+        `cancel` is the request's CancelToken, if any.
+        """
+        checks = []
+        if self.early_exit_rules:
+            checks.append(
+                EarlyIgnoreCheck(
+                    self.processor.tokenizer,
+                    self.early_exit_rules,
+                    postprocess=self.clean_output_text,
+                )
+            )
+        if self.repetition_check is not None:
+            checks.append(
+                RepetitionCheck(self.processor.tokenizer, **self.repetition_check)
+            )
+        if self.page_timeout or cancel is not None:
+            checks.append(DeadlineCheck(self.page_timeout, cancel))
+        if len(checks) > 1:
+            return StopChecks(checks)
+        return checks[0] if checks else None
+
+    def generate(self, inputs, cancel=None, **generation_kwargs):
+        """
+        Decode one page. Returns (markdown_text, stop_reason). Decoding stops
+        at the next token once `cancel` (a CancelToken) trips. Extra keyword
+        arguments are passed on to model.generate().
+        """
+        criteria = None
+        stop_check = self.make_stop_check(cancel)
+        if stop_check is not None:
+            criteria = StopCheckCriteria(stop_check)
+            generation_kwargs["stopping_criteria"] = [criteria]
+
         with torch.no_grad():
             outputs = self.model.generate(
                 **inputs,
@@ -108,26 +337,341 @@ class OCRService:
                 top_p=0.9,
                 use_cache=True,
                 do_sample=False,
+                **generation_kwargs,
             )
 
         output_text = self.processor.decode(outputs[0], skip_special_tokens=True)
-        return self.clean_output_text(output_text)
+        return self.clean_output_text(output_text), criteria and criteria.reason
 
-    def process_pdf(self, pdf_path):
+    def cache_key(self, image):
+        if self.cache is None:
+            return None
+        # int8 and float weights give different text, so they never share entries
+        quantize = None
+        if self.quantize is not None and self.device == "cpu":
+            quantize = {"vision": bool(self.quantize.get("vision", False))}
+        return self.cache.make_key(
+            image,
+            self.model_name,
+            self.render_scale,
+            self.max_new_tokens,
+            dtype=self.dtype,
+            quantize=quantize,
+        )
+
+    def prepare_page(self, image):
+        """
+        Cache lookup plus preprocessing for one image. Returns the cached
+        markdown (str) on a hit, otherwise a PreparedPage ready to decode.
+        Safe to call from prefetch worker threads.
+        """
+        key = self.cache_key(image)
+        if key is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                return cached
+
+        self.load_model()
+        return PreparedPage(self.prepare_inputs(image), key)
+
+    def retry_repetition(self, key, prepared, text, stop_reason, cancel=None):
+        """Decode a page that looped once more with a repetition penalty."""
+        if stop_reason != RepetitionCheck.REASON or not self.repetition_retry_penalty:
+            return text, stop_reason
+        print(
+            f"  Page {key}: output started repeating; retrying with "
+            f"repetition_penalty={self.repetition_retry_penalty}"
+        )
+        return self.generate(
+            prepared.inputs,
+            cancel=cancel,
+            repetition_penalty=self.repetition_retry_penalty,
+        )
+
+    def store_result(self, prepared, text, stop_reason):
+        # Pages cut short depend on more than the key, so only full pages are kept
+        if prepared.cache_key is not None and stop_reason is None:
+            self.cache.put(prepared.cache_key, text)
+
+    def ocr_image(self, image, cancel=None):
+        """
+        OCR one image through the cache. Returns (markdown_text, stop_reason).
+        Decoded like a page of process_pdf: stop checks, the repetition retry
+        and page_timeout apply, and request_timeout unless `cancel` (a
+        CancelToken) is given.
+        """
+        if cancel is None and self.request_timeout:
+            cancel = CancelToken(self.request_timeout)
+        _, text, stop_reason = next(self.extract_pages([(1, image)], cancel))
+        return text, stop_reason
+
+    def extract_text_from_image(self, image):
+        if self.trim_margins:
+            image, _ = trim_image(image)
+        text, _ = self.ocr_image(image)
+        return text
+
+    def extract_texts(self, images, cancel=None):
+        """
+        Yields (index, markdown_text, stop_reason) for an iterable of images,
+        in input order. stop_reason is None for pages that decoded normally.
+        Images are consumed lazily, so a generator of rendered pages is fine.
+        request_timeout applies unless `cancel` (a CancelToken) is given.
+        """
+        if cancel is None and self.request_timeout:
+            cancel = CancelToken(self.request_timeout)
+        return self.extract_pages(enumerate(images), cancel)
+
+    def extract_pages(self, pages, cancel=None):
+        """
+        Yields (key, markdown_text, stop_reason) for an iterable of
+        (key, payload) pairs, in input order. The payload is an image to OCR,
+        a PreparedPage from prepare_page, a str holding markdown that is
+        already known, which is passed through untouched, or None for a page
+        to skip, reported as ("", BLANK_REASON). The model is only loaded
+        once an image actually needs OCR.
+
+        Once `cancel` (a CancelToken) trips, pages being decoded stop with its
+        reason and no further pages are read.
+        """
+
+        def prepared_pages():
+            for key, payload in pages:
+                if cancel is not None and cancel.cancelled:
+                    return
+                if payload is not None and not isinstance(payload, (str, PreparedPage)):
+                    payload = self.prepare_page(payload)
+                yield key, payload
+
+        if self.batch_size <= 1:
+            for key, payload in prepared_pages():
+                if isinstance(payload, str):
+                    yield key, payload, None
+                    continue
+                if payload is None:
+                    yield key, "", self.BLANK_REASON
+                    continue
+                text, stop_reason = self.retry_repetition(
+                    key, payload, *self.generate(payload.inputs, cancel), cancel=cancel
+                )
+                self.store_result(payload, text, stop_reason)
+                yield key, text, stop_reason
+            return
+
+        # Pages finish out of order; hold them back until their turn comes.
+        keys = []
+        in_flight = {}
+        finished = {}
+
+        def requests():
+            for seq, (key, payload) in enumerate(prepared_pages()):
+                keys.append(key)
+                if isinstance(payload, str):
+                    finished[seq] = (payload, None)
+                    continue
+                if payload is None:
+                    finished[seq] = ("", self.BLANK_REASON)
+                    continue
+                in_flight[seq] = payload
+                yield seq, payload.inputs
+
+        pending = requests()
+        first = next(pending, None)
+        results = iter(())
+        if first is not None:
+            engine = ContinuousBatchEngine(
+                self.model,
+                max_batch_size=self.batch_size,
+                max_new_tokens=self.max_new_tokens,
+                stop_check_factory=lambda _: self.make_stop_check(cancel),
+            )
+            results = engine.run(itertools.chain([first], pending))
+
+        next_seq = 0
+        for seq, token_ids, stop_reason in results:
+            text = self.clean_output_text(
+                self.processor.decode(token_ids, skip_special_tokens=True)
+            )
+            prepared = in_flight.pop(seq)
+            text, stop_reason = self.retry_repetition(
+                keys[seq], prepared, text, stop_reason, cancel
+            )
+            finished[seq] = (text, stop_reason)
+            self.store_result(prepared, text, stop_reason)
+            while next_seq in finished:
+                yield (keys[next_seq], *finished.pop(next_seq))
+                next_seq += 1
+
+        # Known pages queued after the last OCR'd one
+        while next_seq in finished:
+            yield (keys[next_seq], *finished.pop(next_seq))
+            next_seq += 1
+
+    def read_pdf_page(self, pdf, index):
+        """
+        Text layer, blank check and render for page `index` of an open
+        PdfDocument. Returns the page's markdown (str) when its text layer is
+        used, a BlankPage, or a RenderedPage with the image and RenderPlan.
+        """
+        markdown = blank = None
+        with PDFIUM_LOCK:
+            page = pdf[index]
+            if self.use_text_layer:
+                markdown = page_text_markdown(page)
+            if markdown is None and self.blank_page is not None:
+                is_blank, ratio = blank_page_check(page, **self.blank_page)
+                blank = BlankPage(ratio) if is_blank else None
+            if markdown is None and blank is None:
+                plan = self.plan_pdf_page(page)
+                image = render_planned(page, plan).to_pil()
+            page.close()
+
+        if markdown is not None:
+            return markdown
+        if blank is not None:
+            return blank
+        return RenderedPage(index + 1, image, None, plan)
+
+    def report_trim(self, page_num, plan):
+        """Prints the vision tokens margin trimming saved on a page; returns them."""
+        if plan.tokens_saved > 0:
+            print(
+                f"  Page {page_num}: margins trimmed, "
+                f"~{plan.tokens_saved} vision tokens saved"
+            )
+        return plan.tokens_saved
+
+    def log_page(self, doc_id, page_num, text, stop_reason, ink_ratio=None):
+        """
+        Logs a page that was skipped or cut short. Returns True when the page
+        should be passed on, False for blank, "Ignore" and timed-out pages.
+        """
+        if stop_reason == self.BLANK_REASON:
+            log_event(
+                ERRORS.PAGE_BLANK,
+                "Blank page skipped before OCR",
+                doc_id=doc_id,
+                file=doc_id,
+                page=page_num,
+                level="INFO",
+                meta={"ink_ratio": None if ink_ratio is None else round(ink_ratio, 6)},
+            )
+            return False
+        if stop_reason == EarlyIgnoreCheck.REASON:
+            log_event(
+                ERRORS.PAGE_CLASS,
+                "Page classified as Ignore during OCR; decoding stopped early",
+                doc_id=doc_id,
+                file=doc_id,
+                page=page_num,
+                level="INFO",
+                meta={"partial_chars": len(text)},
+            )
+            return False
+        if stop_reason in (DeadlineCheck.TIMEOUT, DeadlineCheck.CANCELLED):
+            log_event(
+                ERRORS.OCR_TIMEOUT,
+                f"OCR stopped ({stop_reason}); partial page dropped",
+                doc_id=doc_id,
+                file=doc_id,
+                page=page_num,
+                meta={
+                    "partial_chars": len(text),
+                    "page_timeout": self.page_timeout,
+                    "reason": stop_reason,
+                },
+            )
+            return False
+        if stop_reason == RepetitionCheck.REASON:
+            # Kept (truncated) so extraction still sees the page
+            log_event(
+                ERRORS.OCR_REPEAT,
+                "OCR output looped; generation cut short",
+                doc_id=doc_id,
+                file=doc_id,
+                page=page_num,
+                meta={
+                    "chars": len(text),
+                    "retry_penalty": self.repetition_retry_penalty,
+                },
+            )
+        return True
+
+    def log_cancelled(self, doc_id, reason):
+        log_event(
+            ERRORS.OCR_TIMEOUT,
+            "Document abandoned before every page was OCR'd",
+            doc_id=doc_id,
+            file=doc_id,
+            meta={"reason": reason, "request_timeout": self.request_timeout},
+        )
+
+    def process_pdf(self, pdf_path, cancel=None):
         """
         Yields (page_number, markdown_text) for each page.
+        Pages stopped early as "Ignore" are logged and not yielded.
+
+        Pages cut short by page_timeout are logged and dropped. `cancel` is a
+        CancelToken the caller can trip to abandon the document; by default
+        one is made from request_timeout.
         """
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"{pdf_path} not found")
 
-        pdf = pdfium.PdfDocument(pdf_path)
-        total_pages = len(pdf)
+        doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+        if cancel is None:
+            cancel = CancelToken(self.request_timeout)
+        pdf = None
+        # page_num -> ink ratio of pages skipped as blank
+        blank_pages = {}
+        tokens_saved = []
 
-        for i in range(total_pages):
-            page = pdf[i]
-            image = self.render_pdf_page(page)
-            # Simplification: skipping blank page check for now or can add it back
-            text = self.extract_text_from_image(image)
-            yield i + 1, text
+        def load_page(index):
+            # Runs on a prefetch worker when prefetch_pages > 0
+            return load_rendered((index + 1, self.read_pdf_page(pdf, index)))
+
+        def load_rendered(item):
+            page_num, payload = item
+            if isinstance(payload, BlankPage):
+                blank_pages[page_num] = payload.ink_ratio
+                return page_num, None
+            if isinstance(payload, str):
+                print(f"  Page {page_num}: using PDF text layer")
+                return page_num, payload
+            saved = self.report_trim(page_num, payload.plan)
+            if saved > 0:
+                tokens_saved.append(saved)
+            # A pool bitmap lives in a shared slot; hand it back once preprocessed
+            with payload:
+                return page_num, self.prepare_page(payload.image)
+
+        if self.render_workers > 0:
+            self.start_render_pool()
+            load, items = load_rendered, self.render_pool.pages(
+                pdf_path, use_text_layer=self.use_text_layer
+            )
+        else:
+            pdf = pdfium.PdfDocument(pdf_path)
+            load, items = load_page, range(len(pdf))
+
+        pages = prefetch(
+            load, items, depth=self.prefetch_pages, workers=self.prefetch_workers
+        )
 
-        pdf.close()
+        try:
+            for page_num, text, stop_reason in self.extract_pages(pages, cancel):
+                if self.log_page(
+                    doc_id, page_num, text, stop_reason, blank_pages.pop(page_num, None)
+                ):
+                    yield page_num, text
+            if cancel.cancelled:
+                self.log_cancelled(doc_id, cancel.reason)
+            if tokens_saved:
+                print(
+                    f"Margin trimming saved ~{sum(tokens_saved)} vision tokens "
+                    f"over {len(tokens_saved)} pages of {doc_id}"
+                )
+        finally:
+            pages.close()
+            if pdf is not None:
+                pdf.close()
@@ -0,0 +1,238 @@
+import threading
+import time
+
+import torch
+from transformers import StoppingCriteria
+
+from soa_extractor.pipeline.page_classifier import classify_page_prefix
+
+
+class StopCheck:
+    """
+    Watches one page's generated tokens as they are produced.
+    update() is called once per new token and returns a stop reason
+    (a short string) to end generation, or None to continue.
+    """
+
+    def update(self, token_id):
+        raise NotImplementedError
+
+
+class StopChecks(StopCheck):
+    """Runs several checks and stops on the first one that fires."""
+
+    def __init__(self, checks):
+        self.checks = list(checks)
+
+    def update(self, token_id):
+        for check in self.checks:
+            reason = check.update(token_id)
+            if reason:
+                return reason
+        return None
+
+
+class EarlyIgnoreCheck(StopCheck):
+    """
+    Classifies the partial OCR output and stops as soon as the page is
+    confidently "Ignore". Only the header matters to classify_page, so the
+    check switches itself off once the header is decided either way.
+    """
+
+    REASON = "ignore"
+
+    def __init__(self, tokenizer, rules, postprocess=None, check_every=8, max_header_tokens=1024):
+        self.tokenizer = tokenizer
+        self.rules = rules
+        self.postprocess = postprocess
+        self.check_every = check_every
+        self.max_header_tokens = max_header_tokens
+        self.tokens = []
+        self.done = False
+
+    def update(self, token_id):
+        if self.done:
+            return None
+
+        self.tokens.append(token_id)
+        if len(self.tokens) % self.check_every:
+            return None
+        if len(self.tokens) > self.max_header_tokens:
+            # Header is unusually long; let the page decode normally
+            self.done = True
+            return None
+
+        text = self.tokenizer.decode(self.tokens, skip_special_tokens=True)
+        if self.postprocess:
+            text = self.postprocess(text)
+
+        page_type, is_final = classify_page_prefix(text, self.rules)
+        if not is_final:
+            return None
+
+        self.done = True
+        return self.REASON if page_type == "Ignore" else None
+
+
+def _skip_space(text, end):
+    while end and text[end - 1].isspace():
+        end -= 1
+    return end
+
+
+def _skip_rows(text, end):
+    """Start of the whitespace and <tr>/</tr> tags that text[:end] ends with."""
+    while True:
+        end = _skip_space(text, end)
+        if text.endswith("<tr>", 0, end):
+            end -= len("<tr>")
+        elif text.endswith("</tr>", 0, end):
+            end -= len("</tr>")
+        else:
+            return end
+
+
+class RepetitionCheck(StopCheck):
+    """
+    Stops a page that has started looping: the same span of up to
+    `max_period` tokens repeated back to back (duplicated table rows,
+    "-----" runs), or a long run of empty table cells.
+
+    For every period p, run[p] counts how many tokens in a row equalled the
+    token p positions earlier, so a loop is found in O(max_period) per token
+    without rescanning the output.
+    """
+
+    REASON = "repetition"
+
+    def __init__(
+        self,
+        tokenizer=None,
+        max_period=200,
+        min_repeats=6,
+        min_span=128,
+        max_empty_cells=64,
+        check_every=32,
+        window=512,
+    ):
+        self.tokenizer = tokenizer
+        self.max_period = max_period
+        self.min_repeats = min_repeats
+        self.min_span = min_span
+        self.max_empty_cells = max_empty_cells
+        self.check_every = check_every
+        self.window = window
+        self.tokens = []
+        self.runs = [0] * (max_period + 1)
+
+    def update(self, token_id):
+        tokens = self.tokens
+        tokens.append(token_id)
+        n = len(tokens)
+
+        runs = self.runs
+        for period in range(1, min(n - 1, self.max_period) + 1):
+            if tokens[-1 - period] == token_id:
+                runs[period] += 1
+                # `min_repeats` copies of the span, and long enough to matter
+                if runs[period] >= max(self.min_span, period * (self.min_repeats - 1)):
+                    return self.REASON
+            else:
+                runs[period] = 0
+
+        if self.tokenizer is not None and n % self.check_every == 0:
+            tail = self.tokenizer.decode(tokens[-self.window :], skip_special_tokens=True)
+            if self.trailing_empty_cells(tail) >= self.max_empty_cells:
+                return self.REASON
+        return None
+
+    @staticmethod
+    def trailing_empty_cells(text):
+        """
+        How many empty <td></td> cells `text` ends with, rows breaking
+        between them allowed, plus a last <td> still open. The last tag may
+        be incomplete. Scans back from the end in time linear in the run, so
+        it stays cheap on tails that almost match.
+        """
+        end = len(text)
+        start = text.rfind("<")
+        if start != -1 and ">" not in text[start:]:
+            end = start
+        end = _skip_space(text, end)
+        open_cell = text.endswith("<td>", 0, end)
+        if open_cell:
+            end -= len("<td>")
+        end = _skip_rows(text, end)
+
+        cells = 0
+        while text.endswith("</td>", 0, end):
+            inner = _skip_space(text, end - len("</td>"))
+            if not text.endswith("<td>", 0, inner):
+                break
+            cells += 1
+            end = _skip_rows(text, inner - len("<td>"))
+        return cells + open_cell if cells else 0
+
+
+class CancelToken:
+    """
+    Shared stop flag for one request. Any thread may cancel() it; with a
+    timeout it also trips by itself once the request deadline passes.
+    """
+
+    def __init__(self, timeout=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self._event = threading.Event()
+        self._reason = None
+
+    def cancel(self, reason=None):
+        self._reason = reason or DeadlineCheck.CANCELLED
+        self._event.set()
+
+    @property
+    def cancelled(self):
+        if self._event.is_set():
+            return True
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.cancel(DeadlineCheck.TIMEOUT)
+            return True
+        return False
+
+    @property
+    def reason(self):
+        return self._reason if self.cancelled else None
+
+
+class DeadlineCheck(StopCheck):
+    """
+    Stops a page when its own wall-clock budget (`timeout` seconds from
+    creation) runs out, or when the request's CancelToken trips.
+    """
+
+    TIMEOUT = "timeout"
+    CANCELLED = "cancelled"
+
+    def __init__(self, timeout=None, cancel=None):
+        self.deadline = time.monotonic() + timeout if timeout else None
+        self.cancel = cancel
+
+    def update(self, token_id):
+        if self.cancel is not None and self.cancel.cancelled:
+            return self.cancel.reason
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            return self.TIMEOUT
+        return None
+
+
+class StopCheckCriteria(StoppingCriteria):
+    """Adapts a StopCheck to model.generate() for a batch of one."""
+
+    def __init__(self, check):
+        self.check = check
+        self.reason = None
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.reason is None:
+            self.reason = self.check.update(int(input_ids[0, -1]))
+        done = self.reason is not None
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
@@ -0,0 +1,336 @@
+import multiprocessing
+import os
+import queue
+import time
+
+import pypdfium2 as pdfium
+import torch
+
+from soa_extractor.ocr_cache import OCRCache
+from soa_extractor.ocr_stopping import CancelToken, DeadlineCheck
+from soa_extractor.rendering import PDFIUM_LOCK, BlankPage
+
+# Worker -> parent message kinds
+_PAGE, _SKIPPED, _ERROR, _STATS = "page", "skipped", "error", "stats"
+
+
+def core_sets(processes, threads, cores=None):
+    """
+    Splits the CPUs this process may run on into `processes` disjoint sets of
+    `threads` cores (threads=0: an even share each). Returns None when
+    pinning is unavailable or there are not enough cores to go round.
+    """
+    if cores is None:
+        if not hasattr(os, "sched_getaffinity"):
+            return None
+        cores = sorted(os.sched_getaffinity(0))
+    threads = threads or max(1, len(cores) // processes)
+    if processes * threads > len(cores):
+        return None
+    return [cores[k * threads : (k + 1) * threads] for k in range(processes)]
+
+
+class _SharedCancel(CancelToken):
+    """
+    A worker's view of one document's cancellation: trips on the shared
+    per-document flag as well as on the document's request deadline.
+    """
+
+    def __init__(self, flags, doc, deadline):
+        super().__init__()
+        self.deadline = deadline
+        self._flags = flags
+        self._doc = doc
+
+    @property
+    def cancelled(self):
+        if self._flags[self._doc] and not self._event.is_set():
+            self.cancel()
+        if super().cancelled:
+            # Spare the other workers the rest of this document
+            self._flags[self._doc] = 1
+            return True
+        return False
+
+
+def _worker_main(service, cores, threads, tasks, results, flags, started):
+    """
+    Body of one worker process. The service (and its model) was inherited
+    from the parent via fork, so the weights are shared copy-on-write.
+    """
+    if cores is not None:
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+    if service.cache is not None:
+        # The parent's SQLite connection must not be used across fork
+        service.cache = OCRCache(service.cache.path, service.cache.max_bytes)
+
+    open_path, pdf = None, None
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        doc, pdf_path, index = task
+        page_num = index + 1
+
+        deadline = None
+        if service.request_timeout:
+            with started.get_lock():
+                # The document's clock starts when its first page is picked up
+                if not started[doc]:
+                    started[doc] = time.monotonic()
+            deadline = started[doc] + service.request_timeout
+        cancel = _SharedCancel(flags, doc, deadline)
+        if cancel.cancelled:
+            results.put((_SKIPPED, doc, page_num, cancel.reason, None))
+            continue
+
+        try:
+            if pdf_path != open_path:
+                if pdf is not None:
+                    pdf.close()
+                pdf, open_path = pdfium.PdfDocument(pdf_path), pdf_path
+
+            payload = service.read_pdf_page(pdf, index)
+            if isinstance(payload, BlankPage):
+                results.put((_PAGE, doc, page_num, ("", service.BLANK_REASON), payload.ink_ratio))
+                continue
+            if isinstance(payload, str):
+                print(f"  Page {page_num}: using PDF text layer")
+                results.put((_PAGE, doc, page_num, (payload, None), None))
+                continue
+
+            service.report_trim(page_num, payload.plan)
+            _, text, stop_reason = next(
+                service.extract_pages([(page_num, payload.image)], cancel)
+            )
+            results.put((_PAGE, doc, page_num, (text, stop_reason), None))
+        except Exception as e:
+            results.put((_ERROR, doc, page_num, f"{type(e).__name__}: {e}", None))
+
+    cache = service.cache
+    results.put((_STATS, cache.hits if cache else 0, cache.misses if cache else 0, None, None))
+
+
+class OCRWorkerPool:
+    """
+    Runs OCR in `processes` worker processes, each pinned to its own set of
+    `threads` cores with torch.set_num_threads(threads). For a 1B model at
+    batch size 1, several narrow workers beat one process spread over every
+    core.
+
+    The model is loaded once in this process before the workers are forked,
+    so its weights are shared copy-on-write. Pages of all documents go
+    through one task queue, so a worker that finishes early picks up the
+    next document's pages instead of idling until the slowest page of the
+    current one is done. Requires the fork start method (Linux).
+    """
+
+    def __init__(self, service, processes, threads=0):
+        if "fork" not in multiprocessing.get_all_start_methods():
+            raise RuntimeError("OCRWorkerPool needs the fork start method")
+        if service.device != "cpu":
+            if service.model is not None:
+                raise ValueError(f"OCRWorkerPool needs a CPU model, not {service.device}")
+            # Workers always run on CPU; a GPU, if any, is left to the LLM
+            service.device, service.dtype = "cpu", torch.float32
+            service.attn_implementation = "eager"
+        self.service = service
+        self.processes = processes
+        if hasattr(os, "sched_getaffinity"):
+            cpus = len(os.sched_getaffinity(0))
+        else:
+            cpus = os.cpu_count() or 1
+        self.threads = threads or max(1, cpus // processes)
+        self.cores = core_sets(processes, self.threads)
+        if self.cores is None:
+            print(
+                f"Not pinning OCR workers: {processes} x {self.threads} threads "
+                f"exceeds {cpus} cores"
+            )
+        self._context = multiprocessing.get_context("fork")
+        self._workers = []
+        self._tasks = self._results = None
+
+    def start(self, doc_count):
+        """
+        Loads the model and forks the workers, sized for `doc_count`
+        documents. Call it early, before other threads or processes (vLLM)
+        are started, since fork only copies the calling thread. documents()
+        starts the pool itself if needed.
+        """
+        if self._workers:
+            return
+        # Load before forking so every worker shares one copy of the weights
+        self.service.load_model()
+        self._tasks = self._context.Queue()
+        self._results = self._context.Queue()
+        self._flags = self._context.Array("b", doc_count, lock=False)
+        self._started = self._context.Array("d", doc_count)
+        with PDFIUM_LOCK:
+            for k in range(self.processes):
+                worker = self._context.Process(
+                    target=_worker_main,
+                    args=(
+                        self.service,
+                        self.cores[k] if self.cores else None,
+                        self.threads,
+                        self._tasks,
+                        self._results,
+                        self._flags,
+                        self._started,
+                    ),
+                    daemon=True,
+                )
+                worker.start()
+                self._workers.append(worker)
+
+    def _stop(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        cache = self.service.cache
+        alive = len(self._workers)
+        while alive:
+            try:
+                message = self._results.get(timeout=5)
+            except queue.Empty:
+                if not any(worker.is_alive() for worker in self._workers):
+                    break
+                continue
+            if message[0] == _STATS:
+                alive -= 1
+                if cache is not None:
+                    cache.hits += message[1]
+                    cache.misses += message[2]
+        for worker in self._workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self._workers = []
+
+    def close(self):
+        """
+        Stops the workers, if still running, and releases the task and
+        result queues. Call it once the pool is no longer needed, including
+        when documents() was never run or was left part-way.
+        """
+        if self._workers:
+            for doc in range(len(self._flags)):
+                self._flags[doc] = 1
+            self._stop()
+        for channel in (self._tasks, self._results):
+            if channel is not None:
+                channel.close()
+                channel.join_thread()
+        self._tasks = self._results = None
+        self._flags = self._started = None
+
+    def _receive(self):
+        while True:
+            try:
+                return self._results.get(timeout=1)
+            except queue.Empty:
+                dead = [w for w in self._workers if not w.is_alive()]
+                if dead:
+                    raise RuntimeError(
+                        f"OCR worker {dead[0].pid} exited with code {dead[0].exitcode}"
+                    )
+
+    def documents(self, pdf_paths):
+        """
+        Yields (pdf_path, pages) for each document in order, where pages
+        yields (page_number, markdown_text) like OCRService.process_pdf. Each
+        document's pages must be consumed (or closed) before the next one.
+        """
+        pdf_paths = list(pdf_paths)
+        page_counts = []
+        # doc -> why it could not be opened; raised when its turn comes, so
+        # one unreadable file does not stop the others
+        self._open_errors = {}
+        with PDFIUM_LOCK:
+            for doc, path in enumerate(pdf_paths):
+                if not os.path.exists(path):
+                    page_counts.append(None)
+                    continue
+                try:
+                    pdf = pdfium.PdfDocument(path)
+                except Exception as e:
+                    self._open_errors[doc] = e
+                    page_counts.append(None)
+                    continue
+                page_counts.append(len(pdf))
+                pdf.close()
+
+        self.start(len(pdf_paths))
+        if len(self._flags) < len(pdf_paths):
+            raise ValueError(
+                f"Pool was started for {len(self._flags)} documents, got {len(pdf_paths)}"
+            )
+        # Keep a couple of pages per worker queued; the rest are fed as
+        # results come back so a cancelled document stops costing work
+        self._todo = (
+            (doc, os.path.abspath(path), index)
+            for doc, (path, count) in enumerate(zip(pdf_paths, page_counts))
+            for index in range(count or 0)
+        )
+        self._queued = 0
+        # (doc, page_num) -> result that arrived before its turn
+        self._buffer = {}
+        self._finished = set()
+        self._feed()
+        try:
+            for doc, path in enumerate(pdf_paths):
+                yield path, self._document_pages(doc, path, page_counts[doc])
+                # Also covers a pages iterator that was never started
+                self._abandon(doc)
+        finally:
+            for doc in range(len(pdf_paths)):
+                self._flags[doc] = 1
+            self._stop()
+
+    def _feed(self):
+        while self._queued < 2 * self.processes:
+            task = next(self._todo, None)
+            if task is None:
+                return
+            self._tasks.put(task)
+            self._queued += 1
+
+    def _document_pages(self, doc, pdf_path, page_count):
+        if page_count is None:
+            if doc in self._open_errors:
+                raise self._open_errors[doc]
+            raise FileNotFoundError(f"{pdf_path} not found")
+        doc_id = os.path.splitext(os.path.basename(pdf_path))[0]
+        cancel_reason = None
+        try:
+            for page_num in range(1, page_count + 1):
+                while (doc, page_num) not in self._buffer:
+                    kind, got_doc, got_page, result, ink_ratio = self._receive()
+                    self._queued -= 1
+                    self._feed()
+                    if got_doc not in self._finished:
+                        self._buffer[(got_doc, got_page)] = (kind, result, ink_ratio)
+
+                kind, result, ink_ratio = self._buffer.pop((doc, page_num))
+                if kind == _ERROR:
+                    raise RuntimeError(f"OCR of {doc_id} page {page_num} failed: {result}")
+                if kind == _SKIPPED:
+                    cancel_reason = result
+                    continue
+                text, stop_reason = result
+                if stop_reason in (DeadlineCheck.TIMEOUT, DeadlineCheck.CANCELLED) and self._flags[doc]:
+                    cancel_reason = stop_reason
+                if self.service.log_page(doc_id, page_num, text, stop_reason, ink_ratio):
+                    yield page_num, text
+            if cancel_reason is not None:
+                self.service.log_cancelled(doc_id, cancel_reason)
+        finally:
+            self._abandon(doc)
+
+    def _abandon(self, doc):
+        """Skip what is still queued of a document the consumer is done with."""
+        self._flags[doc] = 1
+        self._finished.add(doc)
+        for key in [key for key in self._buffer if key[0] == doc]:
+            del self._buffer[key]
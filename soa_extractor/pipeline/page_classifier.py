@@ -1,10 +1,24 @@
+# classify_page only ever looks at this many leading lines of a page
+HEADER_LINES = 20
+
+
 def classify_page(text: str, rules: dict) -> str:
     """
     Classify the page based on rules.
     Expects rules['page_classification']['rules'] to be a list of rules.
     """
+    return classify_page_prefix(text, rules)[0]
+
+
+def classify_page_prefix(text: str, rules: dict) -> tuple[str, bool]:
+    """
+    Classify a page from a (possibly partial) OCR output.
+    Returns (page_type, is_final). is_final is True when more text can no
+    longer change the result: either the header window is complete, or the
+    matched rule outranks every rule that could still match later.
+    """
     if not rules or "page_classification" not in rules:
-        return "Ignore"
+        return "Ignore", True
 
     page_rules = rules["page_classification"].get("rules", [])
     # Sort by priority desc
@@ -13,10 +27,12 @@ def classify_page(text: str, rules: dict) -> str:
     # Get header (first few lines)
     lines = text.split("\n")
     # heuristics for header: first 10 lines or lines starting with #
-    headers = [line for line in lines[:20]]
+    headers = [line for line in lines[:HEADER_LINES]]
     header_text = "\n".join(headers).lower()
+    header_complete = len(lines) > HEADER_LINES
 
     default_type = "Ignore"
+    unmatched_before = False
 
     for rule in sorted_rules:
         if rule.get("fallback"):
@@ -34,6 +50,8 @@ def classify_page(text: str, rules: dict) -> str:
                     break
 
         if matched:
-            return rule.get("type")
+            return rule.get("type"), header_complete or not unmatched_before
+
+        unmatched_before = True
 
-    return default_type
+    return default_type, header_complete
@@ -0,0 +1,30 @@
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+
+def prefetch(fn, items, depth=2, workers=1):
+    """
+    Yields fn(item) for every item, in order, computing up to `depth`
+    results ahead of the consumer on background threads.
+
+    The bound is the backpressure: once `depth` results are waiting, no
+    new work is submitted until the consumer takes one, so memory stays
+    capped no matter how long `items` is.
+    """
+    if depth <= 0:
+        yield from map(fn, items)
+        return
+
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+    pending = deque()
+    try:
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) > depth:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import time
+
+import torch
+from torch import nn
+from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+
+from soa_extractor.snapshot import build_model, save_weights
+
+# Submodules of LightOnOcrForConditionalGeneration whose nn.Linear layers
+# are quantised. The language model (decoder + lm_head) runs once per
+# generated token and dominates CPU time; the vision side runs once per page.
+LANGUAGE_MODULES = ("model.language_model", "lm_head")
+VISION_MODULES = ("model.vision_encoder", "model.vision_projection")
+
+PACKED_SUFFIX = "._packed_params._packed_params"
+
+
+def quantize_targets(vision=False):
+    return LANGUAGE_MODULES + (VISION_MODULES if vision else ())
+
+
+def quantize_model(model, vision=False):
+    """
+    Dynamic int8 quantisation (CPU only) of the nn.Linear layers under
+    quantize_targets(): int8 weights, activations quantised on the fly per
+    batch. Everything else stays float32. Modifies `model` in place.
+    """
+    qconfig_spec = {name: default_dynamic_qconfig for name in quantize_targets(vision)}
+    quantize_dynamic(
+        model,
+        qconfig_spec,
+        dtype=torch.qint8,
+        mapping={nn.Linear: DynamicLinear},
+        inplace=True,
+    )
+    return model
+
+
+def cache_path(cache_dir, model_name, config, vision=False):
+    """Cache file for one model / config / target set / torch version."""
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (config.to_json_string(), torch.__version__, repr(quantize_targets(vision))):
+        digest.update(part.encode())
+    name = model_name.replace("/", "--")
+    return os.path.join(cache_dir, f"{name}-int8-{digest.hexdigest()}.pt")
+
+
+def _swap_linears(model, state_dict):
+    """Replace every nn.Linear the cached state_dict holds packed weights for."""
+    for key in state_dict:
+        if not key.endswith(PACKED_SUFFIX):
+            continue
+        name = key[: -len(PACKED_SUFFIX)]
+        parent_name, _, child = name.rpartition(".")
+        parent = model.get_submodule(parent_name)
+        linear = getattr(parent, child)
+        if not isinstance(linear, nn.Linear):
+            raise ValueError(f"Cached int8 weights for {name}, which is not nn.Linear")
+        setattr(
+            parent,
+            child,
+            DynamicLinear(
+                linear.in_features,
+                linear.out_features,
+                bias_=linear.bias is not None,
+                dtype=torch.qint8,
+            ),
+        )
+
+
+def _load_cached(model_cls, config, path):
+    # Our own cache file; packed int8 params are not plain tensors, so the
+    # weights_only loader cannot read them.
+    cached = torch.load(path, map_location="cpu", weights_only=False)
+    # The float skeleton stays on the meta device; int8 layers are swapped
+    # in before the cached tensors are assigned.
+    return build_model(model_cls, config, cached, before_load=_swap_linears)
+
+
+def load_quantized(
+    model_cls,
+    model_name,
+    cache_dir=None,
+    vision=False,
+    attn_implementation="sdpa",
+    **from_pretrained_kwargs,
+):
+    """
+    Loads `model_name` on CPU with int8 dynamic quantisation applied. With a
+    cache_dir, the quantised weights are saved there on first use and later
+    loads read them directly, skipping the float32 checkpoint and the
+    quantisation pass.
+    """
+    start_time = time.time()
+    config = model_cls.config_class.from_pretrained(
+        model_name, attn_implementation=attn_implementation, **from_pretrained_kwargs
+    )
+    path = cache_path(cache_dir, model_name, config, vision) if cache_dir else None
+
+    if path is not None and os.path.exists(path):
+        try:
+            model = _load_cached(model_cls, config, path)
+            print(f"Loaded int8 weights from {path} in {time.time() - start_time:.2f}s")
+            return model
+        except Exception as e:
+            print(f"Ignoring unusable int8 cache {path}: {e}")
+
+    model = model_cls.from_pretrained(
+        model_name,
+        config=config,
+        torch_dtype=torch.float32,
+        **from_pretrained_kwargs,
+    ).eval()
+    quantize_model(model, vision=vision)
+    if path is not None:
+        save_weights(model, path)
+        print(f"Saved int8 weights to {path}")
+    print(f"Quantised {model_name} to int8 in {time.time() - start_time:.2f}s")
+    return model
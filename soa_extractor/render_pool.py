@@ -0,0 +1,275 @@
+import multiprocessing
+import os
+import queue
+import sys
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pypdfium2 as pdfium
+from PIL import Image
+
+from soa_extractor.rendering import (
+    PDFIUM_LOCK,
+    BlankPage,
+    blank_page_check,
+    plan_render,
+    render_planned,
+)
+from soa_extractor.text_layer import page_text_markdown
+
+# Documents currently open in this worker process, keyed by path
+_worker_docs = {}
+_worker_slots = {}
+
+
+def _worker_document(pdf_path):
+    pdf = _worker_docs.get(pdf_path)
+    if pdf is None:
+        # Pages of one document are spread over all workers, so every worker
+        # keeps only its latest document open.
+        for old in _worker_docs.values():
+            old.close()
+        _worker_docs.clear()
+        pdf = _worker_docs[pdf_path] = pdfium.PdfDocument(pdf_path)
+    return pdf
+
+
+def _worker_slot(name):
+    slot = _worker_slots.get(name)
+    if slot is None:
+        slot = _worker_slots[name] = shared_memory.SharedMemory(name=name)
+    return slot
+
+
+def _render_job(
+    pdf_path,
+    index,
+    slot_name,
+    max_resolution,
+    scale,
+    render_mode,
+    trim_margins,
+    use_text_layer,
+    blank_page,
+):
+    """
+    Runs in a worker process. Renders one page into the shared memory slot
+    and returns its geometry; only a few integers cross the process boundary.
+    """
+    page = _worker_document(pdf_path)[index]
+    try:
+        if use_text_layer:
+            markdown = page_text_markdown(page)
+            if markdown is not None:
+                return "text", markdown
+        if blank_page is not None:
+            is_blank, ratio = blank_page_check(page, **blank_page)
+            if is_blank:
+                return "blank", ratio
+
+        plan = plan_render(page, max_resolution, scale, render_mode, trim=trim_margins)
+        bitmap = render_planned(page, plan, prefer_bgrx=True)
+        data = memoryview(bitmap.buffer).cast("B")
+        slot = _worker_slot(slot_name)
+        if data.nbytes > slot.size:
+            # Bigger than a slot (unusual page size): fall back to pickling
+            return "bytes", (bitmap.width, bitmap.height, bitmap.stride, bitmap.mode, plan, bytes(data))
+        slot.buf[: data.nbytes] = data
+        return "shm", (bitmap.width, bitmap.height, bitmap.stride, bitmap.mode, plan)
+    finally:
+        page.close()
+
+
+class RenderedPage:
+    """
+    One rendered page and the RenderPlan used. From a RenderPool, `image`
+    and `array` are views onto the pool's shared memory, valid until
+    release() hands the slot back; copy them if they must outlive that.
+    """
+
+    def __init__(self, page_num, image, array, plan, on_release=None):
+        self.page_num = page_num
+        self.image = image
+        self.array = array
+        self.plan = plan
+        self._on_release = on_release
+
+    def release(self):
+        if self._on_release is not None:
+            self._on_release()
+            self._on_release = None
+        self.image = None
+        self.array = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def __del__(self):
+        # A page dropped without release() must not starve the pool
+        self.release()
+
+
+def _start_method():
+    """
+    "fork" avoids re-importing the entry point (torch, vllm) in every
+    worker, but fork copies only the calling thread and inherits a CUDA
+    context it cannot use, so it is only safe before either exists. Once
+    other threads run or CUDA is initialised (create the pool before the
+    model or vLLM to keep fork), workers come from a forkserver instead.
+    """
+    if not sys.platform.startswith("linux"):
+        return "spawn"
+    torch = sys.modules.get("torch")
+    if torch is not None and torch.cuda.is_initialized():
+        return "forkserver"
+    if threading.active_count() > 1:
+        return "forkserver"
+    return "fork"
+
+
+class RenderPool:
+    """
+    Rasterises PDF pages in worker processes. Each worker opens the document
+    itself and writes the bitmap into one of `slots` shared memory buffers
+    owned by this process, which the consumer wraps as a PIL image / NumPy
+    array without copying. A page holds its slot until it is released, so
+    `slots` also bounds how many rendered pages exist at once.
+    """
+
+    def __init__(
+        self,
+        workers=None,
+        slots=None,
+        max_resolution=1540,
+        scale=2.77,
+        blank_page=None,
+        render_mode="fixed",
+        trim_margins=False,
+    ):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_resolution = max_resolution
+        self.scale = scale
+        # Thresholds for rendering.blank_page_check; None renders every page
+        self.blank_page = blank_page
+        self.render_mode = render_mode
+        self.trim_margins = trim_margins
+        # RGBX, one extra pixel per side for pdfium's rounding
+        self.slot_bytes = (max_resolution + 1) ** 2 * 4
+        self._slots = [
+            shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+            for _ in range(slots or self.workers * 2)
+        ]
+        self._free = queue.Queue()
+        for index in range(len(self._slots)):
+            self._free.put(index)
+        method = _start_method()
+        if method == "forkserver":
+            print("Render workers start from a forkserver: threads or CUDA are already live")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers, mp_context=multiprocessing.get_context(method)
+        )
+        # Start the workers now, while no thread of ours is inside pdfium,
+        # so no child inherits its state mid-call.
+        with PDFIUM_LOCK:
+            self._executor.submit(os.getpid).result()
+
+    def pages(self, pdf_path, use_text_layer=False, page_indices=None):
+        """
+        Yields (page_number, payload) in page order, where payload is a
+        RenderedPage, the page's markdown when use_text_layer is set and the
+        PDF text layer is usable, or a BlankPage when the blank check fired.
+        """
+        if page_indices is None:
+            with PDFIUM_LOCK:
+                pdf = pdfium.PdfDocument(pdf_path)
+                page_indices = range(len(pdf))
+                pdf.close()
+
+        pdf_path = os.path.abspath(pdf_path)
+        todo = iter(page_indices)
+        index = next(todo, None)
+        pending = deque()
+        try:
+            while True:
+                # Keep every free slot busy; block for one only when idle
+                while index is not None:
+                    try:
+                        slot = self._free.get(block=not pending)
+                    except queue.Empty:
+                        break
+                    future = self._executor.submit(
+                        _render_job,
+                        pdf_path,
+                        index,
+                        self._slots[slot].name,
+                        self.max_resolution,
+                        self.scale,
+                        self.render_mode,
+                        self.trim_margins,
+                        use_text_layer,
+                        self.blank_page,
+                    )
+                    pending.append((index, slot, future))
+                    index = next(todo, None)
+                if not pending:
+                    return
+
+                done, slot, future = pending.popleft()
+                try:
+                    kind, result = future.result()
+                except BaseException:
+                    self._free.put(slot)
+                    raise
+                yield done + 1, self._payload(done, slot, kind, result)
+        finally:
+            for _, slot, future in pending:
+                future.cancel()
+                try:
+                    future.result()
+                except BaseException:
+                    pass
+                self._free.put(slot)
+
+    def _payload(self, index, slot, kind, result):
+        if kind == "text":
+            self._free.put(slot)
+            return result
+        if kind == "blank":
+            self._free.put(slot)
+            return BlankPage(result)
+        if kind == "bytes":
+            self._free.put(slot)
+            width, height, stride, mode, plan, buffer = result
+        else:
+            width, height, stride, mode, plan = result
+            buffer = self._slots[slot].buf[: stride * height]
+
+        array = np.ndarray(
+            (height, width, 4), dtype=np.uint8, buffer=buffer, strides=(stride, 4, 1)
+        )
+        image = Image.frombuffer(mode, (width, height), buffer, "raw", mode, stride, 1)
+        on_release = (lambda: self._free.put(slot)) if kind == "shm" else None
+        return RenderedPage(index + 1, image, array, plan, on_release)
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        for slot in self._slots:
+            try:
+                slot.close()
+            except BufferError:
+                # A caller still holds a view; the mapping goes with it
+                pass
+            slot.unlink()
+        self._slots = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
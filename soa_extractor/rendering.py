@@ -0,0 +1,253 @@
+import math
+import threading
+from dataclasses import dataclass
+
+import numpy as np
+
+# pdfium is not thread-safe: any call into it made off the main thread
+# (prefetch workers, background renderers) must hold this lock.
+PDFIUM_LOCK = threading.RLock()
+
+
+def target_scale(page, max_resolution=1540, scale=2.77):
+    """Render scale for `page`, shrunk so neither side exceeds max_resolution."""
+    width, height = page.get_size()
+    pixel_width = width * scale
+    pixel_height = height * scale
+    resize_factor = min(1, max_resolution / pixel_width, max_resolution / pixel_height)
+    return scale * resize_factor
+
+
+RENDER_MODES = ("fixed", "adaptive")
+
+# LightOnOCR's vision tower: 14px patches, merged 2x2 into one token
+VISION_BLOCK_PX = 28
+
+
+def vision_tokens(width, height, block=VISION_BLOCK_PX):
+    """Approximate number of image tokens the model spends on a bitmap."""
+    return math.ceil(width / block) * math.ceil(height / block)
+
+
+@dataclass
+class RenderPlan:
+    """
+    How one page is rendered: the scale, and the points to crop off each
+    side (left, bottom, right, top) when margins are trimmed. `box` is the
+    kept region in pixels of the untrimmed render, whose size is `full_size`.
+    """
+
+    scale: float
+    full_size: tuple
+    box: tuple
+    crop: tuple = (0, 0, 0, 0)
+
+    @property
+    def tokens_saved(self):
+        left, top, right, bottom = self.box
+        return vision_tokens(*self.full_size) - vision_tokens(right - left, bottom - top)
+
+
+def page_scale(page, max_resolution=1540, scale=2.77, mode="fixed", gray=None):
+    """Render scale for `page` under one of RENDER_MODES."""
+    if mode == "adaptive":
+        return adaptive_scale(page, max_resolution, scale, gray=gray)
+    if mode != "fixed":
+        raise ValueError(f"Unknown render mode: {mode}")
+    return target_scale(page, max_resolution, scale)
+
+
+def plan_render(
+    page, max_resolution=1540, scale=2.77, mode="fixed", trim=False, trim_pad=12
+):
+    """
+    Pick the scale and, with trim=True, the margin crop for `page`. Both
+    come from the same probe render. Cropping keeps the scale, so the kept
+    content is rendered at exactly the DPI it would have had untrimmed.
+    """
+    gray = probe_page(page) if mode == "adaptive" or trim else None
+    render_scale = page_scale(page, max_resolution, scale, mode, gray=gray)
+    width, height = page.get_size()
+    full_size = (round(width * render_scale), round(height * render_scale))
+    plan = RenderPlan(render_scale, full_size, (0, 0, *full_size))
+
+    bbox = content_box(gray) if trim else None
+    if bbox is None:
+        return plan
+
+    left, top, right, bottom = bbox
+    # Whole pixels at render_scale, so the crop lands on the full render's grid
+    cut = [
+        math.floor(max(0.0, points - trim_pad) * render_scale)
+        for points in (
+            left * width,
+            (1 - bottom) * height,
+            (1 - right) * width,
+            top * height,
+        )
+    ]
+    plan.crop = tuple(pixels / render_scale for pixels in cut)
+    plan.box = (cut[0], cut[3], full_size[0] - cut[2], full_size[1] - cut[1])
+    return plan
+
+
+def render_planned(page, plan, **kwargs):
+    """Render `page` as described by a RenderPlan; returns the PdfBitmap."""
+    bitmap = page.render(
+        scale=plan.scale, crop=plan.crop, rev_byteorder=True, **kwargs
+    )
+    # pdfium rounds the bitmap size itself; keep the box in step with it
+    left, top = plan.box[:2]
+    plan.box = (left, top, left + bitmap.width, top + bitmap.height)
+    return bitmap
+
+
+def render_page(page, max_resolution=1540, scale=2.77, mode="fixed"):
+    """Render a PDF page to PIL Image."""
+    return page.render(
+        scale=page_scale(page, max_resolution, scale, mode), rev_byteorder=True
+    ).to_pil()
+
+
+@dataclass
+class BlankPage:
+    """Stands in for a page the blank check skipped."""
+
+    ink_ratio: float
+
+
+def probe_page(page, width=512):
+    """Grayscale render of `page` about `width` pixels wide, as a 2-D uint8 array."""
+    page_width, _ = page.get_size()
+    bitmap = page.render(scale=width / page_width, grayscale=True)
+    gray = np.frombuffer(bitmap.buffer, dtype=np.uint8)
+    return gray.reshape(bitmap.height, bitmap.stride)[:, : bitmap.width]
+
+
+def ink_ratio(gray, ink_delta=48, background_percentile=90):
+    """
+    Fraction of pixels clearly darker than the paper. The paper tone is
+    taken from the image itself so grey or yellowed scans are not all ink.
+    """
+    background = np.percentile(gray, background_percentile)
+    return np.count_nonzero(gray < background - ink_delta) / gray.size
+
+
+def blank_page_check(page, probe_width=256, ink_delta=48, max_ink_ratio=0.0003):
+    """
+    Returns (is_blank, ink_ratio) from a low resolution probe, so pages with
+    no content (or only a stray mark / page number) never get a full render.
+    """
+    ratio = ink_ratio(probe_page(page, probe_width), ink_delta)
+    return ratio <= max_ink_ratio, ratio
+
+
+def _run_lengths(mask):
+    """Lengths of the runs of True along axis 0 of a 2-D boolean array."""
+    edges = np.diff(
+        np.pad(mask.astype(np.int8), ((1, 1), (0, 0))), axis=0
+    ).T.ravel()
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return ends - starts
+
+
+def line_heights(gray, ink_delta=48, strips=4, rule_ratio=0.9):
+    """
+    Ink heights in pixels of the text lines in a grayscale probe, from the
+    row ink profile. The page is cut into vertical strips so side-by-side
+    columns with offset baselines do not merge into one tall "line"; rows
+    that are mostly ink (table rules, bars) split lines instead of joining them.
+    """
+    background = np.percentile(gray, 90)
+    ink = gray < background - ink_delta
+    width = ink.shape[1] // strips * strips
+    if width == 0:
+        return np.empty(0, dtype=np.int64)
+
+    # rows x strips: how many ink pixels each row has within each strip
+    row_ink = ink[:, :width].reshape(ink.shape[0], strips, -1).sum(axis=2)
+    strip_width = width // strips
+    text_rows = (row_ink > 0) & (row_ink < strip_width * rule_ratio)
+    return _run_lengths(text_rows)
+
+
+def adaptive_scale(
+    page,
+    max_resolution=1540,
+    scale=2.77,
+    min_glyph_px=13,
+    min_scale=1.0,
+    probe_width=512,
+    ink_delta=48,
+    dense_ink_ratio=0.08,
+    gray=None,
+):
+    """
+    Lowest render scale that still gives the page's smallest glyphs about
+    `min_glyph_px` pixels of ink height, measured on a cheap probe render
+    (or `gray`, one already made). Dense pages and pages without measurable
+    text lines keep the fixed scale, which is also the upper bound
+    (`max_resolution` should not exceed the processor's own resize target,
+    or those pixels are thrown away again).
+    """
+    upper = target_scale(page, max_resolution, scale)
+    if gray is None:
+        gray = probe_page(page, probe_width)
+    if ink_ratio(gray, ink_delta) >= dense_ink_ratio:
+        return upper
+
+    # Runs of 1px are specks or hairlines, not text
+    heights = line_heights(gray, ink_delta)
+    heights = heights[heights >= 2]
+    if heights.size == 0:
+        return upper
+
+    probe_scale = gray.shape[1] / page.get_size()[0]
+    smallest_glyph = np.percentile(heights, 10) / probe_scale
+    return float(min(upper, max(min_scale, min_glyph_px / smallest_glyph)))
+
+
+def content_box(gray, ink_delta=48, min_ink_px=2, border_ratio=0.95):
+    """
+    Bounding box of the ink in a grayscale image from its row and column
+    projection profiles, as fractions (left, top, right, bottom), or None
+    if there is no ink. Rows/columns with fewer than `min_ink_px` ink pixels
+    (dust) or nearly all ink (scanner edges) are not content.
+    """
+    background = np.percentile(gray, 90)
+    ink = gray < background - ink_delta
+    height, width = ink.shape
+    cols = ink.sum(axis=0)
+    rows = ink.sum(axis=1)
+    col_hits = np.flatnonzero((cols >= min_ink_px) & (cols < height * border_ratio))
+    row_hits = np.flatnonzero((rows >= min_ink_px) & (rows < width * border_ratio))
+    if col_hits.size == 0 or row_hits.size == 0:
+        return None
+    return (
+        col_hits[0] / width,
+        row_hits[0] / height,
+        (col_hits[-1] + 1) / width,
+        (row_hits[-1] + 1) / height,
+    )
+
+
+def trim_image(image, pad=24, probe_width=512, ink_delta=48):
+    """
+    Crop the blank margins of a PIL image (uploads, non-PDF input). Returns
+    (cropped_image, box) where box is the kept region in pixels of `image`.
+    """
+    probe = image.convert("L")
+    probe.thumbnail((probe_width, probe_width * 4))
+    bbox = content_box(np.asarray(probe), ink_delta)
+    width, height = image.size
+    if bbox is None:
+        return image, (0, 0, width, height)
+    left, top, right, bottom = bbox
+    box = (
+        max(0, int(left * width) - pad),
+        max(0, int(top * height) - pad),
+        min(width, math.ceil(right * width) + pad),
+        min(height, math.ceil(bottom * height) + pad),
+    )
+    return image.crop(box), box
@@ -1,12 +1,14 @@
 import os
 import json
 import glob
-import pandas as pd
+import html
+import re
 
 # from soa_extractor.rules import rule # Removed incorrect import
 
-from soa_extractor.ocr_service import OCRService
-from soa_extractor.llm.vllm_direct import VLLMDirectClient
+# torch/transformers (OCR), vllm and pandas are imported where they are
+# first needed, so config and resource errors surface without paying for them
+from soa_extractor.ocr_cache import OCRCache
 from soa_extractor.pipeline.page_classifier import classify_page
 from soa_extractor.pipeline.record_router import classify_record
 from soa_extractor.pipeline.extractor import extract_records_batch
@@ -30,19 +32,45 @@ def load_json_file(path):
         raise
 
 
-def parse_markdown_table_to_records(markdown_text):
+HTML_TABLE = re.compile(r"<table[^>]*>(.*?)</table>", re.DOTALL | re.IGNORECASE)
+HTML_ROW = re.compile(r"<tr[^>]*>(.*?)</tr>", re.DOTALL | re.IGNORECASE)
+HTML_CELL = re.compile(r"<t[hd][^>]*>(.*?)</t[hd]>", re.DOTALL | re.IGNORECASE)
+
+
+def html_table_rows(table_html):
+    """Rows of one HTML table as "| cell | cell |" lines, header rows included."""
+    rows = []
+    for row in HTML_ROW.findall(table_html):
+        cells = []
+        for cell in HTML_CELL.findall(row):
+            text = html.unescape(re.sub(r"<[^>]+>", " ", cell))
+            cells.append(" ".join(text.split()).replace("|", "\\|"))
+        if any(cells):
+            rows.append("| " + " | ".join(cells) + " |")
+    return rows
+
+
+def parse_markdown_table_to_records(markdown_text, html_tables=False):
     """
-    Simple parser to extract rows from markdown tables.
+    Simple parser to extract rows from markdown tables. With html_tables
+    (pages read from the PDF text layer, whose tables are <table> markup),
+    HTML tables also give one "| cell | cell |" record per row, in page
+    order with any pipe tables.
     """
     records = []
-    lines = markdown_text.split("\n")
-
-    for line in lines:
-        stripped = line.strip()
-        if stripped.startswith("|") and stripped.endswith("|"):
-            if "---" in stripped:
-                continue
-            records.append(stripped)
+    # Odd parts are the insides of <table> elements
+    parts = HTML_TABLE.split(markdown_text) if html_tables else [markdown_text]
+
+    for index, part in enumerate(parts):
+        if index % 2:
+            records.extend(html_table_rows(part))
+            continue
+        for line in part.split("\n"):
+            stripped = line.strip()
+            if stripped.startswith("|") and stripped.endswith("|"):
+                if "---" in stripped:
+                    continue
+                records.append(stripped)
 
     return records
 
@@ -80,6 +108,28 @@ def main():
     ocr_config = config.get("ocr", {})
     ocr_model = ocr_config.get("model", "lightonai/LightOnOCR-2-1B")
     ocr_max_tokens = ocr_config.get("max_new_tokens", 8192)
+    ocr_batch_size = ocr_config.get("batch_size", 1)
+    ocr_early_exit = ocr_config.get("early_exit", False)
+    ocr_text_layer = ocr_config.get("text_layer", False)
+    ocr_cache_config = ocr_config.get("cache") or {}
+    ocr_prefetch_pages = ocr_config.get("prefetch_pages", 0)
+    ocr_prefetch_workers = ocr_config.get("prefetch_workers", 1)
+    ocr_render_workers = ocr_config.get("render_workers", 0)
+    ocr_blank_page = ocr_config.get("blank_page")
+    ocr_render_mode = ocr_config.get("render_mode", "fixed")
+    ocr_trim_margins = ocr_config.get("trim_margins", False)
+    ocr_repetition = ocr_config.get("repetition")
+    ocr_repetition_check = ocr_retry_penalty = None
+    if ocr_repetition is not None:
+        ocr_repetition_check = dict(ocr_repetition)
+        ocr_retry_penalty = ocr_repetition_check.pop("retry_penalty", None)
+    ocr_page_timeout = ocr_config.get("page_timeout_s")
+    ocr_request_timeout = ocr_config.get("request_timeout_s")
+    ocr_quantize = ocr_config.get("quantize")
+    ocr_worker_processes = ocr_config.get("worker_processes", 0)
+    ocr_worker_threads = ocr_config.get("worker_threads", 0)
+    ocr_snapshot_dir = ocr_config.get("snapshot_dir") or os.environ.get("OCR_SNAPSHOT_DIR")
+    ocr_warm_up = ocr_config.get("warm_up", False)
 
     pipeline_config = config.get("pipeline", {})
     max_retries = pipeline_config.get("max_retries", 2)
@@ -92,7 +142,12 @@ def main():
     print(f"  Input: {input_path}")
     print(f"  Output: {output_dir}")
     print(f"  LLM: {llm_model} | MaxLen: {llm_max_len} | Dtype: {llm_dtype}")
-    print(f"  OCR: {ocr_model}")
+    print(
+        f"  OCR: {ocr_model} | BatchSize: {ocr_batch_size} | EarlyExit: {ocr_early_exit}"
+        f" | TextLayer: {ocr_text_layer}"
+    )
+    if ocr_cache_config:
+        print(f"  OCR Cache: {ocr_cache_config.get('path')}")
     print(f"  Pipeline Retries: {max_retries}")
 
     # 1. Setup Directories
@@ -129,165 +184,235 @@ def main():
         )
         return
 
+    # Listed up front so the OCR worker pool can be sized for them
+    input_files = []
+    if os.path.isdir(input_path):
+        input_files = glob.glob(os.path.join(input_path, "*.pdf"))
+    else:
+        input_files = [input_path]
+
     # 3. Initialize Services
+    ocr_pool = None
     try:
-        ocr_service = OCRService(model_name=ocr_model, max_new_tokens=ocr_max_tokens)
+        from soa_extractor.llm.vllm_direct import VLLMDirectClient
+        from soa_extractor.ocr_service import OCRService
+        from soa_extractor.ocr_workers import OCRWorkerPool
+        from soa_extractor.text_layer import TextLayerMarkdown
+
+        ocr_cache = None
+        if ocr_cache_config:
+            ocr_cache = OCRCache(
+                ocr_cache_config.get("path", "soa_extractor/intermediate/ocr_cache.sqlite"),
+                max_bytes=int(ocr_cache_config.get("max_mb", 1024)) * 1024 * 1024,
+            )
+        ocr_service = OCRService(
+            model_name=ocr_model,
+            max_new_tokens=ocr_max_tokens,
+            batch_size=ocr_batch_size,
+            early_exit_rules=rules if ocr_early_exit else None,
+            use_text_layer=ocr_text_layer,
+            cache=ocr_cache,
+            prefetch_pages=ocr_prefetch_pages,
+            prefetch_workers=ocr_prefetch_workers,
+            render_workers=ocr_render_workers,
+            blank_page=ocr_blank_page,
+            render_mode=ocr_render_mode,
+            trim_margins=ocr_trim_margins,
+            repetition_check=ocr_repetition_check,
+            repetition_retry_penalty=ocr_retry_penalty,
+            page_timeout=ocr_page_timeout,
+            request_timeout=ocr_request_timeout,
+            quantize=ocr_quantize,
+            snapshot_dir=ocr_snapshot_dir,
+            warm_up=ocr_warm_up,
+        )
+        if ocr_worker_processes == 0:
+            # Fork the render workers before the model and vLLM are loaded
+            ocr_service.start_render_pool()
+        else:
+            ocr_pool = OCRWorkerPool(
+                ocr_service, ocr_worker_processes, threads=ocr_worker_threads
+            )
+            print(
+                f"  OCR Workers: {ocr_pool.processes} x {ocr_pool.threads} threads"
+            )
+            # Fork the workers before vLLM starts its own threads and processes
+            ocr_pool.start(len(input_files))
         llm_client = VLLMDirectClient(
             model_name=llm_model, max_model_len=llm_max_len, dtype=llm_dtype
         )
     except Exception as e:
         log_event(ERRORS.SYS_DEP, "Failed to initialize services", exc=e, **sys_ctx)
+        if ocr_pool is not None:
+            ocr_pool.close()
         return
 
     # 4. Process Inputs
-    input_files = []
-    if os.path.isdir(input_path):
-        input_files = glob.glob(os.path.join(input_path, "*.pdf"))
+    if ocr_pool is not None:
+        # Pages of every document are spread over the worker processes
+        documents = ocr_pool.documents(input_files)
     else:
-        input_files = [input_path]
+        documents = ((path, ocr_service.process_pdf(path)) for path in input_files)
 
-    for pdf_file in input_files:
-        print(f"Processing {pdf_file}...")
-        base_name = os.path.splitext(os.path.basename(pdf_file))[0]
-        final_results = []
+    try:
+        for pdf_file, ocr_pages in documents:
+            print(f"Processing {pdf_file}...")
+            base_name = os.path.splitext(os.path.basename(pdf_file))[0]
+            final_results = []
 
-        # File Context
-        doc_id = base_name
-        file_ctx = {"doc_id": doc_id, "file": base_name}
+            # File Context
+            doc_id = base_name
+            file_ctx = {"doc_id": doc_id, "file": base_name}
 
-        try:
-            # Loop over pages
-            for page_num, markdown_text in ocr_service.process_pdf(pdf_file):
-                print(f"  Page {page_num} extracted.")
+            try:
+                # Loop over pages
+                for page_num, markdown_text in ocr_pages:
+                    print(f"  Page {page_num} extracted.")
 
-                # Page Context
-                page_ctx = {**file_ctx, "page": page_num}
+                    # Page Context
+                    page_ctx = {**file_ctx, "page": page_num}
 
-                if not markdown_text.strip():
-                    log_event(ERRORS.PAGE_HEADER, "Empty page content", **page_ctx)
-                    continue
+                    if not markdown_text.strip():
+                        log_event(ERRORS.PAGE_HEADER, "Empty page content", **page_ctx)
+                        continue
 
-                # Save Intermediate
-                try:
-                    md_path = os.path.join(
-                        intermediate_dir, f"{base_name}_page_{page_num}.md"
+                    # Save Intermediate
+                    try:
+                        md_path = os.path.join(
+                            intermediate_dir, f"{base_name}_page_{page_num}.md"
+                        )
+                        with open(md_path, "w", encoding="utf-8") as f:
+                            f.write(markdown_text)
+                    except Exception as e:
+                        log_event(
+                            ERRORS.IO_READMD,
+                            "Failed to save intermediate markdown",
+                            exc=e,
+                            **page_ctx,
+                        )
+
+                    # Classify Page
+                    page_type = classify_page(markdown_text, rules)
+                    print(f"  Page {page_num} classified as: {page_type}")
+
+                    if page_type == "Ignore":
+                        log_event(
+                            ERRORS.PAGE_CLASS,
+                            "Page classified as Ignore",
+                            level="INFO",
+                            **page_ctx,
+                        )
+                        continue
+
+                    # Parse Records
+                    # Only text-layer pages are read for <table> rows
+                    raw_records = parse_markdown_table_to_records(
+                        markdown_text,
+                        html_tables=isinstance(markdown_text, TextLayerMarkdown),
                     )
-                    with open(md_path, "w", encoding="utf-8") as f:
-                        f.write(markdown_text)
-                except Exception as e:
-                    log_event(
-                        ERRORS.IO_READMD,
-                        "Failed to save intermediate markdown",
-                        exc=e,
-                        **page_ctx,
+                    if not raw_records:
+                        log_event(ERRORS.REC_EMPTY, "No records found on page", **page_ctx)
+                        continue
+
+                    print(f"  Found {len(raw_records)} potential records.")
+
+                    # Prepare Batch
+                    batch_data = []
+                    for i, record_text in enumerate(raw_records):
+                        txn_group, txn_type = classify_record(record_text, rules)
+                        target_schema = schemas.get(txn_group)
+
+                        if target_schema:
+                            batch_data.append(
+                                {
+                                    "text": record_text,
+                                    "group": txn_group,
+                                    "type": txn_type,
+                                    "schema": target_schema,
+                                    "original_index": i,
+                                }
+                            )
+                        else:
+                            # Log Routing Error
+                            log_event(
+                                ERRORS.REC_ROUTE,
+                                f"Could not route record: {record_text[:50]}...",
+                                record_id=f"rec_{i}",
+                                txn_type=txn_type,
+                                **page_ctx,
+                            )
+
+                    if not batch_data:
+                        continue
+
+                    # Batch Extract with Retry & Logging
+                    print(f"    Extracting batch of {len(batch_data)} records...")
+                    validated_data_list = extract_records_batch(
+                        batch_data,
+                        llm_client,
+                        prompt_template,
+                        file_name=base_name,
+                        start_record_id=0,  # In reality, accumulate this
+                        max_retries=max_retries,
                     )
 
-                # Classify Page
-                page_type = classify_page(markdown_text, rules)
-                print(f"  Page {page_num} classified as: {page_type}")
+                    # Collect
+                    for item, data in zip(batch_data, validated_data_list):
+                        if data:
+                            data["_meta"] = {
+                                "page": page_num,
+                                "group": item["group"],
+                                "type": item["type"],
+                                "source_file": base_name,
+                            }
+                            final_results.append(data)
 
-                if page_type == "Ignore":
+                # Save Final Output
+                try:
+                    output_json_path = os.path.join(output_dir, f"{base_name}.json")
+                    with open(output_json_path, "w", encoding="utf-8") as f:
+                        json.dump(final_results, f, indent=2, ensure_ascii=False)
+                    print(f"Saved results to {output_json_path}")
+                except Exception as e:
                     log_event(
-                        ERRORS.PAGE_CLASS,
-                        "Page classified as Ignore",
-                        level="INFO",
-                        **page_ctx,
+                        ERRORS.IO_WRITEJSON, "Failed to save JSON output", exc=e, **file_ctx
                     )
-                    continue
 
-                # Parse Records
-                raw_records = parse_markdown_table_to_records(markdown_text)
-                if not raw_records:
-                    log_event(ERRORS.REC_EMPTY, "No records found on page", **page_ctx)
-                    continue
+                # Export to Excel
+                if final_results:
+                    try:
+                        import pandas as pd
 
-                print(f"  Found {len(raw_records)} potential records.")
-
-                # Prepare Batch
-                batch_data = []
-                for i, record_text in enumerate(raw_records):
-                    txn_group, txn_type = classify_record(record_text, rules)
-                    target_schema = schemas.get(txn_group)
-
-                    if target_schema:
-                        batch_data.append(
-                            {
-                                "text": record_text,
-                                "group": txn_group,
-                                "type": txn_type,
-                                "schema": target_schema,
-                                "original_index": i,
-                            }
-                        )
-                    else:
-                        # Log Routing Error
+                        df = pd.DataFrame(final_results)
+                        output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
+                        df.to_excel(output_excel_path, index=False)
+                        print(f"Saved results to {output_excel_path}")
+                    except Exception as e:
                         log_event(
-                            ERRORS.REC_ROUTE,
-                            f"Could not route record: {record_text[:50]}...",
-                            record_id=f"rec_{i}",
-                            txn_type=txn_type,
-                            **page_ctx,
+                            ERRORS.IO_WRITECSV,
+                            "Failed to save Excel output",
+                            exc=e,
+                            **file_ctx,
                         )
 
-                if not batch_data:
-                    continue
-
-                # Batch Extract with Retry & Logging
-                print(f"    Extracting batch of {len(batch_data)} records...")
-                validated_data_list = extract_records_batch(
-                    batch_data,
-                    llm_client,
-                    prompt_template,
-                    file_name=base_name,
-                    start_record_id=0,  # In reality, accumulate this
-                    max_retries=max_retries,
-                )
-
-                # Collect
-                for item, data in zip(batch_data, validated_data_list):
-                    if data:
-                        data["_meta"] = {
-                            "page": page_num,
-                            "group": item["group"],
-                            "type": item["type"],
-                            "source_file": base_name,
-                        }
-                        final_results.append(data)
-
-            # Save Final Output
-            try:
-                output_json_path = os.path.join(output_dir, f"{base_name}.json")
-                with open(output_json_path, "w", encoding="utf-8") as f:
-                    json.dump(final_results, f, indent=2, ensure_ascii=False)
-                print(f"Saved results to {output_json_path}")
             except Exception as e:
                 log_event(
-                    ERRORS.IO_WRITEJSON, "Failed to save JSON output", exc=e, **file_ctx
+                    ERRORS.SYS_DEP,
+                    f"Unhandled error processing file {pdf_file}",
+                    exc=e,
+                    **file_ctx,
                 )
-
-            # Export to Excel
-            if final_results:
-                try:
-                    df = pd.DataFrame(final_results)
-                    output_excel_path = os.path.join(output_dir, f"{base_name}.xlsx")
-                    df.to_excel(output_excel_path, index=False)
-                    print(f"Saved results to {output_excel_path}")
-                except Exception as e:
-                    log_event(
-                        ERRORS.IO_WRITECSV,
-                        "Failed to save Excel output",
-                        exc=e,
-                        **file_ctx,
-                    )
-
-        except Exception as e:
-            log_event(
-                ERRORS.SYS_DEP,
-                f"Unhandled error processing file {pdf_file}",
-                exc=e,
-                **file_ctx,
-            )
-            print(f"Error processing {pdf_file}: {e}")
+                print(f"Error processing {pdf_file}: {e}")
+    finally:
+        documents.close()
+        if ocr_pool is not None:
+            # Stops the workers and releases their queues and shared arrays
+            ocr_pool.close()
+
+    ocr_service.close()
+    if ocr_cache is not None:
+        print(f"OCR cache stats: {ocr_cache.stats()}")
+        ocr_cache.close()
 
 
 if __name__ == "__main__":
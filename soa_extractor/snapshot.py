@@ -0,0 +1,180 @@
+"""
+Pre-converted model snapshots for fast cold starts.
+
+    python -m soa_extractor.snapshot prepare --out snapshots --dtype float32
+    python -m soa_extractor.snapshot load --out snapshots --dtype float32
+
+`prepare` loads a checkpoint once, converts it to the target dtype and
+writes weights.pt (state_dict plus non-persistent buffers), config.json and
+the processor files to <out>/<model>-<dtype>/. load_snapshot memory-maps
+weights.pt and assigns the tensors straight into a model skeleton built on
+the meta device, so on CPU nothing is copied or converted at startup.
+"""
+
+import argparse
+import itertools
+import os
+import time
+from contextlib import contextmanager
+
+import torch
+
+WEIGHTS_FILE = "weights.pt"
+
+
+class StageTimer:
+    """Wall-clock time per named stage, for cold-start reports."""
+
+    def __init__(self):
+        self.stages = []
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.stages.append((name, time.time() - start))
+
+    @property
+    def total(self):
+        return sum(seconds for _, seconds in self.stages)
+
+    def report(self):
+        parts = " | ".join(f"{name} {seconds:.2f}s" for name, seconds in self.stages)
+        return f"{parts} | total {self.total:.2f}s"
+
+
+def save_weights(model, path):
+    """Writes the state_dict plus non-persistent buffers (rotary inv_freq)."""
+    persistent = model.state_dict()
+    buffers = {
+        name: buffer
+        for name, buffer in model.named_buffers()
+        if name not in persistent
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save({"state_dict": persistent, "buffers": buffers}, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def build_model(model_cls, config, weights, dtype=torch.float32, before_load=None):
+    """
+    Builds `model_cls` on the meta device and assigns the tensors from
+    `weights` (as written by save_weights) without allocating or copying.
+    before_load(model, state_dict) may adapt the skeleton first.
+    """
+    with torch.device("meta"):
+        model = model_cls._from_config(config, torch_dtype=dtype)
+    if before_load is not None:
+        before_load(model, weights["state_dict"])
+    model.load_state_dict(weights["state_dict"], assign=True)
+    for name, buffer in weights["buffers"].items():
+        parent_name, _, child = name.rpartition(".")
+        model.get_submodule(parent_name).register_buffer(child, buffer, persistent=False)
+
+    tensors = itertools.chain(model.named_parameters(), model.named_buffers())
+    leftover = [name for name, tensor in tensors if tensor.is_meta]
+    if leftover:
+        raise ValueError(f"Weights are missing {leftover[:3]}")
+    return model.eval()
+
+
+def snapshot_path(root, model_name, dtype):
+    dtype_name = str(dtype).replace("torch.", "")
+    return os.path.join(root, f"{model_name.replace('/', '--')}-{dtype_name}")
+
+
+def has_snapshot(path):
+    return path is not None and os.path.exists(os.path.join(path, WEIGHTS_FILE))
+
+
+def prepare_snapshot(model_cls, processor_cls, model_name, root, dtype):
+    """Converts `model_name` to `dtype` once and writes it under `root`."""
+    path = snapshot_path(root, model_name, dtype)
+    timer = StageTimer()
+    with timer.stage("from_pretrained"):
+        model = model_cls.from_pretrained(
+            model_name, torch_dtype=dtype, trust_remote_code=True
+        ).eval()
+    with timer.stage("save"):
+        save_weights(model, os.path.join(path, WEIGHTS_FILE))
+        model.config.save_pretrained(path)
+        processor_cls.from_pretrained(model_name, trust_remote_code=True).save_pretrained(
+            path
+        )
+    print(f"Snapshot of {model_name} ({dtype}) written to {path}: {timer.report()}")
+    return path
+
+
+def load_snapshot(model_cls, path, device="cpu", attn_implementation=None, timer=None):
+    """
+    Loads a prepare_snapshot() directory. Weights are memory-mapped, so on
+    CPU the model's tensors are views of the page cache; on GPU they are
+    copied over once with no dtype conversion.
+    """
+    timer = timer or StageTimer()
+    with timer.stage("config"):
+        kwargs = {"attn_implementation": attn_implementation} if attn_implementation else {}
+        config = model_cls.config_class.from_pretrained(path, **kwargs)
+    with timer.stage("mmap weights"):
+        weights = torch.load(
+            os.path.join(path, WEIGHTS_FILE), mmap=True, weights_only=True
+        )
+    with timer.stage("assign"):
+        dtype = next(
+            t.dtype for t in weights["state_dict"].values() if t.is_floating_point()
+        )
+        model = build_model(model_cls, config, weights, dtype=dtype)
+    if device != "cpu":
+        with timer.stage(f"to({device})"):
+            model = model.to(device)
+    return model
+
+
+def warm_up(model, inputs, max_new_tokens=4):
+    """
+    One short generation so kernel selection, allocator growth and other
+    lazy initialisation happen before the first real page.
+    """
+    with torch.no_grad():
+        model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False)
+
+
+def main():
+    from transformers import LightOnOcrForConditionalGeneration, LightOnOcrProcessor
+
+    parser = argparse.ArgumentParser(description="Prepare or time OCR model snapshots")
+    parser.add_argument("command", choices=["prepare", "load"])
+    parser.add_argument("--model", default="lightonai/LightOnOCR-2-1B")
+    parser.add_argument("--out", default=os.environ.get("OCR_SNAPSHOT_DIR", "snapshots"))
+    parser.add_argument("--dtype", default="float32", choices=["float32", "bfloat16", "float16"])
+    parser.add_argument("--device", default="cpu")
+    args = parser.parse_args()
+
+    dtype = getattr(torch, args.dtype)
+    if args.command == "prepare":
+        prepare_snapshot(
+            LightOnOcrForConditionalGeneration,
+            LightOnOcrProcessor,
+            args.model,
+            args.out,
+            dtype,
+        )
+        return
+
+    timer = StageTimer()
+    load_snapshot(
+        LightOnOcrForConditionalGeneration,
+        snapshot_path(args.out, args.model, dtype),
+        device=args.device,
+        timer=timer,
+    )
+    print(f"Cold start: {timer.report()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import html
+import statistics
+import unicodedata
+
+import pypdfium2.raw as pdfium_c
+
+
+class TextLayerMarkdown(str):
+    """Markdown rebuilt from a page's text layer instead of OCR'd."""
+
+
+def _is_garbled(ch):
+    """Characters a broken font encoding typically maps to."""
+    if ch == "\ufffd":
+        return True
+    return unicodedata.category(ch) in ("Co", "Cc", "Cn")
+
+
+def read_chars(page):
+    """
+    Returns [(char, left, bottom, right, top, space_before), ...] for every
+    visible character of the page's text layer, in PDF canvas units.
+    space_before is True when whitespace preceded the character.
+    """
+    textpage = page.get_textpage()
+    chars = []
+    space_before = False
+    try:
+        for index in range(textpage.count_chars()):
+            code = pdfium_c.FPDFText_GetUnicode(textpage, index)
+            ch = chr(code) if code else " "
+            if ch.isspace():
+                space_before = True
+                continue
+            left, bottom, right, top = textpage.get_charbox(index, loose=True)
+            if right <= left or top <= bottom:
+                continue
+            chars.append((ch, left, bottom, right, top, space_before))
+            space_before = False
+    finally:
+        textpage.close()
+    return chars
+
+
+def is_usable(chars, min_chars=30, max_garbled_ratio=0.05):
+    """True when the text layer is dense and clean enough to skip OCR."""
+    if len(chars) < min_chars:
+        return False
+    garbled = sum(1 for ch, *_ in chars if _is_garbled(ch))
+    return garbled / len(chars) <= max_garbled_ratio
+
+
+def group_lines(chars):
+    """Cluster characters into lines by vertical centre, top to bottom."""
+    if not chars:
+        return []
+
+    height = statistics.median(top - bottom for _, _, bottom, _, top, _ in chars)
+    ordered = sorted(chars, key=lambda c: -(c[2] + c[4]) / 2)
+
+    lines = []
+    current, center_sum = [], 0.0
+    for char in ordered:
+        center = (char[2] + char[4]) / 2
+        if current and abs(center - center_sum / len(current)) > height * 0.5:
+            lines.append(current)
+            current, center_sum = [], 0.0
+        current.append(char)
+        center_sum += center
+    lines.append(current)
+
+    return [sorted(line, key=lambda c: c[1]) for line in lines]
+
+
+def split_cells(line, word_gap=0.25, cell_gap=1.2):
+    """
+    Split one line into cells [(left, right, text), ...].
+    Gaps are relative to the line height: small gaps separate words,
+    large gaps separate table columns.
+    """
+    height = statistics.median(top - bottom for _, _, bottom, _, top, _ in line)
+    cells = []
+    words = [line[0][0]]
+    cell_left, last_right = line[0][1], line[0][3]
+
+    for ch, left, _, right, _, space_before in line[1:]:
+        gap = left - last_right
+        if gap > height * cell_gap:
+            cells.append((cell_left, last_right, "".join(words)))
+            words, cell_left = [ch], left
+        elif space_before or gap > height * word_gap:
+            words.append(" " + ch)
+        else:
+            words.append(ch)
+        last_right = max(last_right, right)
+
+    cells.append((cell_left, last_right, "".join(words)))
+    return cells
+
+
+def _column_spans(rows):
+    """Merge the horizontal extents of all cells into column spans."""
+    spans = []
+    for left, right in sorted((l, r) for row in rows for l, r, _ in row):
+        if spans and left <= spans[-1][1]:
+            spans[-1][1] = max(spans[-1][1], right)
+        else:
+            spans.append([left, right])
+    return spans
+
+
+def table_to_html(rows):
+    """Render rows of cells as the <table> markup parse_html_tables expects."""
+    spans = _column_spans(rows)
+    grid = []
+    for row in rows:
+        values = [""] * len(spans)
+        for left, right, text in row:
+            center = (left + right) / 2
+            column = next(
+                (i for i, (l, r) in enumerate(spans) if l <= center <= r),
+                len(spans) - 1,
+            )
+            values[column] = f"{values[column]} {text}".strip()
+        grid.append([html.escape(v, quote=False) for v in values])
+
+    out = ["<table>", "<thead>"]
+    out.append("<tr>" + "".join(f"<th>{v}</th>" for v in grid[0]) + "</tr>")
+    out += ["</thead>", "<tbody>"]
+    for values in grid[1:]:
+        out.append("<tr>" + "".join(f"<td>{v}</td>" for v in values) + "</tr>")
+    out += ["</tbody>", "</table>"]
+    return out
+
+
+def chars_to_markdown(chars, min_table_rows=2):
+    """
+    Rebuild OCR-style markdown from positioned characters: runs of lines
+    with several cells become HTML tables, everything else plain lines.
+    """
+    out = []
+    table = []
+
+    def flush():
+        if len(table) >= min_table_rows:
+            out.extend(table_to_html(table))
+        else:
+            out.extend(" ".join(text for _, _, text in row) for row in table)
+        table.clear()
+
+    for line in group_lines(chars):
+        cells = split_cells(line)
+        if len(cells) > 1:
+            table.append(cells)
+            continue
+        flush()
+        out.append(cells[0][2])
+    flush()
+
+    return "\n".join(out)
+
+
+def page_text_markdown(page, min_chars=30, max_garbled_ratio=0.05):
+    """
+    Returns a TextLayerMarkdown built from the page's text layer, or None when
+    the page has no usable text layer (scanned, or garbled font encoding) and
+    needs OCR.
+    """
+    chars = read_chars(page)
+    if not is_usable(chars, min_chars=min_chars, max_garbled_ratio=max_garbled_ratio):
+        return None
+    return TextLayerMarkdown(chars_to_markdown(chars))
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import torch
+
+
+def encode_prompt(model, inputs):
+    """
+    Runs the vision tower once and returns generate() inputs with the image
+    features already scattered into `inputs_embeds` (no pixel_values), so
+    generation starts with the first decoder step.
+    """
+    input_ids = inputs["input_ids"]
+    with torch.no_grad():
+        features = model.get_image_features(
+            pixel_values=inputs["pixel_values"], image_sizes=inputs["image_sizes"]
+        )
+        # Newer transformers return a model output with per-image splits
+        features = getattr(features, "pooler_output", features)
+        if isinstance(features, (tuple, list)):
+            features = torch.cat(features, dim=0)
+
+        embeds = model.get_input_embeddings()(input_ids)
+        mask = (input_ids == model.config.image_token_id).unsqueeze(-1)
+        embeds = embeds.masked_scatter(
+            mask.to(embeds.device), features.to(embeds.device, embeds.dtype)
+        )
+    return {
+        "input_ids": input_ids,
+        "attention_mask": inputs["attention_mask"],
+        "inputs_embeds": embeds,
+    }
+
+
+class VisionCache:
+    """
+    In-memory LRU of encode_prompt() results for one model, capped at
+    `max_bytes`. Keys hash the image pixels together with the processor's
+    image settings, so a re-run of the same page skips preprocessing and the
+    vision tower.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (inputs, size)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(image, processor):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{image.mode}:{image.size}".encode())
+        digest.update(image.tobytes())
+        digest.update(processor.image_processor.to_json_string().encode())
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, inputs):
+        size = sum(t.numel() * t.element_size() for t in inputs.values())
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = (inputs, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.bytes -= evicted_size
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
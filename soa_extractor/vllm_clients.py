@@ -0,0 +1,150 @@
+import asyncio
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+# Connections kept open per endpoint (and per event loop for async clients)
+MAX_CONNECTIONS = 32
+KEEPALIVE_EXPIRY_S = 60
+
+# Transient statuses worth another attempt; anything else is the caller's bug
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+_lock = threading.Lock()
+_clients = {}  # endpoint -> OpenAI
+_async_clients = {}  # (event loop, endpoint) -> AsyncOpenAI
+_loop = None
+
+
+def _limits():
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY_S,
+    )
+
+
+def get_client(endpoint):
+    """
+    Process-wide OpenAI client for `endpoint`. Its keep-alive connections are
+    reused by every call and thread, so only the first request pays the
+    TCP (and TLS) setup. Retries are left to create_with_retries().
+    """
+    with _lock:
+        client = _clients.get(endpoint)
+        if client is None:
+            client = openai.OpenAI(
+                base_url=endpoint,
+                api_key="not-needed",
+                max_retries=0,
+                http_client=httpx.Client(limits=_limits()),
+            )
+            _clients[endpoint] = client
+        return client
+
+
+def get_async_client(endpoint):
+    """
+    AsyncOpenAI client for `endpoint` on the running event loop. httpx async
+    connections belong to the loop that opened them, so each loop gets its
+    own pool; background_loop() keeps one loop alive for the process.
+    """
+    loop = asyncio.get_running_loop()
+    with _lock:
+        # Clients of loops that have since closed are dead weight
+        for key in [key for key in _async_clients if key[0].is_closed()]:
+            del _async_clients[key]
+        client = _async_clients.get((loop, endpoint))
+        if client is None:
+            client = openai.AsyncOpenAI(
+                base_url=endpoint,
+                api_key="not-needed",
+                max_retries=0,
+                http_client=httpx.AsyncClient(limits=_limits()),
+            )
+            _async_clients[(loop, endpoint)] = client
+        return client
+
+
+def background_loop():
+    """A process-wide event loop on a daemon thread, for calls from sync code."""
+    global _loop
+    with _lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="vllm-clients", daemon=True).start()
+        return _loop
+
+
+def is_retryable(error):
+    # APIConnectionError covers timeouts and refused or dropped connections
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code in RETRY_STATUS
+
+
+def retry_delay(attempt, base_delay=0.5, max_delay=8.0):
+    # "Full jitter": uniform up to the capped exponential backoff, so
+    # callers that failed together do not all come back together
+    return random.uniform(0, min(max_delay, base_delay * 2**attempt))
+
+
+def create_with_retries(client, retries=3, base_delay=0.5, max_delay=8.0, **kwargs):
+    """
+    client.chat.completions.create(**kwargs), retried with jittered
+    exponential backoff on connection errors, timeouts and transient
+    statuses. With stream=True only opening the stream is retried; an error
+    after tokens have arrived is raised to the caller.
+    """
+    for attempt in range(retries + 1):
+        try:
+            return client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = retry_delay(attempt, base_delay, max_delay)
+            print(f"vLLM request failed ({type(e).__name__}), retry {attempt + 1}/{retries} in {delay:.2f}s")
+            time.sleep(delay)
+
+
+async def acreate_with_retries(client, retries=3, base_delay=0.5, max_delay=8.0, **kwargs):
+    """Async create_with_retries() for an AsyncOpenAI client."""
+    for attempt in range(retries + 1):
+        try:
+            return await client.chat.completions.create(**kwargs)
+        except Exception as e:
+            if attempt == retries or not is_retryable(e):
+                raise
+            delay = retry_delay(attempt, base_delay, max_delay)
+            print(f"vLLM request failed ({type(e).__name__}), retry {attempt + 1}/{retries} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+async def acomplete_many(requests, max_concurrency=8, retries=3):
+    """
+    Sends non-streaming chat completions concurrently, at most
+    `max_concurrency` in flight. Each request is a dict with an "endpoint"
+    and the create() keyword arguments. Returns, in order, the message text
+    or the exception that request ended with.
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def complete(request):
+        request = dict(request)
+        client = get_async_client(request.pop("endpoint"))
+        async with semaphore:
+            response = await acreate_with_retries(client, retries=retries, **request)
+        return response.choices[0].message.content
+
+    return await asyncio.gather(*(complete(r) for r in requests), return_exceptions=True)
+
+
+def complete_many(requests, max_concurrency=8, retries=3):
+    """acomplete_many() from sync code, on the shared background loop."""
+    future = asyncio.run_coroutine_threadsafe(
+        acomplete_many(requests, max_concurrency, retries), background_loop()
+    )
+    return future.result()
@@ -0,0 +1,53 @@
+"""
+RepetitionCheck's count of empty table cells at the end of the output,
+which runs every `check_every` tokens while a page decodes. Needs torch and
+transformers; skipped without them.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from soa_extractor.ocr_stopping import RepetitionCheck
+
+ROW = "<tr>" + "<td></td>" * 8 + "</tr>\n"
+
+
+@pytest.mark.parametrize(
+    "text, cells",
+    [
+        ("", 0),
+        ("| a | b |", 0),
+        ("<td></td>", 1),
+        ("<td>x</td><td> </td>", 1),
+        ("<td></td>\n</tr>\n<tr><td></td>  <td>", 3),
+        ("<td></td><td></td></tr><t", 2),
+        ("<td>", 0),
+        ("<td>x</td>", 0),
+        ("<td></td>x", 0),
+        (ROW * 3, 24),
+    ],
+)
+def test_trailing_empty_cells(text, cells):
+    assert RepetitionCheck.trailing_empty_cells(text) == cells
+
+
+def test_near_miss_tail_is_cheap():
+    # Empty rows that end in a filled cell: a backtracking pattern retries
+    # every earlier start, a backwards scan stops at once
+    tail = ((ROW * 25) + "<td>x")[-2048:]
+
+    start_time = time.perf_counter()
+    for _ in range(1000):
+        assert RepetitionCheck.trailing_empty_cells(tail) == 0
+    assert time.perf_counter() - start_time < 0.5
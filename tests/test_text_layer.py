@@ -0,0 +1,105 @@
+"""
+Round trip from the PDF text layer to SOA records: tables rebuilt by
+soa_extractor.text_layer must come back, row by row, from
+soa_extractor.run.parse_markdown_table_to_records, while OCR'd pages keep
+being parsed for pipe tables only.
+
+Usage:
+    python -m pytest tests
+"""
+
+import os
+import pickle
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytest.importorskip("pypdfium2")
+pytest.importorskip("jinja2")
+
+from soa_extractor.run import parse_markdown_table_to_records
+from soa_extractor.text_layer import TextLayerMarkdown, chars_to_markdown
+
+CHAR_WIDTH = 5.0
+LINE_HEIGHT = 10.0
+
+
+def line_chars(cells, top):
+    """Characters of one line: `cells` is [(left, text), ...] in canvas units."""
+    chars = []
+    for left, text in cells:
+        x, space_before = left, False
+        for ch in text:
+            if ch == " ":
+                space_before = True
+                x += CHAR_WIDTH
+                continue
+            chars.append((ch, x, top - LINE_HEIGHT, x + CHAR_WIDTH, top, space_before))
+            space_before = False
+            x += CHAR_WIDTH
+    return chars
+
+
+def page_chars(lines):
+    chars = []
+    for number, cells in enumerate(lines):
+        chars += line_chars(cells, top=800 - number * 2 * LINE_HEIGHT)
+    return chars
+
+
+def test_text_layer_table_rows_become_records():
+    rows = [
+        ["Date", "Description", "Amount"],
+        ["01/02/2025", "Buy AAPL", "1,250.00"],
+        ["03/02/2025", "Sell & settle", "-300.50"],
+    ]
+    columns = [50, 200, 400]
+    lines = [[(50, "Statement of Account")]]
+    lines += [list(zip(columns, row)) for row in rows]
+    lines += [[(50, "End of statement")]]
+
+    markdown = chars_to_markdown(page_chars(lines))
+    records = parse_markdown_table_to_records(markdown, html_tables=True)
+
+    assert "<table>" in markdown
+    assert records == ["| " + " | ".join(row) + " |" for row in rows]
+
+
+MIXED_PAGE = "\n".join(
+    [
+        "| a | b |",
+        "|---|---|",
+        "| 1 | 2 |",
+        "<table><thead><tr><th>c</th><th>d</th></tr></thead>",
+        "<tbody><tr><td>3 &amp; 4</td><td>x<br>y</td></tr><tr><td></td><td></td></tr></tbody></table>",
+        "| 5 | 6 |",
+    ]
+)
+
+
+def test_text_layer_page_keeps_pipe_and_html_rows_in_order():
+    assert parse_markdown_table_to_records(MIXED_PAGE, html_tables=True) == [
+        "| a | b |",
+        "| 1 | 2 |",
+        "| c | d |",
+        "| 3 & 4 | x y |",
+        "| 5 | 6 |",
+    ]
+
+
+def test_ocr_page_reads_pipe_tables_only():
+    assert parse_markdown_table_to_records(MIXED_PAGE) == [
+        "| a | b |",
+        "| 1 | 2 |",
+        "| 5 | 6 |",
+    ]
+
+
+def test_text_layer_markdown_survives_worker_processes():
+    # Render and OCR workers pickle page markdown back to the parent
+    markdown = pickle.loads(pickle.dumps(TextLayerMarkdown(MIXED_PAGE)))
+
+    assert isinstance(markdown, TextLayerMarkdown)
+    assert markdown == MIXED_PAGE
@@ -0,0 +1,141 @@
+"""
+soa_extractor.vllm_clients against the stub server in
+benchmarks/stub_openai_server.py: keep-alive connection reuse, retries on
+503 and ordered async fan-out. Needs the optional openai and httpx
+packages; skipped without them.
+
+Usage:
+    python -m pytest tests
+"""
+
+import json
+import os
+import sys
+import threading
+import urllib.request
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+pytest.importorskip("httpx")
+openai = pytest.importorskip("openai")
+
+from soa_extractor.vllm_clients import complete_many, create_with_retries, get_client
+from stub_openai_server import TEXT, serve
+
+# Retries in these tests wait milliseconds, not seconds
+FAST_RETRY = dict(base_delay=0.001, max_delay=0.01)
+
+
+@pytest.fixture
+def stub(request):
+    """Starts a stub server with the given options; returns its endpoint."""
+
+    def start(**options):
+        options.setdefault("latency_s", 0.005)
+        server, endpoint = serve(**options)
+        request.addfinalizer(server.shutdown)
+        return endpoint
+
+    return start
+
+
+def stats(endpoint):
+    with urllib.request.urlopen(endpoint + "/stats", timeout=5) as response:
+        counts = json.loads(response.read())
+    # Not counting the connection this /stats request came in on
+    counts["connections"] -= 1
+    return counts
+
+
+def page_request(max_tokens=256):
+    return dict(
+        model="stub",
+        messages=[{"role": "user", "content": [{"type": "text", "text": "page"}]}],
+        max_tokens=max_tokens,
+        temperature=0.0,
+        timeout=30,
+    )
+
+
+def test_pooled_client_reuses_one_connection(stub):
+    endpoint = stub()
+    client = get_client(endpoint)
+    assert get_client(endpoint) is client
+
+    for _ in range(30):
+        response = create_with_retries(client, retries=0, **page_request())
+        assert response.choices[0].message.content == TEXT
+
+    counts = stats(endpoint)
+    assert counts["requests"] == 30
+    assert counts["connections"] == 1
+
+
+def test_pooled_client_connections_bounded_by_threads(stub):
+    endpoint = stub(latency_s=0.02)
+    client = get_client(endpoint)
+    errors = []
+
+    def worker():
+        try:
+            for _ in range(10):
+                create_with_retries(client, retries=0, **page_request())
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    counts = stats(endpoint)
+    assert counts["requests"] == 40
+    assert counts["connections"] <= 4
+
+
+def test_retries_recover_every_page_from_503s(stub):
+    endpoint = stub(fail_rate=0.3, seed=0)
+    client = get_client(endpoint)
+
+    texts = [
+        create_with_retries(client, retries=3, **FAST_RETRY, **page_request()).choices[0].message.content
+        for _ in range(40)
+    ]
+
+    assert texts == [TEXT] * 40
+    counts = stats(endpoint)
+    assert counts["failures"] > 0
+    assert counts["requests"] == 40 + counts["failures"]
+    # 503 responses do not cost the kept-alive connection
+    assert counts["connections"] == 1
+
+
+def test_retries_give_up_after_the_limit(stub):
+    endpoint = stub(fail_rate=1.0)
+
+    with pytest.raises(openai.APIStatusError) as error:
+        create_with_retries(get_client(endpoint), retries=2, **FAST_RETRY, **page_request())
+
+    assert error.value.status_code == 503
+    assert stats(endpoint)["requests"] == 3
+
+
+def test_complete_many_keeps_input_order(stub):
+    # Jittered latency makes responses finish out of order
+    endpoint = stub(latency_s=0.01, latency_jitter_s=0.05, seed=1)
+    words = TEXT.split(" ")
+    # The stub answers with the first max_tokens words, so each result
+    # identifies its request
+    requests = [dict(page_request(max_tokens=n), endpoint=endpoint) for n in range(1, len(words) + 1)]
+
+    results = complete_many(requests, max_concurrency=8, retries=0)
+
+    assert results == [" ".join(words[:n]) for n in range(1, len(words) + 1)]
+    counts = stats(endpoint)
+    assert counts["requests"] == len(requests)
+    assert counts["connections"] <= 8